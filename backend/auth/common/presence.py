@@ -0,0 +1,69 @@
+"""Присутствие пользователей: отметки активности в UNLOGGED-таблице presence вместо записи в users
+
+Пользователь онлайн, если его отметка моложе PRESENCE_TTL. Повторная отметка из того же экземпляра
+раньше HEARTBEAT_MIN_INTERVAL до БД не доходит. users.last_seen пишется пачками из presence
+скриптом backend/messages/presence.py, он же удаляет истёкшие отметки.
+"""
+import os
+from common.cache import TTLCache
+
+SCHEMA = 't_p33435224_messenger_api_modern'
+PRESENCE_TTL = int(os.environ.get('PRESENCE_TTL', '60'))
+HEARTBEAT_MIN_INTERVAL = float(os.environ.get('PRESENCE_HEARTBEAT_INTERVAL', '20'))
+
+_recent = TTLCache(10000, HEARTBEAT_MIN_INTERVAL)
+
+TOUCH_SQL = f"""
+    INSERT INTO {SCHEMA}.presence (user_id, seen_at)
+    SELECT unnest(%s::int[]), NOW()
+    ON CONFLICT (user_id) DO UPDATE SET seen_at = EXCLUDED.seen_at
+"""
+
+def join(user_alias: str) -> str:
+    """LEFT JOIN отметок к таблице users под псевдонимом user_alias"""
+    return f"LEFT JOIN {SCHEMA}.presence p ON p.user_id = {user_alias}.id"
+
+def columns(user_alias: str) -> str:
+    """is_online и last_seen с учётом ещё не сброшенной в users отметки"""
+    return (
+        f"COALESCE(p.seen_at > NOW() - INTERVAL '{PRESENCE_TTL} seconds', FALSE) as is_online, "
+        f"GREATEST({user_alias}.last_seen, p.seen_at) as last_seen"
+    )
+
+def heartbeat(req) -> bool:
+    """Отмечает автора запроса активным; False, если отметка из этого экземпляра ещё свежая"""
+    if _recent.get(req.user_id):
+        return False
+    req.cur.execute(TOUCH_SQL, ([req.user_id],))
+    req.conn.commit()
+    _recent.set(req.user_id, True)
+    return True
+
+def flush(conn, granularity: int) -> dict:
+    """Переносит отметки в users.last_seen и удаляет истёкшие
+
+    Строка users переписывается, только если отметка ушла вперёд больше чем на granularity секунд
+    или истекла, поэтому активный пользователь обновляет горячую таблицу не чаще раза в granularity.
+    """
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            WITH flushed AS (
+                UPDATE {SCHEMA}.users u SET last_seen = p.seen_at
+                FROM {SCHEMA}.presence p
+                WHERE u.id = p.user_id
+                  AND (
+                      u.last_seen IS NULL
+                      OR u.last_seen < p.seen_at - %(granularity)s * INTERVAL '1 second'
+                      OR (p.seen_at < NOW() - %(ttl)s * INTERVAL '1 second' AND u.last_seen < p.seen_at)
+                  )
+                RETURNING u.id
+            ), expired AS (
+                DELETE FROM {SCHEMA}.presence
+                WHERE seen_at < NOW() - %(ttl)s * INTERVAL '1 second'
+                RETURNING user_id
+            )
+            SELECT (SELECT COUNT(*) FROM flushed), (SELECT COUNT(*) FROM expired)
+        """, {'granularity': granularity, 'ttl': PRESENCE_TTL})
+        flushed, expired = cur.fetchone()
+    conn.commit()
+    return {'flushed': flushed, 'expired': expired}
@@ -0,0 +1,215 @@
+"""Инструментирование запросов: время и строки по каждому SQL-оператору, структурные логи и метрики Prometheus
+
+Курсор из cursor_factory() замеряет каждый execute и относит его к трассе текущего запроса.
+По завершении запроса в stdout пишется одна JSON-строка; операторы дольше SLOW_QUERY_MS
+логируются отдельно, а SELECT и WITH из них с вероятностью EXPLAIN_SAMPLE_RATE повторяются
+под EXPLAIN (ANALYZE, BUFFERS) в откатываемом read-only savepoint.
+"""
+import contextvars
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from functools import lru_cache
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '200'))
+EXPLAIN_SAMPLE_RATE = float(os.environ.get('EXPLAIN_SAMPLE_RATE', '0'))
+REQUEST_LOG = os.environ.get('REQUEST_LOG', '1') != '0'
+METRICS_DUMP_INTERVAL = float(os.environ.get('METRICS_DUMP_INTERVAL', '0'))
+# Кэшируются только тексты не длиннее этого: шаблоны операторов повторяются, а execute_values
+# присылает уже подставленные значения, каждый раз новый текст на мегабайты
+NORMALIZE_CACHE_MAX_SQL = 4096
+
+_current = contextvars.ContextVar('request_trace', default=None)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_VALUE_LISTS = re.compile(r'\((?:\s*\?\s*,)*\s*\?\s*\)(?:\s*,\s*\((?:\s*\?\s*,)*\s*\?\s*\))+')
+_SPACES = re.compile(r'\s+')
+
+def normalize(sql: str) -> str:
+    """Текст оператора без литералов и с одной группой VALUES вместо многих"""
+    if len(sql) <= NORMALIZE_CACHE_MAX_SQL:
+        return _normalize_cached(sql)
+    return _normalize(sql)
+
+def _normalize(sql: str) -> str:
+    sql = _LITERALS.sub('?', sql)
+    sql = _SPACES.sub(' ', sql).strip()
+    return _VALUE_LISTS.sub('(...)', sql)
+
+_normalize_cached = lru_cache(maxsize=1024)(_normalize)
+
+def fingerprint(sql: str) -> tuple:
+    normalized = normalize(sql)
+    return hashlib.sha1(normalized.encode()).hexdigest()[:12], normalized
+
+def log(event: str, **fields):
+    print(json.dumps({'event': event, 'ts': round(time.time(), 3), **fields}, ensure_ascii=False, default=str), flush=True)
+
+class RequestTrace:
+    __slots__ = ('route', 'method', 'started', 'checkout_ms', 'queries', 'db_ms', 'rows')
+
+    def __init__(self, route: str, method: str):
+        self.route = route
+        self.method = method
+        self.started = time.perf_counter()
+        self.checkout_ms = 0.0
+        self.queries = 0
+        self.db_ms = 0.0
+        self.rows = 0
+
+class Registry:
+    """Накопленные метрики процесса для выгрузки в формате Prometheus"""
+
+    def __init__(self):
+        self.requests = {}
+        self.statements = {}
+        self.queries_total = 0
+        self._lock = threading.Lock()
+        self._last_dump = time.monotonic()
+
+    def observe_request(self, route: str, status: int, seconds: float, checkout_seconds: float):
+        with self._lock:
+            item = self.requests.setdefault((route, status), [0, 0.0, 0.0])
+            item[0] += 1
+            item[1] += seconds
+            item[2] += checkout_seconds
+
+    def observe_statement(self, fp: str, sql: str, seconds: float, rows: int):
+        with self._lock:
+            self.queries_total += 1
+            item = self.statements.setdefault(fp, [0, 0.0, 0, sql])
+            item[0] += 1
+            item[1] += seconds
+            item[2] += max(rows, 0)
+
+    def render_prometheus(self, pool: dict = None) -> str:
+        with self._lock:
+            requests = sorted(self.requests.items())
+            statements = sorted(self.statements.items())
+        families = [
+            ('messenger_requests_total', [(f'route="{r}",status="{s}"', v[0]) for (r, s), v in requests]),
+            ('messenger_request_seconds_total', [(f'route="{r}",status="{s}"', f'{v[1]:.6f}') for (r, s), v in requests]),
+            ('messenger_db_checkout_seconds_total', [(f'route="{r}",status="{s}"', f'{v[2]:.6f}') for (r, s), v in requests]),
+            ('messenger_db_statements_total', [(f'fingerprint="{fp}"', v[0]) for fp, v in statements]),
+            ('messenger_db_statement_seconds_total', [(f'fingerprint="{fp}"', f'{v[1]:.6f}') for fp, v in statements]),
+            ('messenger_db_statement_rows_total', [(f'fingerprint="{fp}"', v[2]) for fp, v in statements]),
+        ]
+        lines = []
+        for name, samples in families:
+            lines.append(f'# TYPE {name} counter')
+            lines += [f'{name}{{{labels}}} {value}' for labels, value in samples]
+        for key, value in sorted((pool or {}).items()):
+            lines.append(f'# TYPE messenger_db_pool_{key} gauge')
+            lines.append(f'messenger_db_pool_{key} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def maybe_dump(self, pool: dict = None):
+        if METRICS_DUMP_INTERVAL <= 0 or time.monotonic() - self._last_dump < METRICS_DUMP_INTERVAL:
+            return
+        self._last_dump = time.monotonic()
+        print(self.render_prometheus(pool), flush=True)
+
+registry = Registry()
+
+def begin(route: str, method: str) -> RequestTrace:
+    trace = RequestTrace(route, method)
+    _current.set(trace)
+    return trace
+
+def end(trace: RequestTrace, status: int, pool=None):
+    _current.set(None)
+    seconds = time.perf_counter() - trace.started
+    registry.observe_request(trace.route, status, seconds, trace.checkout_ms / 1000)
+    pool_snapshot = pool.snapshot() if pool is not None else None
+    if REQUEST_LOG:
+        log(
+            'request',
+            route=trace.route,
+            method=trace.method,
+            status=status,
+            duration_ms=round(seconds * 1000, 3),
+            db_checkout_ms=round(trace.checkout_ms, 3),
+            db_ms=round(trace.db_ms, 3),
+            queries=trace.queries,
+            rows=trace.rows,
+        )
+    registry.maybe_dump(pool_snapshot)
+
+def record_checkout(seconds: float):
+    trace = _current.get()
+    if trace is not None:
+        trace.checkout_ms += seconds * 1000
+
+def _observe(cursor, query, params, seconds: float):
+    sql = query.decode() if isinstance(query, bytes) else str(query)
+    fp, normalized = fingerprint(sql)
+    rows = cursor.rowcount
+    registry.observe_statement(fp, normalized, seconds, rows)
+
+    trace = _current.get()
+    if trace is not None:
+        trace.queries += 1
+        trace.db_ms += seconds * 1000
+        trace.rows += max(rows, 0)
+
+    if seconds * 1000 < SLOW_QUERY_MS:
+        return
+    fields = {'fingerprint': fp, 'sql': normalized[:500], 'duration_ms': round(seconds * 1000, 3), 'rows': rows,
+              'route': trace.route if trace else None}
+    if EXPLAIN_SAMPLE_RATE > 0 and random.random() < EXPLAIN_SAMPLE_RATE and normalized.upper().startswith(('SELECT', 'WITH')):
+        plan = _explain(cursor.connection, query, params)
+        if plan is not None:
+            fields['plan'] = plan
+    log('slow_query', **fields)
+
+def _explain(conn, query, params):
+    """EXPLAIN ANALYZE повторяет запрос, поэтому выполняется в read-only savepoint, который всегда откатывается
+
+    Изменяет ли оператор данные, решает не первое слово, а сам Postgres: INSERT/UPDATE/DELETE,
+    в том числе в CTE, и nextval() отклоняются в read-only транзакции до выполнения. Откат
+    возвращает и режим транзакции, и всё, что запрос успел сделать (pg_notify, блокировки savepoint).
+    Только если транзакция исправна: после ошибки в ней любой оператор, включая SAVEPOINT, упадёт.
+    """
+    import psycopg2
+    from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+    if conn.get_transaction_status() not in (TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS):
+        return None
+    # В autocommit своей транзакции нет, открываем и откатываем отдельную
+    begin, rollback = (
+        ('BEGIN READ ONLY', 'ROLLBACK') if conn.autocommit
+        else ('SAVEPOINT explain_sample', 'ROLLBACK TO SAVEPOINT explain_sample')
+    )
+    with conn.cursor() as cur:
+        cur.execute(begin)
+        try:
+            if not conn.autocommit:
+                cur.execute('SET TRANSACTION READ ONLY')
+            cur.execute(b'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + cur.mogrify(query, params))
+            return cur.fetchone()[0]
+        except psycopg2.Error as e:
+            return {'error': str(e).strip()}
+        finally:
+            cur.execute(rollback)
+
+_cursor_class = None
+
+def cursor_factory():
+    """Класс курсора с замерами; psycopg2 импортируется только при первом обращении"""
+    global _cursor_class
+    if _cursor_class is None:
+        from psycopg2.extras import RealDictCursor
+
+        class InstrumentedCursor(RealDictCursor):
+            def execute(self, query, vars=None):
+                started = time.perf_counter()
+                try:
+                    return super().execute(query, vars)
+                finally:
+                    _observe(self, query, vars, time.perf_counter() - started)
+
+        _cursor_class = InstrumentedCursor
+    return _cursor_class
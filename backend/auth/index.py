@@ -1,139 +1,257 @@
-import json
 import os
+import sys
 import hashlib
 import secrets
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import time
 
-def handler(event: dict, context) -> dict:
-    """API для регистрации, авторизации по телефону/username и управления пользователями"""
+# common — копия backend/common (backend/vendor_common.py): каталог функции разворачивается отдельно
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import presence, profiles
+from common.auth import AUTH_DEV_MODE, issue_token, require_configured, verify_phone_proof
+from common.ratelimit import Limit, check, throttled
+from passwords import check_password
+from common.cache import TTLCache
+from common.http import Router, respond, respond_raw, error
+from common.jsonenc import dumps
+
+SEARCH_LIMIT = 20
+PROFILE_MAX_LENGTH = {'username': 50, 'full_name': 100, 'avatar_url': 500}
+SEARCH_CACHE_SIZE = int(os.environ.get('USER_SEARCH_CACHE_SIZE', '256'))
+SEARCH_CACHE_TTL = float(os.environ.get('USER_SEARCH_CACHE_TTL', '10'))
+
+PASSWORD_PER_USERNAME = Limit('login_password_user', 10, 600)
+PASSWORD_PER_IP = Limit('login_password_ip', 30, 600)
+
+IDEMPOTENCY_CACHE_SIZE = 1024
+IDEMPOTENCY_TTL = float(os.environ.get('AUTH_IDEMPOTENCY_TTL', '600'))
+# Пароли не используются, у всех пользователей хэш пустой строки
+EMPTY_PASSWORD_HASH = hashlib.sha256(b'').hexdigest()
+USER_COLUMNS = 'id, username, full_name, phone, is_admin, avatar_url, suspended_at IS NOT NULL as suspended'
+
+_search_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+# Ответы на повторы входа с тем же Idempotency-Key; сам вход тоже идемпотентен, повтор в другом экземпляре найдёт пользователя
+_idempotent_responses = TTLCache(IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL)
+
+router = Router('GET, POST, PUT, OPTIONS', 'Content-Type, X-Auth-Token, X-User-Id, Idempotency-Key')
+
+def escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def search_users(cur, query: str) -> list:
+    """Поиск по username/имени через pg_trgm и по префиксу телефона; точное совпадение username выше префиксного, префиксное выше нечёткого"""
+    params = {
+        'q': query,
+        'prefix': escape_like(query.lower()) + '%',
+        'contains': '%' + escape_like(query) + '%',
+        'limit': SEARCH_LIMIT,
+    }
+    if len(query) < 3:
+        # Триграммный индекс бесполезен для коротких строк, хватает префикса по username
+        conditions = ["lower(username) LIKE %(prefix)s"]
+    else:
+        conditions = [
+            "username ILIKE %(contains)s",
+            "full_name ILIKE %(contains)s",
+            "username %% %(q)s",
+            "full_name %% %(q)s",
+        ]
+    if query.lstrip('+').isdigit():
+        params['phone_prefix'] = escape_like(query) + '%'
+        conditions.append("phone LIKE %(phone_prefix)s")
+
+    cur.execute(
+        f"""SELECT u.id, username, full_name, phone, avatar_url, {presence.columns('u')}
+           FROM t_p33435224_messenger_api_modern.users u
+           {presence.join('u')}
+           WHERE ({' OR '.join(conditions)}) AND suspended_at IS NULL
+           ORDER BY
+               lower(username) = lower(%(q)s) DESC,
+               lower(username) LIKE %(prefix)s DESC,
+               GREATEST(similarity(username, %(q)s), similarity(COALESCE(full_name, ''), %(q)s)) DESC,
+               id
+           LIMIT %(limit)s""",
+        params
+    )
+    return cur.fetchall()
+
+def find_or_create_user(cur, phone: str, username: str, full_name: str, match_username: bool = True):
+    """Вход или регистрация одним запросом; None, если пользователя создал параллельный запрос с другими данными
+
+    match_username=False ищет только по телефону, username нужен лишь для новой учётной записи.
+    """
+    params = {
+        'phone': phone or None,
+        'username': username or None,
+        'new_username': username or phone or f'user_{secrets.token_hex(4)}',
+        'full_name': full_name,
+        'password_hash': EMPTY_PASSWORD_HASH,
+    }
+    # Два зонда по уникальным индексам вместо OR по двум колонкам
+    lookups = []
+    if phone:
+        lookups.append(f"(SELECT {USER_COLUMNS} FROM t_p33435224_messenger_api_modern.users WHERE phone = %(phone)s)")
+    if username and match_username:
+        lookups.append(f"(SELECT {USER_COLUMNS} FROM t_p33435224_messenger_api_modern.users WHERE username = %(username)s)")
+    lookup = f"{' UNION ALL '.join(lookups)} LIMIT 1"
+
+    cur.execute(f"""
+        WITH existing AS (
+            {lookup}
+        ), created AS (
+            INSERT INTO t_p33435224_messenger_api_modern.users (username, phone, full_name, password_hash)
+            SELECT %(new_username)s, %(phone)s, %(full_name)s, %(password_hash)s
+            WHERE NOT EXISTS (SELECT 1 FROM existing)
+            ON CONFLICT DO NOTHING
+            RETURNING {USER_COLUMNS}
+        )
+        SELECT *, FALSE as created FROM existing
+        UNION ALL
+        SELECT *, TRUE as created FROM created
+    """, params)
+    user = cur.fetchone()
+    if user is None:
+        # Гонка регистраций: вставка уступила параллельной, её строка уже видна новому запросу
+        cur.execute(f"SELECT *, FALSE as created FROM ({lookup}) u", params)
+        user = cur.fetchone()
+    return user
+
+def consume_phone_proof(cur, proof: dict) -> bool:
+    """Гасит подтверждение телефона; False, если им уже входили"""
+    cur.execute("""
+        INSERT INTO t_p33435224_messenger_api_modern.phone_proof_uses (nonce, expires_at)
+        VALUES (%s, NOW() + %s * INTERVAL '1 second')
+        ON CONFLICT DO NOTHING
+        RETURNING nonce
+    """, (proof['nonce'], max(proof['exp'] - time.time(), 0)))
+    return cur.fetchone() is not None
+
+@router.route('POST', when=lambda req: 'password' in req.body)
+def password_login(req):
+    """Вход по username и паролю для учётных записей без телефона; пароль задаёт backend/auth/passwords.py"""
+    require_configured()
+    username = req.body.get('username', '')
+    password = req.body.get('password', '')
+    if not isinstance(username, str) or not isinstance(password, str) or not username.strip() or not password:
+        return error(400, 'username and password required')
+    username = username.strip()
+
+    retry_after = check(req, [(PASSWORD_PER_USERNAME, username.lower()), (PASSWORD_PER_IP, req.client_ip)])
+    if retry_after:
+        return throttled(retry_after)
+
+    req.cur.execute(f"""
+        SELECT {USER_COLUMNS}, password_hash
+        FROM t_p33435224_messenger_api_modern.users
+        WHERE username = %s
+    """, (username,))
+    user = req.cur.fetchone()
+    # Списанные попытки сохраняются и при неверном пароле
+    req.conn.commit()
+
+    if not user or not check_password(user.pop('password_hash'), password):
+        return error(401, 'Invalid username or password')
+    if user.pop('suspended'):
+        return error(403, 'Account suspended')
+    return respond(200, {'user': user, 'token': issue_token(user)})
+
+@router.route('POST')
+def login(req):
+    """Вход по телефону или username; новый пользователь регистрируется
+
+    Вход только по подтверждённому телефону: phone_token из sms должен подтверждать переданный
+    phone и ещё не использоваться, username нужен лишь при регистрации. Учётные записи без
+    телефона входят паролем (password_login). На локальном стенде (AUTH_DEV_MODE) вход
+    по username или телефону без подтверждения.
+    """
+    require_configured()
+    phone = req.body.get('phone', '').strip()
+    username = req.body.get('username', '').strip()
+    full_name = req.body.get('full_name', '')
     
-    method = event.get('httpMethod', 'GET')
+    if not phone and not username:
+        return error(400, 'Phone or username required')
+    proof = None
+    if not AUTH_DEV_MODE:
+        proof = verify_phone_proof(req.body.get('phone_token'))
+        if not phone or not proof or proof['phone'] != phone:
+            return error(401, 'Phone verification required')
     
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+    idempotency_key = req.headers.get('idempotency-key')
+    cache_key = (idempotency_key, phone, username, full_name, req.body.get('phone_token')) if idempotency_key else None
+    if cache_key:
+        cached = _idempotent_responses.get(cache_key)
+        if cached:
+            return cached
     
-    dsn = os.environ.get('DATABASE_URL')
-    if not dsn:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Database not configured'}),
-            'isBase64Encoded': False
-        }
+    if proof and not consume_phone_proof(req.cur, proof):
+        return error(401, 'Phone verification already used')
+    user = find_or_create_user(req.cur, phone, username, full_name, match_username=AUTH_DEV_MODE)
+    if not user:
+        # Подтверждение остаётся непогашенным, с ним можно повторить вход с другим username
+        req.conn.rollback()
+        return error(409, 'Username or phone already exists')
+    req.conn.commit()
     
-    conn = psycopg2.connect(dsn)
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    if user.pop('suspended'):
+        return error(403, 'Account suspended')
     
-    try:
-        qsp = event.get('queryStringParameters', {}) or {}
-        
-        if method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            phone = body.get('phone', '').strip()
-            username = body.get('username', '').strip()
-            full_name = body.get('full_name', '')
-            
-            if not phone and not username:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Phone or username required'}),
-                    'isBase64Encoded': False
-                }
-            
-            cur.execute(
-                "SELECT id, username, full_name, phone, is_admin, avatar_url FROM t_p33435224_messenger_api_modern.users WHERE phone = %s OR username = %s",
-                (phone, username)
-            )
-            existing_user = cur.fetchone()
-            
-            if existing_user:
-                token = secrets.token_urlsafe(32)
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'user': dict(existing_user),
-                        'token': token
-                    }),
-                    'isBase64Encoded': False
-                }
-            
-            try:
-                cur.execute(
-                    """INSERT INTO t_p33435224_messenger_api_modern.users 
-                       (username, phone, full_name, password_hash) 
-                       VALUES (%s, %s, %s, %s) 
-                       RETURNING id, username, phone, full_name, is_admin, avatar_url""",
-                    (username or phone or f'user_{secrets.token_hex(4)}', phone or None, full_name, hashlib.sha256(b'').hexdigest())
-                )
-                user = cur.fetchone()
-                conn.commit()
-                
-                token = secrets.token_urlsafe(32)
-                
-                return {
-                    'statusCode': 201,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'user': dict(user),
-                        'token': token
-                    }),
-                    'isBase64Encoded': False
-                }
-            except psycopg2.IntegrityError as e:
-                conn.rollback()
-                return {
-                    'statusCode': 409,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Username or phone already exists'}),
-                    'isBase64Encoded': False
-                }
-        
-        elif method == 'GET' and qsp.get('q'):
-            query = qsp.get('q', '').strip()
-            
-            if not query:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Search query required'}),
-                    'isBase64Encoded': False
-                }
-            
-            cur.execute(
-                """SELECT id, username, full_name, phone, avatar_url, is_online 
-                   FROM t_p33435224_messenger_api_modern.users 
-                   WHERE username ILIKE %s OR full_name ILIKE %s OR phone ILIKE %s 
-                   LIMIT 20""",
-                (f'%{query}%', f'%{query}%', f'%{query}%')
-            )
-            users = cur.fetchall()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'users': [dict(u) for u in users]}),
-                'isBase64Encoded': False
-            }
-        
-        return {
-            'statusCode': 404,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Endpoint not found'}),
-            'isBase64Encoded': False
-        }
+    created = user.pop('created')
+    response = respond(201 if created else 200, {'user': user, 'token': issue_token(user)})
+    if cache_key:
+        _idempotent_responses.set(cache_key, response)
+    return response
+
+@router.route('GET', when=lambda req: req.query.get('q'))
+def search(req):
+    query = req.query.get('q', '').strip()
+    
+    if not query:
+        return error(400, 'Search query required')
     
-    finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+    cache_key = query.lower()
+    body = _search_cache.get(cache_key)
+    if body is None:
+        body = dumps({'users': search_users(req.cur, query)})
+        _search_cache.set(cache_key, body)
+    
+    return respond_raw(200, body)
+
+@router.route('PUT', auth=True)
+def update_profile(req):
+    """Изменение username, full_name или avatar_url; новая версия профиля сразу попадает в кэш профилей"""
+    changes = {field: req.body[field] for field in profiles.PROFILE_FIELDS if field in req.body}
+    if not changes:
+        return error(400, 'Nothing to update')
+    for field, value in changes.items():
+        if value is not None and (not isinstance(value, str) or len(value) > PROFILE_MAX_LENGTH[field]):
+            return error(400, f'{field} must be a string up to {PROFILE_MAX_LENGTH[field]} characters')
+    if 'username' in changes:
+        changes['username'] = (changes['username'] or '').strip()
+        if not changes['username']:
+            return error(400, 'username cannot be empty')
+
+    from psycopg2 import IntegrityError
+    cur = req.cur
+    try:
+        cur.execute(f"""
+            UPDATE t_p33435224_messenger_api_modern.users
+            SET {', '.join(f'{field} = %s' for field in changes)}, profile_version = profile_version + 1
+            WHERE id = %s
+            RETURNING id, profile_version as version, {', '.join(profiles.PROFILE_FIELDS)}
+        """, (*changes.values(), req.user_id))
+        profile = cur.fetchone()
+        req.conn.commit()
+    except IntegrityError:
+        req.conn.rollback()
+        return error(409, 'Username already exists')
+
+    if not profile:
+        return error(404, 'User not found')
+    profiles.store([dict(profile)])
+    _search_cache.clear()
+    return respond(200, {'user': profile})
+
+def handler(event: dict, context) -> dict:
+    """API для регистрации, авторизации по телефону/username и управления пользователями"""
+    return router(event, context)
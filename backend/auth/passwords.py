@@ -0,0 +1,71 @@
+"""Пароли для входа без телефона (например, администратор из V0001) и установка пароля из консоли
+
+Хэш: pbkdf2_sha256$итерации$соль$ключ. Другие значения password_hash (хэш пустой строки у
+зарегистрированных по телефону, заглушки из V0001) паролем не считаются, вход по ним невозможен.
+
+Запуск: DATABASE_URL=postgres://... python backend/auth/passwords.py --username admin
+"""
+import argparse
+import base64
+import getpass
+import hashlib
+import hmac
+import os
+import secrets
+
+ALGORITHM = 'pbkdf2_sha256'
+ITERATIONS = int(os.environ.get('PASSWORD_ITERATIONS', '600000'))
+MIN_LENGTH = 12
+
+def _derive(password: str, salt: str, iterations: int) -> str:
+    key = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), iterations)
+    return base64.urlsafe_b64encode(key).decode().rstrip('=')
+
+def hash_password(password: str) -> str:
+    salt = secrets.token_urlsafe(16)
+    return f'{ALGORITHM}${ITERATIONS}${salt}${_derive(password, salt, ITERATIONS)}'
+
+def check_password(stored: str, password: str) -> bool:
+    try:
+        algorithm, iterations, salt, key = (stored or '').split('$')
+        iterations = int(iterations)
+    except ValueError:
+        return False
+    if algorithm != ALGORITHM or not password:
+        return False
+    return hmac.compare_digest(_derive(password, salt, iterations), key)
+
+def main():
+    import psycopg2
+
+    parser = argparse.ArgumentParser(description='Установка пароля пользователю')
+    parser.add_argument('--username', required=True)
+    args = parser.parse_args()
+
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        raise SystemExit('DATABASE_URL is not configured')
+
+    password = getpass.getpass('Пароль: ')
+    if len(password) < MIN_LENGTH:
+        raise SystemExit(f'Password must be at least {MIN_LENGTH} characters')
+    if getpass.getpass('Повторите пароль: ') != password:
+        raise SystemExit('Passwords do not match')
+
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE t_p33435224_messenger_api_modern.users SET password_hash = %s WHERE username = %s RETURNING id",
+                (hash_password(password), args.username)
+            )
+            updated = cur.fetchone()
+        conn.commit()
+    finally:
+        conn.close()
+    if not updated:
+        raise SystemExit('User not found')
+    print(f'Password set for user {updated[0]}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,8 @@
+"""Общий рантайм облачных функций: маршрутизация, ответы, JSON, пул соединений, токены и трассировка запросов
+
+Модули импортируются по месту использования, чтобы холодный старт не платил за то, что запросу не нужно:
+psycopg2 подгружается только при первом обращении к БД.
+
+Функции разворачиваются по отдельности и импортируют копию из своего каталога: после правок здесь
+запускать python backend/vendor_common.py.
+"""
@@ -0,0 +1,173 @@
+"""Маршрутизация запросов облачной функции и готовые ответы
+
+Заголовки ответов собраны заранее и разделяются между ответами, их нельзя изменять на месте.
+"""
+import os
+import sys
+import time
+from common import tracing
+from common.jsonenc import dumps, loads
+
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+
+class HttpError(Exception):
+    """Прерывает обработку маршрута ответом с ошибкой"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+def respond(status: int, body) -> dict:
+    return {'statusCode': status, 'headers': JSON_HEADERS, 'body': dumps(body), 'isBase64Encoded': False}
+
+def respond_raw(status: int, body: str) -> dict:
+    """Ответ с уже закодированным JSON, например из кэша"""
+    return {'statusCode': status, 'headers': JSON_HEADERS, 'body': body, 'isBase64Encoded': False}
+
+def error(status: int, message: str) -> dict:
+    return respond(status, {'error': message})
+
+NOT_FOUND = respond(404, {'error': 'Endpoint not found'})
+UNAUTHORIZED = respond(401, {'error': 'Authentication required'})
+SUSPENDED = respond(403, {'error': 'Account suspended'})
+
+class Request:
+    """Входящее событие; соединение с БД берётся из пула только при первом обращении к cur"""
+
+    __slots__ = ('event', 'method', 'headers', 'query', 'claims', '_body', '_pool', '_conn', '_cur')
+
+    def __init__(self, event: dict):
+        self.event = event
+        self.method = event.get('httpMethod', 'GET')
+        self.headers = event.get('headers') or {}
+        self.query = event.get('queryStringParameters') or {}
+        self.claims = None
+        self._body = None
+        self._pool = None
+        self._conn = None
+        self._cur = None
+
+    @property
+    def body(self) -> dict:
+        if self._body is None:
+            raw = self.event.get('body')
+            try:
+                self._body = loads(raw) if raw else {}
+            except ValueError:
+                raise HttpError(400, 'Invalid JSON body')
+            if not isinstance(self._body, dict):
+                raise HttpError(400, 'Invalid JSON body')
+        return self._body
+
+    @property
+    def user_id(self) -> int:
+        return self.claims['uid']
+
+    @property
+    def client_ip(self):
+        identity = (self.event.get('requestContext') or {}).get('identity') or {}
+        forwarded = self.headers.get('x-forwarded-for', '').split(',')[0].strip()
+        return identity.get('sourceIp') or forwarded or self.headers.get('x-real-ip')
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            dsn = os.environ.get('DATABASE_URL')
+            if not dsn:
+                raise HttpError(500, 'Database not configured')
+            from common.db import get_pool
+            self._pool = get_pool(dsn)
+            started = time.perf_counter()
+            self._conn = self._pool.getconn()
+            tracing.record_checkout(time.perf_counter() - started)
+        return self._conn
+
+    @property
+    def cur(self):
+        if self._cur is None:
+            conn = self.conn
+            self._cur = conn.cursor(cursor_factory=tracing.cursor_factory())
+        return self._cur
+
+    def release(self, broken: bool = False):
+        if self._cur is not None:
+            self._cur.close()
+            self._cur = None
+        if self._conn is not None:
+            self._pool.putconn(self._conn, broken=broken)
+            self._conn = None
+
+class Router:
+    """Выбирает обработчик по методу и условию на запрос, отвечает на OPTIONS и возвращает соединение в пул
+
+    Для каждого найденного маршрута пишется трасса common.tracing с именем «функция.обработчик».
+    """
+
+    def __init__(self, methods: str, allow_headers: str):
+        self.routes = []
+        self.options_response = {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': methods,
+                'Access-Control-Allow-Headers': allow_headers
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    def route(self, method: str, when=None, auth: bool = False):
+        def decorator(fn):
+            name = f'{os.path.basename(os.path.dirname(fn.__code__.co_filename))}.{fn.__name__}'
+            self.routes.append((method, when, auth, fn, name))
+            return fn
+        return decorator
+
+    def __call__(self, event: dict, context) -> dict:
+        method = event.get('httpMethod', 'GET')
+        if method == 'OPTIONS':
+            return self.options_response
+
+        request = Request(event)
+        trace = None
+        status = 500
+        broken = False
+        try:
+            for route_method, when, auth, fn, name in self.routes:
+                if route_method == method and (when is None or when(request)):
+                    break
+            else:
+                return NOT_FOUND
+
+            trace = tracing.begin(name, method)
+            if auth:
+                from common.auth import authenticate, suspended
+                request.claims = authenticate(request.headers)
+                if not request.claims:
+                    status = 401
+                    return UNAUTHORIZED
+                # Подписанный токен заблокированного пользователя остаётся действительным до истечения
+                if suspended(request.cur, request.claims['uid']):
+                    status = 403
+                    return SUSPENDED
+
+            response = fn(request)
+            status = response['statusCode']
+            return response
+        except HttpError as e:
+            status = e.status
+            return error(e.status, e.message)
+        except Exception as e:
+            broken = _is_connection_error(e)
+            raise
+        finally:
+            pool = request._pool
+            request.release(broken=broken)
+            if trace is not None:
+                tracing.end(trace, status, pool)
+
+def _is_connection_error(exc: Exception) -> bool:
+    # psycopg2 проверяется только если уже загружен: без обращения к БД он не импортируется
+    psycopg2 = sys.modules.get('psycopg2')
+    return psycopg2 is not None and isinstance(exc, (psycopg2.OperationalError, psycopg2.InterfaceError))
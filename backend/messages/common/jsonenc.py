@@ -0,0 +1,37 @@
+"""Кодирование JSON: orjson, если установлен, иначе стандартный json с типизированной сериализацией дат"""
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _default(value):
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+if orjson is not None:
+    def dumps(value) -> str:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(raw):
+        return orjson.loads(raw)
+else:
+    _encoder = json.JSONEncoder(default=_default, ensure_ascii=False, separators=(',', ':'))
+
+    def dumps(value) -> str:
+        return _encoder.encode(value)
+
+    def loads(raw):
+        return json.loads(raw)
+
+def encode_rows(rows) -> str:
+    """Пачка строк-кортежей как элементы JSON-массива без скобок, для ответа, собираемого по частям"""
+    return dumps(rows)[1:-1]
@@ -0,0 +1,110 @@
+"""Кэш профилей пользователей (username, full_name, avatar_url) для подстановки в ответы по id
+
+Запросы отдают id пользователей, профили подставляются отсюда пачкой: сначала LRU в памяти процесса,
+затем общий уровень в redis (PROFILE_CACHE_URL, если установлен пакет redis), остальные одним
+запросом к users. Профиль несёт версию users.profile_version: изменение увеличивает её, и в общий
+уровень попадает только более новая версия, поэтому заполнение после промаха, прочитавшее профиль
+до изменения, не затирает новый. Память процесса других экземпляров отстаёт не дольше PROFILE_CACHE_TTL.
+"""
+import os
+from common import tracing
+from common.cache import TTLCache
+from common.jsonenc import dumps, loads
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+SCHEMA = 't_p33435224_messenger_api_modern'
+PROFILE_FIELDS = ('username', 'full_name', 'avatar_url')
+PROFILE_CACHE_SIZE = int(os.environ.get('PROFILE_CACHE_SIZE', '10000'))
+PROFILE_CACHE_TTL = float(os.environ.get('PROFILE_CACHE_TTL', '30'))
+PROFILE_SHARED_TTL = int(os.environ.get('PROFILE_SHARED_TTL', '3600'))
+PROFILE_CACHE_URL = os.environ.get('PROFILE_CACHE_URL')
+
+# Запись только если ключа нет или в нём версия старше
+STORE_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if current and cjson.decode(current)['version'] >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+return 1
+"""
+
+_local = TTLCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL)
+_shared = None
+_store_script = None
+
+def shared():
+    global _shared, _store_script
+    if _shared is None and PROFILE_CACHE_URL and redis is not None:
+        _shared = redis.Redis.from_url(PROFILE_CACHE_URL, socket_timeout=0.1, socket_connect_timeout=0.1)
+        _store_script = _shared.register_script(STORE_SCRIPT)
+    return _shared
+
+def _key(user_id: int) -> str:
+    return f'profile:{user_id}'
+
+def resolve(cur, user_ids) -> dict:
+    """Профили {id: профиль}; несуществующие id в ответ не попадают"""
+    found = {}
+    missing = []
+    for user_id in {i for i in user_ids if i is not None}:
+        profile = _local.get(user_id)
+        if profile is None:
+            missing.append(user_id)
+        else:
+            found[user_id] = profile
+
+    if missing and shared():
+        try:
+            values = shared().mget([_key(user_id) for user_id in missing])
+        except redis.RedisError as e:
+            tracing.log('profile_cache_error', error=str(e))
+            values = [None] * len(missing)
+        remaining = []
+        for user_id, raw in zip(missing, values):
+            if raw is None:
+                remaining.append(user_id)
+                continue
+            found[user_id] = loads(raw)
+            _local.set(user_id, found[user_id])
+        missing = remaining
+
+    if missing:
+        cur.execute(f"""
+            SELECT id, profile_version as version, {', '.join(PROFILE_FIELDS)}
+            FROM {SCHEMA}.users
+            WHERE id = ANY(%s)
+        """, (missing,))
+        fetched = [{key: row[key] for key in ('id', 'version') + PROFILE_FIELDS} for row in cur.fetchall()]
+        store(fetched)
+        found.update((profile['id'], profile) for profile in fetched)
+    return found
+
+def attach(cur, rows: list, id_key: str, **fields) -> list:
+    """Подставляет поля профиля в строки: attach(cur, rows, 'sender_id', sender_username='username')"""
+    profiles = resolve(cur, (row[id_key] for row in rows))
+    for row in rows:
+        profile = profiles.get(row[id_key], {})
+        for name, field in fields.items():
+            row[name] = profile.get(field)
+    return rows
+
+def store(profiles: list):
+    """Кладёт профили в оба уровня; вызывается после коммита изменения профиля"""
+    for profile in profiles:
+        current = _local.get(profile['id'])
+        if current is None or current['version'] <= profile['version']:
+            _local.set(profile['id'], profile)
+    if not profiles or not shared():
+        return
+    try:
+        pipe = shared().pipeline(transaction=False)
+        for profile in profiles:
+            _store_script(keys=[_key(profile['id'])], args=[dumps(profile), profile['version'], PROFILE_SHARED_TTL], client=pipe)
+        pipe.execute()
+    except redis.RedisError as e:
+        tracing.log('profile_cache_error', error=str(e))
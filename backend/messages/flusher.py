@@ -0,0 +1,183 @@
+"""Перенос сообщений из очереди приёма message_queue в messages (режим MESSAGES_INGEST_MODE=queued)
+
+Запуск: DATABASE_URL=postgres://... python backend/messages/flusher.py --batch-size 1000 --metrics-port 9102
+
+Пачка забирается по возрастанию id и переносится одним оператором: вставка в messages, обновление
+chat_summary и уведомления для SSE коммитятся вместе, один fsync на пачку. Работает один экземпляр
+(advisory lock). Порядок внутри чата сохраняется: enqueue ставит в очередь под блокировкой чата
+(lock_chats в index.py), поэтому видимые строки чата — всегда префикс его очереди по id, и пачка
+по возрастанию id не может перенести более раннее сообщение после более позднего. Отсюда же
+непрочитанные можно прибавлять без проверки: отметка прочтения собеседника стоит на уже
+перенесённом сообщении, а всё переносимое новее её.
+Метрики отставания отдаются в формате Prometheus на /metrics и пишутся в лог JSON-строкой.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import psycopg2
+
+NOTIFY_CHANNEL = 'new_message'
+LOCK_KEY = 'message_queue_flusher'
+
+# Перенесённое сообщение новее последнего в сводке по (sent_at, id), порядку истории
+NEWER = "(s.last_message_id IS NULL OR (last.sent_at, last.id) > (s.last_message_time, s.last_message_id))"
+
+FLUSH_SQL = f"""
+    WITH batch AS (
+        DELETE FROM message_queue
+        WHERE id IN (SELECT id FROM message_queue ORDER BY id LIMIT %s)
+        RETURNING id, chat_id, sender_id, recipient_id, message_text, queued_at
+    ), msg AS (
+        INSERT INTO messages (id, chat_id, sender_id, message_text, sent_at)
+        SELECT id, chat_id, sender_id, message_text, queued_at FROM batch ORDER BY id
+        RETURNING id, chat_id, sender_id, message_text, sent_at
+    ), last AS (
+        SELECT DISTINCT ON (chat_id) chat_id, id, message_text, sent_at, sender_id,
+               COUNT(*) OVER (PARTITION BY chat_id) as sent
+        FROM msg
+        ORDER BY chat_id, sent_at DESC, id DESC
+    ), summary AS (
+        UPDATE chat_summary s SET
+            last_message_id = CASE WHEN {NEWER} THEN last.id ELSE s.last_message_id END,
+            last_message_text = CASE WHEN {NEWER} THEN last.message_text ELSE s.last_message_text END,
+            last_message_time = CASE WHEN {NEWER} THEN last.sent_at ELSE s.last_message_time END,
+            unread_count = s.unread_count + CASE WHEN s.user_id = last.sender_id THEN 0 ELSE last.sent END,
+            change_xid = pg_current_xact_id(),
+            change_seq = nextval('change_seq')
+        FROM last
+        WHERE s.chat_id = last.chat_id
+    ), notified AS (
+        SELECT msg.id, pg_notify('{NOTIFY_CHANNEL}', json_build_object(
+            'id', msg.id, 'chat_id', msg.chat_id, 'sender_id', msg.sender_id, 'recipient_id', batch.recipient_id,
+            'sent_at', msg.sent_at
+        )::text)
+        FROM msg
+        JOIN batch ON batch.id = msg.id
+    )
+    SELECT COUNT(*) as flushed, EXTRACT(EPOCH FROM clock_timestamp() - MIN(batch.queued_at)) as lag
+    FROM notified
+    JOIN batch ON batch.id = notified.id
+"""
+
+class Flusher:
+    def __init__(self, dsn: str, batch_size: int):
+        self.dsn = dsn
+        self.batch_size = batch_size
+        self.conn = None
+        self.stats = {
+            'flushed_total': 0, 'batches_total': 0, 'errors_total': 0,
+            'last_batch_size': 0, 'last_flush_seconds': 0.0, 'last_lag_seconds': 0.0,
+            'queue_depth': 0, 'oldest_pending_seconds': 0.0,
+        }
+        self._lock = threading.Lock()
+
+    def connect(self):
+        self.conn = psycopg2.connect(self.dsn)
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(hashtext(%s))", (LOCK_KEY,))
+            locked = cur.fetchone()[0]
+        self.conn.commit()
+        if not locked:
+            raise SystemExit('Another flusher is already running')
+
+    def flush_once(self) -> int:
+        started = time.perf_counter()
+        with self.conn.cursor() as cur:
+            cur.execute(FLUSH_SQL, (self.batch_size,))
+            flushed, lag = cur.fetchone()
+        self.conn.commit()
+        with self._lock:
+            self.stats['last_batch_size'] = flushed
+            if flushed:
+                self.stats['flushed_total'] += flushed
+                self.stats['batches_total'] += 1
+                self.stats['last_flush_seconds'] = time.perf_counter() - started
+                self.stats['last_lag_seconds'] = float(lag)
+        return flushed
+
+    def measure_queue(self):
+        with self.conn.cursor() as cur:
+            cur.execute("""
+                SELECT COUNT(*), COALESCE(EXTRACT(EPOCH FROM clock_timestamp() - MIN(queued_at)), 0)
+                FROM message_queue
+            """)
+            depth, oldest = cur.fetchone()
+        self.conn.commit()
+        with self._lock:
+            self.stats['queue_depth'] = depth
+            self.stats['oldest_pending_seconds'] = float(oldest)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.stats)
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for key, value in self.snapshot().items():
+            kind = 'counter' if key.endswith('_total') else 'gauge'
+            lines.append(f'# TYPE messenger_message_queue_{key} {kind}')
+            lines.append(f'messenger_message_queue_{key} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def run(self, interval: float, log_interval: float):
+        self.connect()
+        last_log = time.monotonic()
+        while True:
+            try:
+                flushed = self.flush_once()
+                self.measure_queue()
+            except psycopg2.Error as e:
+                with self._lock:
+                    self.stats['errors_total'] += 1
+                print(json.dumps({'event': 'flush_failed', 'error': str(e).strip(), 'ts': time.time()}), flush=True)
+                if self.conn.closed:
+                    time.sleep(interval)
+                    self.connect()
+                else:
+                    self.conn.rollback()
+                flushed = 0
+            if time.monotonic() - last_log >= log_interval:
+                last_log = time.monotonic()
+                print(json.dumps({'event': 'flusher', 'ts': time.time(), **self.snapshot()}), flush=True)
+            # Полная пачка означает, что очередь не разобрана: следующая забирается без паузы
+            if flushed < self.batch_size:
+                time.sleep(interval)
+
+def serve_metrics(flusher: Flusher, port: int):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                body, content_type = flusher.render_prometheus().encode(), 'text/plain; version=0.0.4'
+            else:
+                body, content_type = json.dumps(flusher.snapshot()).encode(), 'application/json'
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Перенос очереди приёма сообщений в messages')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--interval', type=float, default=0.05, help='пауза при пустой очереди, секунды')
+    parser.add_argument('--log-interval', type=float, default=10.0)
+    parser.add_argument('--metrics-port', type=int, default=0, help='порт для /metrics; 0 отключает')
+    args = parser.parse_args()
+
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        raise SystemExit('DATABASE_URL is not configured')
+
+    flusher = Flusher(dsn, args.batch_size)
+    if args.metrics_port:
+        serve_metrics(flusher, args.metrics_port)
+    flusher.run(args.interval, args.log_interval)
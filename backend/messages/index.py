@@ -1,174 +1,553 @@
-import json
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import sys
 
-def handler(event: dict, context) -> dict:
-    """API для отправки и получения сообщений"""
-    
-    method = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token, X-User-Id'
-            },
-            'body': '',
-            'isBase64Encoded': False
+# common — копия backend/common (backend/vendor_common.py): каталог функции разворачивается отдельно
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common.http import Router, HttpError, respond, error
+from common.pagination import (
+    encode_cursor, decode_cursor, encode_rank_cursor, decode_rank_cursor,
+    encode_change_cursor, decode_change_cursor, parse_limit,
+)
+from common import presence, profiles
+
+router = Router('GET, POST, OPTIONS', 'Content-Type, X-Auth-Token, X-User-Id')
+
+NOTIFY_CHANNEL = 'new_message'
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+BATCH_MAX_SIZE = 1000
+SYNC_BATCH_SIZE = 500
+SYNC_MAX_BATCH_SIZE = 2000
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+SEARCH_MAX_QUERY_LENGTH = 200
+# Найденные слова в сниппете обрамляются кавычками, а не HTML: клиент выводит текст как есть
+SEARCH_HEADLINE_OPTIONS = 'StartSel=«, StopSel=», MaxWords=20, MinWords=8, MaxFragments=2, FragmentDelimiter=" … "'
+# direct — сообщение пишется в messages в запросе; queued — в message_queue, в messages его переносит flusher.py
+INGEST_MODE = os.environ.get('MESSAGES_INGEST_MODE', 'direct')
+# Пространство ключей advisory-блокировок отправки в чат
+CHAT_SEND_LOCK = 'chat_send'
+
+def lock_chats(cur, chat_ids):
+    """Сериализует отправки в чаты до конца транзакции
+
+    id берётся из последовательности до коммита, поэтому без блокировки строка с меньшим id может
+    стать видна позже большей. Под блокировкой id и время (clock_timestamp()) внутри чата выдаются
+    в порядке коммитов: кто видит сообщение, видит и все более ранние. Блокировки берутся по
+    возрастанию chat_id, чтобы пачки с общими чатами не ждали друг друга по кругу.
+    """
+    cur.execute("""
+        SELECT pg_advisory_xact_lock(hashtext(%s), c.chat_id)
+        FROM (SELECT DISTINCT unnest(%s::int[]) as chat_id ORDER BY 1) c
+    """, (CHAT_SEND_LOCK, sorted(set(chat_ids))))
+
+def summary_last(row: str) -> str:
+    """SET последнего сообщения сводки s из row, только если row новее по (sent_at, id) — порядку истории
+
+    Параллельные отправки в один чат коммитятся не в порядке sent_at/id: без условия сводку
+    перезаписывает тот, кто закоммитился позже, а не последнее сообщение.
+    """
+    newer = f"(s.last_message_id IS NULL OR ({row}.sent_at, {row}.id) > (s.last_message_time, s.last_message_id))"
+    return ',\n'.join(
+        f"{column} = CASE WHEN {newer} THEN {row}.{source} ELSE s.{column} END"
+        for column, source in (('last_message_id', 'id'), ('last_message_text', 'message_text'), ('last_message_time', 'sent_at'))
+    )
+
+def resolve_chats(cur, sender_id: int, recipient_ids: list) -> dict:
+    """Находит или создаёт личные чаты по ключу (least, greatest) одним запросом; несуществующие получатели не попадают в ответ"""
+    chat_by_recipient = {}
+    remaining = sorted(set(recipient_ids))
+    # Вторая попытка нужна только если параллельный запрос создал тот же чат между снимком и вставкой
+    for _ in range(2):
+        if not remaining:
+            break
+        cur.execute("""
+            WITH pairs AS (
+                SELECT u.id as recipient_id, LEAST(%s, u.id) as lo, GREATEST(%s, u.id) as hi
+                FROM users u
+                WHERE u.id = ANY(%s)
+            ), existing AS (
+                SELECT p.recipient_id, c.id
+                FROM pairs p
+                JOIN chats c ON c.user_low = p.lo AND c.user_high = p.hi
+            ), created AS (
+                INSERT INTO chats (user_low, user_high)
+                SELECT p.lo, p.hi FROM pairs p
+                WHERE NOT EXISTS (SELECT 1 FROM existing e WHERE e.recipient_id = p.recipient_id)
+                ON CONFLICT (user_low, user_high) DO NOTHING
+                RETURNING id, user_low, user_high
+            ), members AS (
+                INSERT INTO chat_participants (chat_id, user_id)
+                SELECT created.id, v.user_id
+                FROM created, LATERAL (VALUES (created.user_low), (created.user_high)) v(user_id)
+            ), summary AS (
+                INSERT INTO chat_summary (chat_id, user_id, peer_user_id)
+                SELECT created.id, v.user_id, v.peer_user_id
+                FROM created, LATERAL (VALUES (created.user_low, created.user_high), (created.user_high, created.user_low)) v(user_id, peer_user_id)
+            )
+            SELECT recipient_id, id as chat_id FROM existing
+            UNION ALL
+            SELECT p.recipient_id, created.id FROM created JOIN pairs p ON p.lo = created.user_low AND p.hi = created.user_high
+        """, (sender_id, sender_id, remaining))
+        for row in cur.fetchall():
+            chat_by_recipient[row['recipient_id']] = row['chat_id']
+        remaining = [r for r in remaining if r not in chat_by_recipient]
+    return chat_by_recipient
+
+def enqueue(cur, rows: list) -> list:
+    """Ставит сообщения в очередь приёма; строки (ord, chat_id, sender_id, recipient_id, message_text)"""
+    from psycopg2.extras import execute_values
+    lock_chats(cur, [row[1] for row in rows])
+    queued = execute_values(cur, """
+        WITH v (ord, chat_id, sender_id, recipient_id, message_text) AS (VALUES %s),
+        queued AS (
+            INSERT INTO message_queue (chat_id, sender_id, recipient_id, message_text, queued_at)
+            SELECT chat_id, sender_id, recipient_id, message_text, clock_timestamp() FROM v
+            -- Отправитель у пачки один: проверка одним поиском по ключу, а не анти-соединением по users на строку
+            WHERE NOT EXISTS (SELECT 1 FROM users su WHERE su.id = (SELECT sender_id FROM v LIMIT 1) AND su.suspended_at IS NOT NULL)
+            ORDER BY ord
+            RETURNING id, chat_id, queued_at
+        )
+        SELECT id, chat_id, queued_at as sent_at FROM queued ORDER BY id
+    """, rows, template='(%s, %s, %s::int, %s::int, %s)', page_size=len(rows), fetch=True)
+    if not queued:
+        raise HttpError(403, 'Account suspended')
+    return queued
+
+def send_batch(cur, sender_id: int, items: list) -> list:
+    """Отправка пачки сообщений: чаты находятся и создаются пачкой, сообщения вставляются одним запросом"""
+    results = [None] * len(items)
+    pending = []
+    for index, item in enumerate(items):
+        recipient_id = item.get('recipient_id') if isinstance(item, dict) else None
+        message_text = (item.get('message_text') or '').strip() if isinstance(item, dict) else ''
+        # Как и одиночная отправка, принимаем id и числом, и строкой из цифр
+        if isinstance(recipient_id, str) and recipient_id.isdigit():
+            recipient_id = int(recipient_id)
+        if not isinstance(recipient_id, int) or isinstance(recipient_id, bool) or not message_text:
+            results[index] = {'index': index, 'status': 400, 'error': 'recipient_id and message_text required'}
+        elif recipient_id == sender_id:
+            results[index] = {'index': index, 'status': 400, 'error': 'Cannot send a message to yourself'}
+        else:
+            pending.append((index, recipient_id, message_text))
+
+    if not pending:
+        return results
+
+    from psycopg2.extras import execute_values
+
+    chat_by_recipient = resolve_chats(cur, sender_id, [r for _, r, _ in pending])
+
+    rows = []
+    for index, recipient_id, message_text in pending:
+        if recipient_id not in chat_by_recipient:
+            results[index] = {'index': index, 'status': 404, 'error': 'Recipient not found'}
+        else:
+            rows.append((index, chat_by_recipient[recipient_id], sender_id, recipient_id, message_text))
+
+    if not rows:
+        return results
+
+    if INGEST_MODE == 'queued':
+        return fill_results(results, rows, enqueue(cur, rows), 202)
+
+    lock_chats(cur, [row[1] for row in rows])
+    inserted = execute_values(cur, f"""
+        WITH v (ord, chat_id, sender_id, recipient_id, message_text) AS (VALUES %s),
+        msg AS (
+            INSERT INTO messages (chat_id, sender_id, message_text, sent_at)
+            SELECT chat_id, sender_id, message_text, clock_timestamp() FROM v
+            -- Отправитель у пачки один: проверка одним поиском по ключу, а не анти-соединением по users на строку
+            WHERE NOT EXISTS (SELECT 1 FROM users su WHERE su.id = (SELECT sender_id FROM v LIMIT 1) AND su.suspended_at IS NOT NULL)
+            ORDER BY ord
+            RETURNING id, chat_id, sender_id, message_text, sent_at
+        ), last AS (
+            SELECT DISTINCT ON (chat_id) chat_id, id, message_text, sent_at, sender_id,
+                   COUNT(*) OVER (PARTITION BY chat_id) as sent
+            FROM msg
+            ORDER BY chat_id, sent_at DESC, id DESC
+        ), targets AS (
+            -- Обе строки сводки по полному первичному ключу (chat_id, user_id)
+            SELECT last.*, t.user_id
+            FROM last
+            JOIN (SELECT DISTINCT chat_id, recipient_id FROM v) r ON r.chat_id = last.chat_id
+            CROSS JOIN LATERAL (VALUES (last.sender_id), (r.recipient_id)) t(user_id)
+        ), summary AS (
+            UPDATE chat_summary s SET
+                {summary_last('last')},
+                unread_count = s.unread_count + CASE WHEN s.user_id = last.sender_id THEN 0 ELSE last.sent END,
+                change_xid = pg_current_xact_id(),
+                change_seq = nextval('change_seq')
+            FROM targets last
+            WHERE s.chat_id = last.chat_id AND s.user_id = last.user_id
+        ), notified AS (
+            SELECT msg.id, msg.chat_id, msg.sent_at, pg_notify('{NOTIFY_CHANNEL}', json_build_object(
+                'id', msg.id, 'chat_id', msg.chat_id, 'sender_id', msg.sender_id, 'recipient_id', r.recipient_id,
+                'sent_at', msg.sent_at
+            )::text)
+            FROM msg
+            JOIN (SELECT DISTINCT chat_id, recipient_id FROM v) r ON r.chat_id = msg.chat_id
+        )
+        SELECT id, chat_id, sent_at FROM notified ORDER BY id
+    """, rows, template='(%s, %s, %s::int, %s::int, %s)', page_size=len(rows), fetch=True)
+    # Все строки пачки от одного отправителя: пустой результат значит, что он заблокирован
+    if not inserted:
+        raise HttpError(403, 'Account suspended')
+
+    return fill_results(results, rows, inserted, 201)
+
+def fill_results(results: list, rows: list, inserted: list, status: int) -> list:
+    # id выдаются последовательностью в порядке ord, поэтому сортировка по id восстанавливает соответствие
+    for (index, *_), message in zip(rows, inserted):
+        results[index] = {
+            'index': index,
+            'status': status,
+            'chat_id': message['chat_id'],
+            'message': {'id': message['id'], 'sent_at': message['sent_at']}
         }
+    return results
+
+@router.route('GET', when=lambda req: 'sync' in req.query, auth=True)
+def sync_changes(req):
+    """Изменения с прошлой синхронизации: новые и удалённые сообщения, сводки чатов и прочтения
+
+    Пустой ?sync= возвращает только курсор: клиент берёт его до полной загрузки чатов и истории,
+    затем передаёт в следующий вызов. Отдаются изменения транзакций, завершившихся до снимка
+    (xmin снимка), поэтому курсор монотонен и ничего не пропускает; изменения ещё открытых
+    транзакций придут следующим вызовом. Порция ограничена ?limit, has_more просит продолжить сразу.
+    """
+    qsp = req.query
+    since = decode_change_cursor(qsp['sync']) if qsp.get('sync') else None
+    limit = parse_limit(qsp.get('limit'), SYNC_BATCH_SIZE, SYNC_MAX_BATCH_SIZE)
+
+    if limit is None or (qsp.get('sync') and not since):
+        return error(400, 'Invalid sync parameters')
+
+    cur = req.cur
+    if not since:
+        cur.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint as horizon")
+        return respond(200, {
+            'messages': [], 'chats': [], 'has_more': False,
+            'cursor': encode_change_cursor(cur.fetchone()['horizon'], 0)
+        })
+
+    # Каждая ветка берёт не больше limit + 1 изменений по своему индексу, общий порядок — по курсору
+    cur.execute("""
+        WITH horizon AS (
+            SELECT pg_snapshot_xmin(pg_current_snapshot()) as xmin
+        ), changed_messages AS (
+            SELECT m.change_xid, m.change_seq, 'message' as kind, jsonb_build_object(
+                'id', m.id, 'chat_id', m.chat_id, 'sender_id', m.sender_id, 'sent_at', m.sent_at,
+                'message_text', CASE WHEN m.deleted_at IS NULL THEN m.message_text END,
+                'deleted', m.deleted_at IS NOT NULL
+            ) as data
+            FROM horizon h
+            JOIN chat_participants cp ON cp.user_id = %(user_id)s
+            CROSS JOIN LATERAL (
+                SELECT id, chat_id, sender_id, sent_at, message_text, deleted_at, change_xid, change_seq
+                FROM messages
+                WHERE chat_id = cp.chat_id
+                  AND (change_xid, change_seq) > (%(xid)s::text::xid8, %(seq)s)
+                  AND change_xid < h.xmin
+                ORDER BY change_xid, change_seq
+                LIMIT %(limit)s
+            ) m
+            ORDER BY m.change_xid, m.change_seq
+            LIMIT %(limit)s
+        ), changed_chats AS (
+            SELECT s.change_xid, s.change_seq, 'chat' as kind, jsonb_build_object(
+                'chat_id', s.chat_id, 'user_id', s.peer_user_id,
+                'last_message_id', s.last_message_id, 'last_message', s.last_message_text,
+                'last_message_time', s.last_message_time, 'unread_count', s.unread_count,
+                'peer_last_read_message_id', peer.last_read_message_id
+            ) as data
+            FROM horizon h
+            JOIN chat_summary s ON s.user_id = %(user_id)s
+            LEFT JOIN chat_participants peer ON peer.chat_id = s.chat_id AND peer.user_id = s.peer_user_id
+            WHERE (s.change_xid, s.change_seq) > (%(xid)s::text::xid8, %(seq)s)
+              AND s.change_xid < h.xmin
+            ORDER BY s.change_xid, s.change_seq
+            LIMIT %(limit)s
+        ), changes AS (
+            SELECT * FROM changed_messages
+            UNION ALL
+            SELECT * FROM changed_chats
+            ORDER BY change_xid, change_seq
+            LIMIT %(limit)s
+        )
+        SELECT h.xmin::text::bigint as horizon, c.change_xid::text::bigint as xid, c.change_seq as seq, c.kind, c.data
+        FROM horizon h
+        LEFT JOIN changes c ON TRUE
+        ORDER BY c.change_xid, c.change_seq
+    """, {'user_id': req.user_id, 'xid': since[0], 'seq': since[1], 'limit': limit + 1})
+    rows = cur.fetchall()
+    changes = [row for row in rows if row['kind']][:limit + 1]
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    # Полная порция продолжается с последнего отданного изменения, иначе курсор сдвигается до горизонта
+    cursor = (changes[-1]['xid'], changes[-1]['seq']) if has_more else (max(rows[0]['horizon'], since[0]), 0)
+
+    return respond(200, {
+        'messages': [row['data'] for row in changes if row['kind'] == 'message'],
+        'chats': [row['data'] for row in changes if row['kind'] == 'chat'],
+        'has_more': has_more,
+        'cursor': encode_change_cursor(*cursor)
+    })
+
+@router.route('GET', when=lambda req: 'q' in req.query, auth=True)
+def search_messages(req):
+    """Поиск по сообщениям чатов пользователя, по убыванию релевантности
+
+    Каждый чат участника проверяется выборкой из GIN-индекса (chat_id, search_vector), поэтому
+    объём работы зависит от переписки пользователя, а не от размера messages. Сниппеты строятся
+    только для строк страницы.
+    """
+    qsp = req.query
+    text = (qsp.get('q') or '').strip()
+    limit = parse_limit(qsp.get('limit'), SEARCH_PAGE_SIZE, SEARCH_MAX_PAGE_SIZE)
+    before = decode_rank_cursor(qsp['before']) if qsp.get('before') else None
+    chat_id = qsp.get('chat_id')
+
+    if not text or len(text) > SEARCH_MAX_QUERY_LENGTH:
+        return error(400, f'q must be 1 to {SEARCH_MAX_QUERY_LENGTH} characters')
+    if limit is None or (qsp.get('before') and not before) or (chat_id and not chat_id.isdigit()):
+        return error(400, 'Invalid search parameters')
+
+    chat_filter = 'AND cp.chat_id = %(chat_id)s' if chat_id else ''
+    # rank имеет тип real: курсор приводится к нему же, иначе сравнение во float8 сдвигает границу страницы
+    keyset = '(h.rank, h.id) < (%(rank)s::real, %(id)s)' if before else 'TRUE'
+    cur = req.cur
+    cur.execute(f"""
+        WITH q AS (
+            SELECT websearch_to_tsquery('russian', %(text)s) || websearch_to_tsquery('simple', %(text)s) as query
+        ), hits AS (
+            SELECT m.id, m.chat_id, m.sender_id, m.message_text, m.sent_at,
+                   ts_rank_cd(m.search_vector, q.query) as rank
+            FROM q
+            JOIN chat_participants cp ON cp.user_id = %(user_id)s {chat_filter}
+            CROSS JOIN LATERAL (
+                SELECT id, chat_id, sender_id, message_text, sent_at, search_vector
+                FROM messages
+                WHERE chat_id = cp.chat_id AND search_vector @@ q.query AND deleted_at IS NULL
+            ) m
+        ), page AS (
+            SELECT * FROM hits h
+            WHERE {keyset}
+            ORDER BY h.rank DESC, h.id DESC
+            LIMIT %(limit)s
+        )
+        SELECT page.id, page.chat_id, page.sent_at, page.rank, page.sender_id,
+               ts_headline('russian', page.message_text, q.query, %(headline)s) as snippet
+        FROM page
+        CROSS JOIN q
+        ORDER BY page.rank DESC, page.id DESC
+    """, {
+        'text': text, 'user_id': req.user_id, 'chat_id': chat_id, 'limit': limit + 1,
+        'rank': before[0] if before else None, 'id': before[1] if before else None,
+        'headline': SEARCH_HEADLINE_OPTIONS,
+    })
+    hits = cur.fetchall()
+    has_more = len(hits) > limit
+    hits = profiles.attach(cur, hits[:limit], 'sender_id', sender_username='username')
+
+    return respond(200, {
+        'hits': hits,
+        'has_more': has_more,
+        'next': encode_rank_cursor(hits[-1]['rank'], hits[-1]['id']) if has_more else None
+    })
+
+@router.route('GET', when=lambda req: not req.query.get('chat_id'), auth=True)
+def list_chats(req):
+    # users присоединяется только ради last_seen, профили собеседников берутся из кэша
+    cur = req.cur
+    cur.execute(f"""
+        SELECT 
+            s.chat_id,
+            s.peer_user_id as user_id,
+            {presence.columns('u')},
+            s.last_message_text as last_message,
+            s.last_message_time,
+            s.unread_count
+        FROM chat_summary s
+        JOIN users u ON s.peer_user_id = u.id
+        {presence.join('u')}
+        WHERE s.user_id = %s
+        ORDER BY s.last_message_time DESC NULLS LAST
+    """, (req.user_id,))
+    chats = profiles.attach(cur, cur.fetchall(), 'user_id', username='username', full_name='full_name', avatar_url='avatar_url')
     
-    dsn = os.environ.get('DATABASE_URL')
-    if not dsn:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Database not configured'}),
-            'isBase64Encoded': False
-        }
+    return respond(200, {'chats': chats})
+
+@router.route('GET', when=lambda req: req.query.get('chat_id'), auth=True)
+def chat_history(req):
+    """Страница истории чата; чужой или несуществующий чат — 404"""
+    qsp = req.query
+    chat_id = qsp.get('chat_id')
+    user_id = req.user_id
+    
+    if not chat_id.isdigit():
+        return error(400, 'Invalid chat_id')
+    
+    limit = parse_limit(qsp.get('limit'), HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE)
+    before = decode_cursor(qsp['before']) if qsp.get('before') else None
+    after = decode_cursor(qsp['after']) if qsp.get('after') else None
+    
+    if limit is None or (qsp.get('before') and not before) or (qsp.get('after') and not after) or (before and after):
+        return error(400, 'Invalid pagination parameters')
     
-    conn = psycopg2.connect(dsn)
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
-    try:
-        user_id = event.get('headers', {}).get('x-user-id')
-        if not user_id:
-            return {
-                'statusCode': 401,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Authentication required'}),
-                'isBase64Encoded': False
-            }
-        
-        qsp = event.get('queryStringParameters', {}) or {}
-        
-        if method == 'GET' and not qsp.get('chat_id'):
-            cur.execute("""
-                SELECT 
-                    c.id as chat_id,
-                    u.id as user_id,
-                    u.username,
-                    u.full_name,
-                    u.avatar_url,
-                    u.is_online,
-                    m.message_text as last_message,
-                    m.sent_at as last_message_time,
-                    COUNT(CASE WHEN m.is_read = FALSE AND m.sender_id != %s THEN 1 END) as unread_count
-                FROM chat_participants cp
-                JOIN chats c ON cp.chat_id = c.id
-                JOIN chat_participants cp2 ON c.id = cp2.chat_id AND cp2.user_id != %s
-                JOIN users u ON cp2.user_id = u.id
-                LEFT JOIN LATERAL (
-                    SELECT message_text, sent_at, sender_id, is_read
-                    FROM messages 
-                    WHERE chat_id = c.id 
-                    ORDER BY sent_at DESC 
-                    LIMIT 1
-                ) m ON TRUE
-                WHERE cp.user_id = %s
-                GROUP BY c.id, u.id, u.username, u.full_name, u.avatar_url, u.is_online, m.message_text, m.sent_at
-                ORDER BY m.sent_at DESC NULLS LAST
-            """, (user_id, user_id, user_id))
-            
-            chats = cur.fetchall()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'chats': [dict(c) for c in chats]}, default=str),
-                'isBase64Encoded': False
-            }
-        
-        elif method == 'GET' and qsp.get('chat_id'):
-            chat_id = qsp.get('chat_id')
-            
-            if not chat_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'chat_id required'}),
-                    'isBase64Encoded': False
-                }
-            
-            cur.execute("""
-                SELECT m.id, m.message_text, m.sent_at, m.is_read,
-                       u.id as sender_id, u.username as sender_username
-                FROM messages m
-                JOIN users u ON m.sender_id = u.id
-                WHERE m.chat_id = %s
-                ORDER BY m.sent_at ASC
-            """, (chat_id,))
-            
-            messages = cur.fetchall()
-            
-            cur.execute("UPDATE messages SET is_read = TRUE WHERE chat_id = %s AND sender_id != %s", (chat_id, user_id))
-            conn.commit()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'messages': [dict(m) for m in messages]}, default=str),
-                'isBase64Encoded': False
-            }
-        
-        elif method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            recipient_id = body.get('recipient_id')
-            message_text = body.get('message_text', '').strip()
-            
-            if not recipient_id or not message_text:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'recipient_id and message_text required'}),
-                    'isBase64Encoded': False
-                }
-            
-            cur.execute("""
-                SELECT c.id FROM chats c
-                JOIN chat_participants cp1 ON c.id = cp1.chat_id AND cp1.user_id = %s
-                JOIN chat_participants cp2 ON c.id = cp2.chat_id AND cp2.user_id = %s
-                LIMIT 1
-            """, (user_id, recipient_id))
-            
-            chat = cur.fetchone()
-            
-            if not chat:
-                cur.execute("INSERT INTO chats DEFAULT VALUES RETURNING id")
-                chat = cur.fetchone()
-                chat_id = chat['id']
-                
-                cur.execute("INSERT INTO chat_participants (chat_id, user_id) VALUES (%s, %s), (%s, %s)",
-                           (chat_id, user_id, chat_id, recipient_id))
-            else:
-                chat_id = chat['id']
-            
-            cur.execute(
-                "INSERT INTO messages (chat_id, sender_id, message_text) VALUES (%s, %s, %s) RETURNING id, sent_at",
-                (chat_id, user_id, message_text)
+    cur = req.cur
+    if after:
+        cur.execute("""
+            SELECT m.id, m.message_text, m.sent_at, m.sender_id,
+                   COALESCE(m.id <= r.last_read_message_id, FALSE) as is_read
+            FROM messages m
+            JOIN chat_participants p ON p.chat_id = m.chat_id AND p.user_id = %s
+            LEFT JOIN chat_participants r ON r.chat_id = m.chat_id AND r.user_id != m.sender_id
+            WHERE m.chat_id = %s AND (m.sent_at, m.id) > (%s, %s) AND m.deleted_at IS NULL
+            ORDER BY m.sent_at ASC, m.id ASC
+            LIMIT %s
+        """, (user_id, chat_id, after[0], after[1], limit + 1))
+        messages = cur.fetchall()
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+    else:
+        keyset = 'AND (m.sent_at, m.id) < (%s, %s)' if before else ''
+        cur.execute(f"""
+            SELECT m.id, m.message_text, m.sent_at, m.sender_id,
+                   COALESCE(m.id <= r.last_read_message_id, FALSE) as is_read
+            FROM messages m
+            JOIN chat_participants p ON p.chat_id = m.chat_id AND p.user_id = %s
+            LEFT JOIN chat_participants r ON r.chat_id = m.chat_id AND r.user_id != m.sender_id
+            WHERE m.chat_id = %s {keyset} AND m.deleted_at IS NULL
+            ORDER BY m.sent_at DESC, m.id DESC
+            LIMIT %s
+        """, (user_id, chat_id, *(before or ()), limit + 1))
+        messages = cur.fetchall()
+        has_more = len(messages) > limit
+        messages = messages[:limit][::-1]
+    
+    # Пустая страница — либо конец истории, либо чужой чат: отличаем по участию
+    if not messages:
+        cur.execute("SELECT 1 FROM chat_participants WHERE chat_id = %s AND user_id = %s", (chat_id, user_id))
+        if not cur.fetchone():
+            return error(404, 'Chat not found')
+    
+    # Отметка — id: отправки в чат идут под lock_chats, поэтому всё с меньшим id в этом чате
+    # уже закоммичено и видно, позже под отметку ничего не попадёт.
+    # Сводка собеседника тоже помечается изменённой: через синхронизацию он узнаёт, что сообщения прочитаны
+    last_seen_id = max((m['id'] for m in messages if m['sender_id'] != user_id), default=None)
+    if last_seen_id:
+        cur.execute("""
+            WITH advanced AS (
+                UPDATE chat_participants SET last_read_message_id = %s
+                WHERE chat_id = %s AND user_id = %s AND last_read_message_id < %s
+                RETURNING chat_id, user_id, last_read_message_id
             )
-            message = cur.fetchone()
-            conn.commit()
-            
-            return {
-                'statusCode': 201,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'message': dict(message),
-                    'chat_id': chat_id
-                }, default=str),
-                'isBase64Encoded': False
-            }
-        
-        return {
-            'statusCode': 404,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Endpoint not found'}),
-            'isBase64Encoded': False
-        }
+            UPDATE chat_summary s SET
+                unread_count = CASE
+                    WHEN s.user_id != a.user_id THEN s.unread_count
+                    WHEN s.last_message_id <= a.last_read_message_id THEN 0
+                    ELSE (
+                        SELECT COUNT(*) FROM messages um
+                        WHERE um.chat_id = s.chat_id AND um.sender_id != s.user_id
+                          AND um.id > a.last_read_message_id AND um.deleted_at IS NULL
+                    )
+                END,
+                change_xid = pg_current_xact_id(),
+                change_seq = nextval('change_seq')
+            FROM advanced a
+            WHERE s.chat_id = a.chat_id
+        """, (last_seen_id, chat_id, user_id, last_seen_id))
+    profiles.attach(cur, messages, 'sender_id', sender_username='username')
+    req.conn.commit()
     
-    finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+    return respond(200, {
+        'messages': messages,
+        'has_more': has_more,
+        'before': encode_cursor(messages[0]['sent_at'], messages[0]['id']) if messages else None,
+        'after': encode_cursor(messages[-1]['sent_at'], messages[-1]['id']) if messages else None
+    })
+
+@router.route('POST', when=lambda req: req.body.get('action') == 'heartbeat', auth=True)
+def heartbeat(req):
+    presence.heartbeat(req)
+    return respond(200, {'online': True, 'ttl': presence.PRESENCE_TTL})
+
+@router.route('POST', when=lambda req: 'messages' in req.body, auth=True)
+def send_message_batch(req):
+    items = req.body.get('messages')
+    if not isinstance(items, list) or not items or len(items) > BATCH_MAX_SIZE:
+        return error(400, f'messages must be a list of 1 to {BATCH_MAX_SIZE} items')
+    
+    results = send_batch(req.cur, req.user_id, items)
+    req.conn.commit()
+    sent = sum(1 for r in results if r['status'] in (201, 202))
+    
+    return respond(200, {
+        'results': results,
+        'sent': sent,
+        'failed': len(results) - sent
+    })
+
+@router.route('POST', auth=True)
+def send_message(req):
+    user_id = req.user_id
+    recipient_id = req.body.get('recipient_id')
+    message_text = req.body.get('message_text', '').strip()
+    
+    if not recipient_id or not message_text or not str(recipient_id).isdigit() or int(recipient_id) == user_id:
+        return error(400, 'recipient_id and message_text required')
+    
+    cur = req.cur
+    recipient_id = int(recipient_id)
+    chat_id = resolve_chats(cur, user_id, [recipient_id]).get(recipient_id)
+    
+    if not chat_id:
+        return error(404, 'Recipient not found')
+    
+    if INGEST_MODE == 'queued':
+        message = enqueue(cur, [(0, chat_id, user_id, recipient_id, message_text)])[0]
+        req.conn.commit()
+        return respond(202, {
+            'message': {'id': message['id'], 'sent_at': message['sent_at']},
+            'chat_id': chat_id
+        })
+    
+    lock_chats(cur, [chat_id])
+    cur.execute(f"""
+        WITH msg AS (
+            INSERT INTO messages (chat_id, sender_id, message_text, sent_at)
+            SELECT %s, %s, %s, clock_timestamp()
+            WHERE NOT EXISTS (SELECT 1 FROM users su WHERE su.id = %s AND su.suspended_at IS NOT NULL)
+            RETURNING id, chat_id, sender_id, message_text, sent_at
+        ), summary AS (
+            UPDATE chat_summary s SET
+                {summary_last('msg')},
+                unread_count = s.unread_count + CASE WHEN s.user_id = msg.sender_id THEN 0 ELSE 1 END,
+                change_xid = pg_current_xact_id(),
+                change_seq = nextval('change_seq')
+            FROM msg
+            WHERE s.chat_id = msg.chat_id
+        ), notified AS (
+            SELECT pg_notify(%s, json_build_object(
+                'id', msg.id, 'chat_id', msg.chat_id, 'sender_id', msg.sender_id, 'recipient_id', %s::int,
+                'sent_at', msg.sent_at
+            )::text)
+            FROM msg
+        )
+        SELECT msg.id, msg.sent_at FROM msg, notified
+    """, (chat_id, user_id, message_text, user_id, NOTIFY_CHANNEL, recipient_id))
+    message = cur.fetchone()
+    if not message:
+        raise HttpError(403, 'Account suspended')
+    req.conn.commit()
+    
+    return respond(201, {
+        'message': message,
+        'chat_id': chat_id
+    })
+
+def handler(event: dict, context) -> dict:
+    """API для отправки и получения сообщений"""
+    return router(event, context)
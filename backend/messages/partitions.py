@@ -0,0 +1,158 @@
+"""Обслуживание помесячных секций таблицы messages
+
+Запуск (раз в сутки по расписанию):
+    DATABASE_URL=postgres://... python backend/messages/partitions.py --ahead 3 --keep 12 --archive-dir /var/archive/messages
+
+Создаёт секции на --ahead месяцев вперёд и переносит в них строки, осевшие в messages_default.
+Секции старше --keep месяцев отсоединяются, выгружаются в <archive-dir>/<секция>.csv.gz через COPY
+и удаляются только после сверки числа строк в архиве с числом строк в секции.
+"""
+import argparse
+import gzip
+import json
+import os
+import re
+import shutil
+import time
+from datetime import date
+import psycopg2
+
+PARTITION_NAME = re.compile(r'^messages_y(\d{4})m(\d{2})$')
+DEFAULT_PARTITION = 'messages_default'
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(month: date) -> str:
+    return f'messages_y{month.year:04d}m{month.month:02d}'
+
+def log(event: str, **fields):
+    print(json.dumps({'event': event, 'ts': round(time.time(), 3), **fields}, ensure_ascii=False, default=str), flush=True)
+
+def list_partitions(cur) -> dict:
+    """Помесячные секции: присоединённые и отсоединённые, но ещё не заархивированные"""
+    cur.execute("""
+        SELECT c.relname, c.relispartition
+        FROM pg_class c
+        WHERE c.relnamespace = (SELECT relnamespace FROM pg_class WHERE oid = 'messages'::regclass)
+          AND c.relkind = 'r' AND c.relname LIKE 'messages\\_y%'
+    """)
+    partitions = {}
+    for name, attached in cur.fetchall():
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = (name, attached)
+    return partitions
+
+def stored_columns(cur) -> str:
+    """Столбцы messages без вычисляемых, через запятую"""
+    cur.execute("""
+        SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum)
+        FROM pg_attribute
+        WHERE attrelid = 'messages'::regclass AND attnum > 0 AND NOT attisdropped AND attgenerated = ''
+    """)
+    return cur.fetchone()[0]
+
+def ensure_partitions(conn, first_month: date, last_month: date) -> list:
+    """Создаёт недостающие секции в диапазоне месяцев; строки из секции по умолчанию переносятся в новую"""
+    created = []
+    with conn.cursor() as cur:
+        existing = list_partitions(cur)
+        month = first_month
+        while month <= last_month:
+            if month not in existing:
+                name, upper = partition_name(month), add_months(month, 1)
+                cur.execute(
+                    f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE sent_at >= %s AND sent_at < %s)",
+                    (month, upper)
+                )
+                if cur.fetchone()[0]:
+                    # Присоединение проверяет секцию по умолчанию, поэтому её строки сначала переносятся.
+                    # Вычисляемые столбцы (search_vector) должны остаться вычисляемыми, иначе ATTACH откажет,
+                    # и при переносе не перечисляются: секция вычисляет их сама
+                    cur.execute(f"CREATE TABLE {name} (LIKE messages INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED)")
+                    columns = stored_columns(cur)
+                    cur.execute(f"""
+                        WITH moved AS (
+                            DELETE FROM {DEFAULT_PARTITION} WHERE sent_at >= %s AND sent_at < %s
+                            RETURNING {columns}
+                        )
+                        INSERT INTO {name} ({columns}) SELECT {columns} FROM moved
+                    """, (month, upper))
+                    moved = cur.rowcount
+                    cur.execute(f"ALTER TABLE messages ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", (month, upper))
+                else:
+                    moved = 0
+                    cur.execute(f"CREATE TABLE {name} PARTITION OF messages FOR VALUES FROM (%s) TO (%s)", (month, upper))
+                conn.commit()
+                created.append(name)
+                log('partition_created', partition=name, moved_from_default=moved)
+            month = add_months(month, 1)
+    return created
+
+def archive_partition(conn, name: str, archive_dir: str) -> int:
+    """Выгружает отсоединённую секцию в gzip-файл и удаляет её; возвращает число строк"""
+    path = os.path.join(archive_dir, f'{name}.csv.gz')
+    partial = path + '.partial'
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT COUNT(*) FROM {name}")
+        expected = cur.fetchone()[0]
+        with gzip.open(partial, 'wb') as f:
+            cur.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER true)", f)
+        conn.rollback()
+
+        with gzip.open(partial, 'rb') as f:
+            written = sum(1 for _ in f) - 1
+        # Переводы строк внутри текста сообщений делают число строк файла больше числа записей, но не меньше
+        if written < expected:
+            raise RuntimeError(f'{name}: archived {written} lines, expected at least {expected} rows')
+        with open(partial, 'rb') as f:
+            os.fsync(f.fileno())
+        shutil.move(partial, path)
+
+        cur.execute(f"DROP TABLE {name}")
+        conn.commit()
+    return expected
+
+def archive_partitions(conn, before_month: date, archive_dir: str) -> list:
+    """Отсоединяет и архивирует секции, целиком лежащие раньше before_month"""
+    os.makedirs(archive_dir, exist_ok=True)
+    archived = []
+    with conn.cursor() as cur:
+        partitions = list_partitions(cur)
+    for month, (name, attached) in sorted(partitions.items()):
+        if month >= before_month:
+            continue
+        if attached:
+            with conn.cursor() as cur:
+                cur.execute(f"ALTER TABLE messages DETACH PARTITION {name}")
+            conn.commit()
+        # Отсоединённая секция без архива (прошлый запуск упал после DETACH) подхватывается здесь же
+        rows = archive_partition(conn, name, archive_dir)
+        archived.append(name)
+        log('partition_archived', partition=name, rows=rows, path=os.path.join(archive_dir, f'{name}.csv.gz'))
+    return archived
+
+def main():
+    parser = argparse.ArgumentParser(description='Секции таблицы messages: создание и архивация')
+    parser.add_argument('--ahead', type=int, default=3, help='сколько месяцев вперёд держать готовыми')
+    parser.add_argument('--keep', type=int, default=12, help='сколько месяцев истории оставлять в БД; 0 отключает архивацию')
+    parser.add_argument('--archive-dir', default=os.environ.get('MESSAGES_ARCHIVE_DIR', 'archive/messages'))
+    args = parser.parse_args()
+
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        raise SystemExit('DATABASE_URL is not configured')
+
+    current = date.today().replace(day=1)
+    conn = psycopg2.connect(dsn)
+    try:
+        ensure_partitions(conn, current, add_months(current, args.ahead))
+        if args.keep > 0:
+            archive_partitions(conn, add_months(current, -args.keep), args.archive_dir)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Периодический сброс отметок присутствия в users.last_seen
+
+Запуск: DATABASE_URL=postgres://... python backend/messages/presence.py --interval 30 --granularity 60
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import psycopg2
+
+# common — копия backend/common (backend/vendor_common.py): каталог функции разворачивается отдельно
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common.presence import flush
+
+def main():
+    parser = argparse.ArgumentParser(description='Сброс присутствия в users.last_seen')
+    parser.add_argument('--interval', type=float, default=30.0, help='пауза между сбросами, секунды')
+    parser.add_argument('--granularity', type=int, default=60, help='минимальный шаг last_seen для онлайн-пользователя, секунды')
+    args = parser.parse_args()
+
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        raise SystemExit('DATABASE_URL is not configured')
+
+    conn = psycopg2.connect(dsn)
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                result = flush(conn, args.granularity)
+            except psycopg2.Error as e:
+                print(json.dumps({'event': 'presence_flush_failed', 'error': str(e).strip(), 'ts': time.time()}), flush=True)
+                if conn.closed:
+                    conn = psycopg2.connect(dsn)
+                else:
+                    conn.rollback()
+            else:
+                print(json.dumps({
+                    'event': 'presence_flush', 'ts': round(time.time(), 3), **result,
+                    'duration_ms': round((time.perf_counter() - started) * 1000, 1),
+                }), flush=True)
+            time.sleep(args.interval)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
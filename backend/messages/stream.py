@@ -0,0 +1,482 @@
+"""SSE-сервис доставки новых сообщений в реальном времени через Postgres LISTEN/NOTIFY
+
+Запуск: DATABASE_URL=postgres://... python backend/messages/stream.py --port 8081
+Клиент подключается к GET /events?token=<токен из auth> и получает события `message`.
+Переподключение с заголовком Last-Event-ID (или ?last_id=) досылает пропущенные сообщения из БД.
+
+id события — не id сообщения, а горизонт x<xid>: все транзакции с меньшим xid завершились и уже
+доставлены. id сообщений выдаются при вставке, а коммитятся в другом порядке, поэтому досылка идёт
+по (change_xid, change_seq) от горизонта, а повторы отсекаются по id сообщения.
+GET /export?chat_id=<id>&token=<токен> отдаёт всю историю чата потоком (chunked): строки читаются
+именованным курсором пачками по EXPORT_CHUNK_ROWS и кодируются из кортежей, память на выгрузку постоянна.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import sys
+import time
+from urllib.parse import urlsplit, parse_qs
+import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import RealDictCursor
+
+# common — копия backend/common (backend/vendor_common.py): каталог функции разворачивается отдельно
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common.auth import SUSPENDED_SQL, authenticate, configured
+from common.jsonenc import dumps, encode_rows
+from common.presence import TOUCH_SQL, HEARTBEAT_MIN_INTERVAL
+
+NOTIFY_CHANNEL = 'new_message'
+QUEUE_SIZE = 256
+REPLAY_LIMIT = 500
+PING_INTERVAL = 15.0
+SEEN_WINDOW = 2048
+LISTEN_RETRY_MAX = 30.0
+# Пустой элемент очереди подписчика: досылка из БД после переподключения слушателя
+REPLAY = None
+EVENT_FIELDS = ('id', 'chat_id', 'message_text', 'sent_at', 'sender_id', 'sender_username')
+EXPORT_CHUNK_ROWS = 2000
+EXPORT_COLUMNS = ('id', 'sender_id', 'message_text', 'sent_at')
+EXPORT_SQL = f"""
+    SELECT {', '.join(EXPORT_COLUMNS)}
+    FROM messages
+    WHERE chat_id = %s AND deleted_at IS NULL
+    ORDER BY sent_at, id
+"""
+
+class Subscriber:
+    def __init__(self, user_id: int, horizon, queue_size: int):
+        self.user_id = user_id
+        self.horizon = horizon
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+        self._seen = collections.deque(maxlen=SEEN_WINDOW)
+        self._seen_ids = set()
+
+    def offer(self, event) -> bool:
+        """Кладёт событие в очередь; переполненный подписчик отключается и догоняет через replay"""
+        if self.overflowed:
+            return False
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            self.overflowed = True
+            return False
+
+    def first_delivery(self, message_id: int) -> bool:
+        """False, если сообщение уже ушло: досылка и живой поток пересекаются"""
+        if message_id in self._seen_ids:
+            return False
+        if len(self._seen) == self._seen.maxlen:
+            self._seen_ids.discard(self._seen[0])
+        self._seen.append(message_id)
+        self._seen_ids.add(message_id)
+        return True
+
+class Hub:
+    """Подписки по пользователям и разбор уведомлений из Postgres"""
+
+    def __init__(self, dsn: str, queue_size: int = QUEUE_SIZE):
+        self.dsn = dsn
+        self.queue_size = queue_size
+        self.subscribers = {}
+        self.stats = {'notifications': 0, 'delivered': 0, 'overflows': 0, 'replayed': 0, 'listener_reconnects': 0}
+        self._listen_conn = None
+        self._query_conn = None
+        self._presence_conn = None
+        self._query_lock = asyncio.Lock()
+        self._batches = asyncio.Queue()
+
+    def subscribe(self, user_id: int, horizon) -> Subscriber:
+        sub = Subscriber(user_id, horizon, self.queue_size)
+        self.subscribers.setdefault(user_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        subs = self.subscribers.get(sub.user_id)
+        if subs:
+            subs.discard(sub)
+            if not subs:
+                del self.subscribers[sub.user_id]
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._listen_conn = self._listen()
+        loop.add_reader(self._listen_conn.fileno(), self._on_readable)
+        loop.create_task(self._deliver_batches())
+        loop.create_task(self._touch_presence())
+
+    def _listen(self):
+        # keepalive закрывает соединение, пропавшее без RST, и сокет становится читаемым с ошибкой
+        conn = psycopg2.connect(self.dsn, keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=3)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            cur.execute(f'LISTEN {NOTIFY_CHANNEL}')
+        return conn
+
+    def _listener_lost(self, error: Exception):
+        loop = asyncio.get_running_loop()
+        loop.remove_reader(self._listen_conn.fileno())
+        self._listen_conn.close()
+        print(json.dumps({'event': 'listener_lost', 'error': str(error).strip(), 'ts': time.time()}), flush=True)
+        loop.create_task(self._relisten())
+
+    async def _relisten(self):
+        """Переподключает слушателя; уведомления за время простоя потеряны, поэтому все подписчики досылают из БД"""
+        loop = asyncio.get_running_loop()
+        delay = 0.5
+        while True:
+            try:
+                self._listen_conn = await loop.run_in_executor(None, self._listen)
+                break
+            except psycopg2.Error as e:
+                print(json.dumps({'event': 'listen_failed', 'error': str(e).strip(), 'ts': time.time()}), flush=True)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, LISTEN_RETRY_MAX)
+        loop.add_reader(self._listen_conn.fileno(), self._on_readable)
+        self.stats['listener_reconnects'] += 1
+        for subs in list(self.subscribers.values()):
+            for sub in list(subs):
+                sub.offer(REPLAY)
+
+    async def _touch_presence(self):
+        """Подключённые к потоку пользователи онлайн: их отметки обновляются одной вставкой"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(HEARTBEAT_MIN_INTERVAL)
+            if not self.subscribers:
+                continue
+            try:
+                await loop.run_in_executor(None, self._touch_sync, list(self.subscribers))
+            except psycopg2.Error as e:
+                print(json.dumps({'event': 'presence_touch_failed', 'error': str(e).strip(), 'ts': time.time()}), flush=True)
+
+    def _touch_sync(self, user_ids: list):
+        if self._presence_conn is None or self._presence_conn.closed:
+            self._presence_conn = psycopg2.connect(self.dsn)
+            self._presence_conn.autocommit = True
+        with self._presence_conn.cursor() as cur:
+            cur.execute(TOUCH_SQL, (user_ids,))
+
+    def _on_readable(self):
+        try:
+            self._listen_conn.poll()
+            if not self._listen_conn.notifies:
+                return
+            # Горизонт снимается на этом же соединении: ответ приходит после уведомлений всех транзакций,
+            # завершившихся до снимка, поэтому всё ниже горизонта уже лежит в notifies
+            with self._listen_conn.cursor() as cur:
+                cur.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint")
+                horizon = cur.fetchone()[0]
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            self._listener_lost(e)
+            return
+        notifies = self._listen_conn.notifies
+        batch = []
+        while notifies:
+            try:
+                batch.append(json.loads(notifies.pop(0).payload))
+            except ValueError:
+                continue
+        self.stats['notifications'] += len(batch)
+        routed = [n for n in batch if n.get('sender_id') in self.subscribers or n.get('recipient_id') in self.subscribers]
+        self._batches.put_nowait((horizon, routed))
+
+    async def _deliver_batches(self):
+        """Пачки разбираются по одной, чтобы горизонты событий у подписчика не убывали"""
+        while True:
+            horizon, routed = await self._batches.get()
+            try:
+                await self._deliver(horizon, routed)
+            except psycopg2.Error as e:
+                # Недоставленное подписчики получат досылкой: горизонт этой пачки им не выдан
+                print(json.dumps({'event': 'deliver_failed', 'error': str(e).strip(), 'ts': time.time()}), flush=True)
+                for n in routed:
+                    for user_id in {n.get('sender_id'), n.get('recipient_id')}:
+                        for sub in list(self.subscribers.get(user_id, ())):
+                            sub.offer(REPLAY)
+
+    async def _deliver(self, horizon: int, routed: list):
+        if not routed:
+            return
+        rows = await self.query("""
+            SELECT m.id, m.chat_id, m.message_text, m.sent_at,
+                   u.id as sender_id, u.username as sender_username
+            FROM messages m
+            JOIN users u ON m.sender_id = u.id
+            WHERE m.id = ANY(%s) AND m.sent_at >= %s::timestamp AND m.deleted_at IS NULL
+        """, ([n['id'] for n in routed], min(n.get('sent_at') or '-infinity' for n in routed)))
+        by_id = {r['id']: r for r in rows}
+        for n in routed:
+            row = by_id.get(n['id'])
+            if not row:
+                continue
+            for user_id in {n.get('sender_id'), n.get('recipient_id')}:
+                for sub in list(self.subscribers.get(user_id, ())):
+                    if sub.offer((horizon, row)):
+                        self.stats['delivered'] += 1
+                    else:
+                        self.stats['overflows'] += 1
+
+    async def horizon(self) -> int:
+        rows = await self.query("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint as horizon", ())
+        return rows[0]['horizon']
+
+    async def replay(self, user_id: int, after: tuple, min_id: int = 0) -> list:
+        """Сообщения чатов пользователя после ключа (change_xid, change_seq) в порядке ключа"""
+        rows = await self.query("""
+            SELECT m.id, m.chat_id, m.message_text, m.sent_at,
+                   u.id as sender_id, u.username as sender_username,
+                   m.change_xid::text::bigint as change_xid, m.change_seq
+            FROM chat_participants cp
+            CROSS JOIN LATERAL (
+                SELECT id, chat_id, sender_id, message_text, sent_at, change_xid, change_seq
+                FROM messages
+                WHERE chat_id = cp.chat_id
+                  AND (change_xid, change_seq) > (%s::text::xid8, %s)
+                  AND id > %s AND deleted_at IS NULL
+                ORDER BY change_xid, change_seq
+                LIMIT %s
+            ) m
+            JOIN users u ON m.sender_id = u.id
+            WHERE cp.user_id = %s
+            ORDER BY m.change_xid, m.change_seq
+            LIMIT %s
+        """, (after[0], after[1], min_id, REPLAY_LIMIT, user_id, REPLAY_LIMIT))
+        self.stats['replayed'] += len(rows)
+        return rows
+
+    async def query(self, sql: str, params: tuple) -> list:
+        async with self._query_lock:
+            return await asyncio.get_running_loop().run_in_executor(None, self._query_sync, sql, params)
+
+    def _query_sync(self, sql: str, params: tuple) -> list:
+        if self._query_conn is None or self._query_conn.closed:
+            self._query_conn = psycopg2.connect(self.dsn)
+            self._query_conn.set_session(readonly=True, autocommit=True)
+        try:
+            with self._query_conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(sql, params)
+                return cur.fetchall()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self._query_conn.close()
+            raise
+
+    def snapshot(self) -> dict:
+        return dict(
+            self.stats,
+            users=len(self.subscribers),
+            connections=sum(len(s) for s in self.subscribers.values()),
+        )
+
+def export_chunks(conn, chat_id: int, chunk_rows: int = EXPORT_CHUNK_ROWS):
+    """История чата пачками кортежей из серверного курсора: в памяти не больше одной пачки"""
+    with conn.cursor(name=f'export_{chat_id}') as cur:
+        cur.itersize = chunk_rows
+        cur.execute(EXPORT_SQL, (chat_id,))
+        while True:
+            rows = cur.fetchmany(chunk_rows)
+            if not rows:
+                break
+            yield rows
+
+def open_export(dsn: str, user_id: int, chat_id: int):
+    """Отдельное соединение на выгрузку и участники чата; (None, None), если пользователь не участник"""
+    conn = psycopg2.connect(dsn)
+    conn.set_session(readonly=True)
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT u.id, u.username
+            FROM chat_participants cp
+            JOIN users u ON u.id = cp.user_id
+            WHERE cp.chat_id = %s
+        """, (chat_id,))
+        participants = cur.fetchall()
+    if not any(p['id'] == user_id for p in participants):
+        conn.close()
+        return None, None
+    return conn, participants
+
+def chunk(data: bytes) -> bytes:
+    return f'{len(data):x}\r\n'.encode() + data + b'\r\n'
+
+async def serve_export(hub: Hub, writer, user_id: int, chat_id: int):
+    loop = asyncio.get_running_loop()
+    conn, participants = await loop.run_in_executor(None, open_export, hub.dsn, user_id, chat_id)
+    if conn is None:
+        await write_response(writer, '404 Not Found', {'error': 'Chat not found'})
+        return
+    try:
+        writer.write(
+            b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nTransfer-Encoding: chunked\r\n'
+            b'Access-Control-Allow-Origin: *\r\nConnection: close\r\n\r\n'
+        )
+        head = dumps({'chat_id': chat_id, 'participants': participants, 'columns': EXPORT_COLUMNS})
+        writer.write(chunk(f'{head[:-1]},"rows":['.encode()))
+        rows_iter = export_chunks(conn, chat_id)
+        separator = ''
+        while True:
+            rows = await loop.run_in_executor(None, next, rows_iter, None)
+            if rows is None:
+                break
+            writer.write(chunk((separator + encode_rows(rows)).encode()))
+            separator = ','
+            # Следующая пачка читается, только когда предыдущая ушла в сокет
+            await writer.drain()
+        writer.write(chunk(b']}') + b'0\r\n\r\n')
+        await writer.drain()
+    finally:
+        await loop.run_in_executor(None, conn.close)
+
+def format_event(row: dict, horizon) -> bytes:
+    data = dumps({key: row[key] for key in EVENT_FIELDS})
+    event_id = f'id: x{horizon}\n' if horizon is not None else ''
+    return f'{event_id}event: message\ndata: {data}\n\n'.encode()
+
+def parse_last_event_id(value: str):
+    """(горизонт, id сообщения): x<xid> — горизонт; число — id сообщения от прежней версии сервиса"""
+    value = (value or '').strip()
+    if value.startswith('x') and value[1:].isdigit():
+        return int(value[1:]), 0
+    if value.isdigit() and int(value):
+        return None, int(value)
+    return None, 0
+
+async def write_response(writer, status: str, body: dict):
+    payload = json.dumps(body).encode()
+    writer.write(
+        f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\nAccess-Control-Allow-Origin: *\r\n'
+        f'Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n'.encode() + payload
+    )
+    await writer.drain()
+
+async def replay_into(hub: Hub, writer, sub: Subscriber, min_id: int = 0):
+    """Досылает всё от горизонта подписчика и сдвигает его до горизонта, снятого перед досылкой
+
+    Транзакции ниже нового горизонта завершились до первого запроса досылки, значит видны ей.
+    Досланные события несут старый горизонт, новый уходит отдельным событием без данных.
+    """
+    horizon = await hub.horizon()
+    after = (sub.horizon or 0, 0)
+    while True:
+        rows = await hub.replay(sub.user_id, after, min_id)
+        for row in rows:
+            if sub.first_delivery(row['id']):
+                writer.write(format_event(row, sub.horizon))
+        await writer.drain()
+        if len(rows) < REPLAY_LIMIT:
+            break
+        after = (rows[-1]['change_xid'], rows[-1]['change_seq'])
+    sub.horizon = max(sub.horizon or 0, horizon)
+    writer.write(f'id: x{sub.horizon}\n\n'.encode())
+    await writer.drain()
+
+async def serve_events(hub: Hub, writer, user_id: int, horizon, legacy_last_id: int):
+    sub = hub.subscribe(user_id, horizon)
+    try:
+        writer.write(
+            b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n'
+            b'Access-Control-Allow-Origin: *\r\nConnection: keep-alive\r\n\r\nretry: 2000\n\n'
+        )
+        if horizon is not None or legacy_last_id:
+            await replay_into(hub, writer, sub, legacy_last_id)
+
+        while True:
+            try:
+                item = await asyncio.wait_for(sub.queue.get(), PING_INTERVAL)
+            except asyncio.TimeoutError:
+                writer.write(b': ping\n\n')
+                await writer.drain()
+                continue
+            if sub.overflowed:
+                break
+            if item is REPLAY:
+                await replay_into(hub, writer, sub)
+                continue
+            event_horizon, row = item
+            # Горизонт события не ниже уже выданного: пачки разбираются по порядку
+            sub.horizon = max(sub.horizon or 0, event_horizon)
+            if sub.first_delivery(row['id']):
+                writer.write(format_event(row, sub.horizon))
+                await writer.drain()
+    finally:
+        hub.unsubscribe(sub)
+
+async def handle_client(hub: Hub, reader, writer):
+    try:
+        request_line = (await reader.readline()).decode('latin-1').split()
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1')
+            if line in ('\r\n', '\n', ''):
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if len(request_line) < 2 or request_line[0] != 'GET':
+            await write_response(writer, '405 Method Not Allowed', {'error': 'Method not allowed'})
+            return
+
+        url = urlsplit(request_line[1])
+        qsp = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        if url.path == '/health':
+            await write_response(writer, '200 OK', hub.snapshot())
+            return
+        if url.path not in ('/events', '/export'):
+            await write_response(writer, '404 Not Found', {'error': 'Endpoint not found'})
+            return
+
+        # EventSource не умеет передавать заголовки, поэтому токен допускается и в query
+        claims = authenticate({
+            'x-auth-token': qsp.get('token') or headers.get('x-auth-token'),
+            'x-user-id': qsp.get('user_id') or headers.get('x-user-id'),
+        })
+        horizon, legacy_last_id = parse_last_event_id(headers.get('last-event-id') or qsp.get('last_id'))
+        if not claims:
+            await write_response(writer, '401 Unauthorized', {'error': 'Authentication required'})
+            return
+        # Блокировка проверяется только при подключении: уже открытый поток живёт до переподключения
+        user = await hub.query(SUSPENDED_SQL, (claims['uid'],))
+        if not user or user[0]['suspended']:
+            await write_response(writer, '403 Forbidden', {'error': 'Account suspended'})
+            return
+
+        if url.path == '/export':
+            if not qsp.get('chat_id', '').isdigit():
+                await write_response(writer, '400 Bad Request', {'error': 'chat_id required'})
+                return
+            await serve_export(hub, writer, claims['uid'], int(qsp['chat_id']))
+            return
+
+        await serve_events(hub, writer, claims['uid'], horizon, legacy_last_id)
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def main(host: str, port: int, queue_size: int):
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        raise SystemExit('DATABASE_URL is not configured')
+    if not configured():
+        raise SystemExit('AUTH_TOKEN_SECRET is not configured (AUTH_DEV_MODE=1 for a local stand)')
+
+    hub = Hub(dsn, queue_size)
+    await hub.start()
+    server = await asyncio.start_server(lambda r, w: handle_client(hub, r, w), host, port)
+    print(json.dumps({'event': 'stream_started', 'host': host, 'port': port, 'ts': time.time()}))
+    async with server:
+        await server.serve_forever()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='SSE-доставка новых сообщений')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE)
+    args = parser.parse_args()
+    asyncio.run(main(args.host, args.port, args.queue_size))
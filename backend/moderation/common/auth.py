@@ -0,0 +1,128 @@
+"""Подписанные токены сессии: выдаются auth, проверяются в каждой функции без обращения к БД
+
+Токен сессии выдаётся только владельцу подтверждённого телефона: sms после верного кода отдаёт
+короткоживущее подтверждение телефона, подписанное тем же секретом, auth его проверяет и гасит
+по nonce (одно подтверждение — один вход).
+
+Токены живут AUTH_TOKEN_TTL и не отзываются. Блокировка (users.suspended_at) поэтому проверяется
+отдельно на каждом аутентифицированном запросе. Ответ кэшируется в памяти процесса на
+SUSPENSION_CHECK_TTL секунд, так что заблокированный теряет доступ не позже чем через столько.
+
+Без AUTH_TOKEN_SECRET функции отвечают 500 на всё, что требует аутентификации. Локальный стенд
+без секрета включается явно, AUTH_DEV_MODE=1: тогда X-User-Id принимается на веру, а токены случайные.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+from common.cache import TTLCache
+from common.http import HttpError
+
+AUTH_TOKEN_SECRET = os.environ.get('AUTH_TOKEN_SECRET', '')
+AUTH_TOKEN_TTL = int(os.environ.get('AUTH_TOKEN_TTL', str(30 * 24 * 3600)))
+PHONE_PROOF_TTL = int(os.environ.get('PHONE_PROOF_TTL', '600'))
+# Учитывается только без секрета: секрет всегда включает проверку подписи
+AUTH_DEV_MODE = not AUTH_TOKEN_SECRET and os.environ.get('AUTH_DEV_MODE') == '1'
+
+SUSPENSION_CHECK_TTL = float(os.environ.get('SUSPENSION_CHECK_TTL', '30'))
+SUSPENDED_SQL = "SELECT suspended_at IS NOT NULL as suspended FROM t_p33435224_messenger_api_modern.users WHERE id = %s"
+
+_verified = TTLCache(4096, 300)
+_suspended = TTLCache(4096, SUSPENSION_CHECK_TTL)
+
+def b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+def b64decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+def sign(claims: dict) -> str:
+    """payload.signature: claims, подписанные HMAC-SHA256"""
+    payload = b64encode(json.dumps(claims, separators=(',', ':')).encode())
+    signature = b64encode(hmac.new(AUTH_TOKEN_SECRET.encode(), payload.encode(), hashlib.sha256).digest())
+    return f'{payload}.{signature}'
+
+def unsign(token: str):
+    """Claims подписанного значения или None, если подпись неверна или срок истёк"""
+    try:
+        payload, signature = token.split('.')
+        expected = hmac.new(AUTH_TOKEN_SECRET.encode(), payload.encode(), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, b64decode(signature)):
+            return None
+        claims = json.loads(b64decode(payload))
+    except (ValueError, TypeError, AttributeError):
+        return None
+    if not isinstance(claims, dict) or claims.get('exp', 0) < time.time():
+        return None
+    return claims
+
+def configured() -> bool:
+    return bool(AUTH_TOKEN_SECRET) or AUTH_DEV_MODE
+
+def require_configured():
+    """500 вместо молчаливого перехода на X-User-Id, если секрет забыли задать"""
+    if not configured():
+        raise HttpError(500, 'AUTH_TOKEN_SECRET is not configured')
+
+def issue_token(user: dict) -> str:
+    """Токен сессии: id пользователя, флаг админа и срок действия"""
+    require_configured()
+    if AUTH_DEV_MODE:
+        return secrets.token_urlsafe(32)
+    return sign({'uid': user['id'], 'adm': bool(user['is_admin']), 'exp': int(time.time()) + AUTH_TOKEN_TTL})
+
+def verify_token(token: str):
+    """Проверяет подпись и срок действия токена сессии; возвращает claims или None"""
+    claims = _verified.get(token)
+    if claims is None:
+        claims = unsign(token)
+        # Подтверждение телефона подписано тем же секретом, но сессией не является
+        if claims is None or 'uid' not in claims:
+            return None
+        _verified.set(token, claims)
+    if claims.get('exp', 0) < time.time():
+        _verified.pop(token)
+        return None
+    return claims
+
+def issue_phone_proof(phone: str):
+    """Подтверждение, что вызывающий ввёл верный код для phone; None на локальном стенде"""
+    require_configured()
+    if AUTH_DEV_MODE:
+        return None
+    return sign({'phone': phone, 'nonce': secrets.token_hex(16), 'exp': int(time.time()) + PHONE_PROOF_TTL})
+
+def verify_phone_proof(proof: str):
+    """Claims подтверждения {'phone', 'nonce', 'exp'} или None; погашено ли оно, проверяет вызывающий"""
+    claims = unsign(proof) if isinstance(proof, str) else None
+    if not claims or 'uid' in claims or not claims.get('phone') or not claims.get('nonce'):
+        return None
+    return claims
+
+def authenticate(headers: dict):
+    """Claims вызывающего: {'uid': ..., 'adm': ...} или None"""
+    require_configured()
+    if AUTH_TOKEN_SECRET:
+        token = headers.get('x-auth-token')
+        return verify_token(token) if token else None
+    # Локальный стенд: доверяем X-User-Id, права админа тогда берутся из БД
+    user_id = headers.get('x-user-id')
+    return {'uid': int(user_id), 'adm': None} if user_id and user_id.isdigit() else None
+
+def suspended(cur, user_id: int) -> bool:
+    """Заблокирован ли пользователь (или удалён); cur — курсор со строками-словарями"""
+    value = _suspended.get(user_id)
+    if value is None:
+        cur.execute(SUSPENDED_SQL, (user_id,))
+        row = cur.fetchone()
+        value = row is None or row['suspended']
+        _suspended.set(user_id, value)
+    return value
+
+def forget_suspension(user_ids):
+    """Сбрасывает кэш блокировки; другие экземпляры узнают не позже SUSPENSION_CHECK_TTL"""
+    for user_id in user_ids:
+        _suspended.pop(user_id)
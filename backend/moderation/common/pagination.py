@@ -0,0 +1,48 @@
+"""Курсоры keyset-пагинации по ключу (время, id), (релевантность, id) и курсор синхронизации"""
+import base64
+from datetime import datetime
+
+def encode_cursor(at: datetime, row_id: int) -> str:
+    raw = f'{at.isoformat()}|{row_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        at, row_id = raw.split('|')
+        return datetime.fromisoformat(at), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def parse_limit(value, default: int, maximum: int):
+    """Размер страницы в пределах 1..maximum; None, если значение не число"""
+    try:
+        return min(max(int(value or default), 1), maximum)
+    except ValueError:
+        return None
+
+def encode_rank_cursor(rank: float, row_id: int) -> str:
+    """Курсор выдачи, отсортированной по релевантности; repr сохраняет значение real без потерь"""
+    raw = f'{rank!r}|{row_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_rank_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        rank, row_id = raw.split('|')
+        return float(rank), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def encode_change_cursor(xid: int, seq: int) -> str:
+    """Курсор синхронизации: транзакция и номер изменения"""
+    raw = f'{xid}|{seq}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_change_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        xid, seq = raw.split('|')
+        return int(xid), int(seq)
+    except (ValueError, UnicodeDecodeError):
+        return None
@@ -1,149 +1,247 @@
-import json
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import sys
+
+# common — копия backend/common (backend/vendor_common.py): каталог функции разворачивается отдельно
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import profiles
+from common.auth import forget_suspension
+from common.cache import TTLCache
+from common.http import Router, HttpError, respond, error
+from common.pagination import encode_cursor, decode_cursor, parse_limit
+
+router = Router('GET, POST, PUT, OPTIONS', 'Content-Type, X-Auth-Token, X-User-Id')
+
+REPORT_STATUSES = ('pending', 'reviewed', 'resolved', 'rejected')
+BULK_MAX_REPORTS = 5000
+# Насколько назад мягко удаляются сообщения заблокированного пользователя, если не передано в запросе
+DELETE_MESSAGES_HOURS = 24
+DELETE_MESSAGES_MAX_HOURS = 24 * 30
+REPORTS_PAGE_SIZE = 50
+REPORTS_MAX_PAGE_SIZE = 200
+GROUP_REPORT_IDS = 20
+GROUP_REASONS = 3
+# Счётчики по статусам нужны на каждой странице панели; жалобы, поданные в другом экземпляре, видны через TTL
+REPORT_COUNTS_TTL = float(os.environ.get('REPORT_COUNTS_TTL', '30'))
+
+_counts_cache = TTLCache(1, REPORT_COUNTS_TTL)
+
+def report_counts(cur) -> dict:
+    counts = _counts_cache.get('counts')
+    if counts is None:
+        cur.execute("SELECT status, COUNT(*) as total FROM reports GROUP BY status")
+        counts = {row['status']: row['total'] for row in cur.fetchall()}
+        _counts_cache.set('counts', counts)
+    return counts
+
+def require_admin(req):
+    """Флаг админа берётся из токена; без подписанных токенов (локальный стенд) читается из БД"""
+    is_admin = req.claims['adm']
+    if is_admin is None:
+        req.cur.execute("SELECT is_admin FROM users WHERE id = %s", (req.user_id,))
+        user = req.cur.fetchone()
+        is_admin = bool(user and user['is_admin'])
+    if not is_admin:
+        raise HttpError(403, 'Admin access required')
+
+@router.route('POST', when=lambda req: req.body.get('reported_user_id'), auth=True)
+def submit_report(req):
+    reported_user_id = req.body.get('reported_user_id')
+    reason = req.body.get('reason', '').strip()
+
+    if not reported_user_id or not reason:
+        return error(400, 'reported_user_id and reason required')
+
+    cur = req.cur
+    cur.execute(
+        "INSERT INTO reports (reported_user_id, reported_by_user_id, reason) VALUES (%s, %s, %s) RETURNING id",
+        (reported_user_id, req.user_id, reason)
+    )
+    report = cur.fetchone()
+    req.conn.commit()
+    _counts_cache.pop('counts')
+
+    return respond(201, {'report_id': report['id'], 'message': 'Report submitted'})
+
+@router.route('GET', auth=True)
+def list_reports(req):
+    """Очередь жалоб: ?status=, ?limit=, ?before=<курсор>; ?view=grouped сворачивает жалобы на одного пользователя"""
+    require_admin(req)
+
+    qsp = req.query
+    status = qsp.get('status')
+    limit = parse_limit(qsp.get('limit'), REPORTS_PAGE_SIZE, REPORTS_MAX_PAGE_SIZE)
+    before = decode_cursor(qsp['before']) if qsp.get('before') else None
+
+    if status is not None and status not in REPORT_STATUSES:
+        return error(400, f'status must be one of: {", ".join(REPORT_STATUSES)}')
+    if limit is None or (qsp.get('before') and not before):
+        return error(400, 'Invalid pagination parameters')
+
+    cur = req.cur
+    if qsp.get('view') == 'grouped':
+        items, next_cursor = list_report_groups(cur, status, before, limit)
+        key = 'groups'
+    else:
+        items, next_cursor = list_report_page(cur, status, before, limit)
+        key = 'reports'
+
+    return respond(200, {key: items, 'next': next_cursor, 'counts': report_counts(cur)})
+
+def list_report_page(cur, status, before, limit: int):
+    filters = ['TRUE']
+    params = []
+    if status:
+        filters.append('status = %s')
+        params.append(status)
+    if before:
+        filters.append('(created_at, id) < (%s, %s)')
+        params.extend(before)
+
+    cur.execute(f"""
+        SELECT id, reason, status, created_at, reported_user_id, reported_by_user_id
+        FROM reports
+        WHERE {' AND '.join(filters)}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s
+    """, (*params, limit + 1))
+    reports = cur.fetchall()
+    last = reports[limit - 1] if len(reports) > limit else None
+    reports = reports[:limit]
+    # Имена подставляются из кэша профилей одной пачкой на обе роли
+    names = profiles.resolve(cur, [r['reported_user_id'] for r in reports] + [r['reported_by_user_id'] for r in reports])
+    for report in reports:
+        report['reported_username'] = names.get(report['reported_user_id'], {}).get('username')
+        report['reported_by_username'] = names.get(report.pop('reported_by_user_id'), {}).get('username')
+    return reports, encode_cursor(last['created_at'], last['id']) if last else None
+
+def list_report_groups(cur, status, before, limit: int):
+    """Жалобы, сгруппированные по пользователю, от последней жалобы к старым; курсор по (last_reported_at, reported_user_id)"""
+    where = 'status = %s' if status else 'TRUE'
+    having = '(MAX(created_at), reported_user_id) < (%s, %s)' if before else 'TRUE'
+    cur.execute(f"""
+        SELECT
+            reported_user_id,
+            COUNT(*) as report_count,
+            COUNT(DISTINCT reported_by_user_id) as reporter_count,
+            MIN(created_at) as first_reported_at,
+            MAX(created_at) as last_reported_at,
+            (array_agg(id ORDER BY created_at DESC, id DESC))[1:%s] as report_ids,
+            (array_agg(reason ORDER BY created_at DESC, id DESC))[1:%s] as reasons
+        FROM reports
+        WHERE {where}
+        GROUP BY reported_user_id
+        HAVING {having}
+        ORDER BY MAX(created_at) DESC, reported_user_id DESC
+        LIMIT %s
+    """, (GROUP_REPORT_IDS, GROUP_REASONS, *([status] if status else []), *(before or ()), limit + 1))
+    groups = cur.fetchall()
+    last = groups[limit - 1] if len(groups) > limit else None
+    groups = profiles.attach(cur, groups[:limit], 'reported_user_id', reported_username='username')
+    return groups, encode_cursor(last['last_reported_at'], last['reported_user_id']) if last else None
+
+@router.route('PUT', when=lambda req: 'report_ids' in req.body, auth=True)
+def bulk_action(req):
+    """Закрытие пачки жалоб одной транзакцией; по флагам блокирует авторов и мягко удаляет их свежие сообщения"""
+    require_admin(req)
+
+    body = req.body
+    report_ids = body.get('report_ids')
+    status = body.get('status', 'resolved')
+    suspend = body.get('suspend_users') is True
+    delete_hours = body.get('delete_messages_hours', DELETE_MESSAGES_HOURS if suspend else 0)
+
+    if (not isinstance(report_ids, list) or not report_ids or len(report_ids) > BULK_MAX_REPORTS
+            or not all(isinstance(i, int) and not isinstance(i, bool) for i in report_ids)):
+        return error(400, f'report_ids must be a list of 1 to {BULK_MAX_REPORTS} ids')
+    if status not in REPORT_STATUSES or status == 'pending':
+        return error(400, 'status must be one of: reviewed, resolved, rejected')
+    if not isinstance(delete_hours, int) or isinstance(delete_hours, bool) or not 0 <= delete_hours <= DELETE_MESSAGES_MAX_HOURS:
+        return error(400, f'delete_messages_hours must be 0 to {DELETE_MESSAGES_MAX_HOURS}')
+
+    cur = req.cur
+    cur.execute("""
+        WITH updated AS (
+            UPDATE reports SET status = %(status)s, reviewed_at = CURRENT_TIMESTAMP, reviewed_by_admin_id = %(admin)s
+            WHERE id = ANY(%(ids)s)
+            RETURNING reported_user_id
+        ), targets AS (
+            SELECT DISTINCT reported_user_id as user_id FROM updated
+        ), suspended AS (
+            UPDATE users SET suspended_at = CURRENT_TIMESTAMP, suspended_by_admin_id = %(admin)s
+            WHERE %(suspend)s AND id IN (SELECT user_id FROM targets) AND suspended_at IS NULL AND NOT COALESCE(is_admin, FALSE)
+            RETURNING id
+        ), offline AS (
+            DELETE FROM presence WHERE user_id IN (SELECT id FROM suspended)
+        ), deleted AS (
+            UPDATE messages SET deleted_at = CURRENT_TIMESTAMP, change_xid = pg_current_xact_id(), change_seq = nextval('change_seq')
+            WHERE %(hours)s > 0
+              AND sender_id IN (SELECT user_id FROM targets)
+              AND sent_at >= CURRENT_TIMESTAMP - %(hours)s * INTERVAL '1 hour'
+              AND deleted_at IS NULL
+            RETURNING id, chat_id
+        ), touched AS (
+            SELECT DISTINCT chat_id FROM deleted
+        ), summary AS (
+            -- Сводки затронутых чатов пересчитываются по оставшимся сообщениям. Удаление в этом же операторе
+            -- другим шагам не видно, поэтому удалённые строки исключаются явно
+            UPDATE chat_summary s SET
+                last_message_id = last.id,
+                last_message_text = last.message_text,
+                last_message_time = last.sent_at,
+                unread_count = (
+                    SELECT COUNT(*) FROM messages um
+                    WHERE um.chat_id = s.chat_id AND um.sender_id != s.user_id
+                      AND um.id > cp.last_read_message_id AND um.deleted_at IS NULL
+                      AND NOT EXISTS (SELECT 1 FROM deleted d WHERE d.id = um.id)
+                ),
+                change_xid = pg_current_xact_id(),
+                change_seq = nextval('change_seq')
+            FROM touched t
+            JOIN chat_participants cp ON cp.chat_id = t.chat_id
+            LEFT JOIN LATERAL (
+                SELECT m.id, m.message_text, m.sent_at
+                FROM messages m
+                WHERE m.chat_id = t.chat_id AND m.deleted_at IS NULL
+                  AND NOT EXISTS (SELECT 1 FROM deleted d WHERE d.id = m.id)
+                ORDER BY m.sent_at DESC, m.id DESC
+                LIMIT 1
+            ) last ON TRUE
+            WHERE s.chat_id = t.chat_id AND s.user_id = cp.user_id
+        )
+        SELECT
+            (SELECT COUNT(*) FROM updated) as reports_updated,
+            (SELECT COUNT(*) FROM targets) as users_reported,
+            (SELECT COUNT(*) FROM suspended) as users_suspended,
+            (SELECT COUNT(*) FROM deleted) as messages_deleted,
+            (SELECT COALESCE(array_agg(id), '{}') FROM suspended) as suspended_ids
+    """, {'status': status, 'admin': req.user_id, 'ids': report_ids, 'suspend': suspend, 'hours': delete_hours})
+    counts = cur.fetchone()
+    req.conn.commit()
+    _counts_cache.pop('counts')
+    forget_suspension(counts.pop('suspended_ids'))
+
+    return respond(200, counts)
+
+@router.route('PUT', auth=True)
+def update_report(req):
+    require_admin(req)
+
+    report_id = req.body.get('report_id')
+    status = req.body.get('status', 'resolved')
+
+    if not report_id:
+        return error(400, 'report_id required')
+
+    req.cur.execute(
+        "UPDATE reports SET status = %s, reviewed_at = CURRENT_TIMESTAMP, reviewed_by_admin_id = %s WHERE id = %s",
+        (status, req.user_id, report_id)
+    )
+    req.conn.commit()
+    _counts_cache.pop('counts')
+
+    return respond(200, {'message': 'Report updated'})
 
 def handler(event: dict, context) -> dict:
     """API для модерации и обработки жалоб"""
-    
-    method = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token, X-User-Id'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    dsn = os.environ.get('DATABASE_URL')
-    if not dsn:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Database not configured'}),
-            'isBase64Encoded': False
-        }
-    
-    conn = psycopg2.connect(dsn)
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
-    try:
-        user_id = event.get('headers', {}).get('x-user-id')
-        if not user_id:
-            return {
-                'statusCode': 401,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Authentication required'}),
-                'isBase64Encoded': False
-            }
-        
-        cur.execute("SELECT is_admin FROM users WHERE id = %s", (user_id,))
-        user = cur.fetchone()
-        
-        body_data = json.loads(event.get('body', '{}')) if event.get('body') else {}
-        
-        if method == 'POST' and body_data.get('reported_user_id'):
-            reported_user_id = body_data.get('reported_user_id')
-            reason = body_data.get('reason', '').strip()
-            
-            if not reported_user_id or not reason:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'reported_user_id and reason required'}),
-                    'isBase64Encoded': False
-                }
-            
-            cur.execute(
-                "INSERT INTO reports (reported_user_id, reported_by_user_id, reason) VALUES (%s, %s, %s) RETURNING id",
-                (reported_user_id, user_id, reason)
-            )
-            report = cur.fetchone()
-            conn.commit()
-            
-            return {
-                'statusCode': 201,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'report_id': report['id'], 'message': 'Report submitted'}),
-                'isBase64Encoded': False
-            }
-        
-        elif method == 'GET':
-            if not user or not user['is_admin']:
-                return {
-                    'statusCode': 403,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Admin access required'}),
-                    'isBase64Encoded': False
-                }
-            
-            cur.execute("""
-                SELECT 
-                    r.id, r.reason, r.status, r.created_at,
-                    u1.username as reported_username,
-                    u2.username as reported_by_username
-                FROM reports r
-                JOIN users u1 ON r.reported_user_id = u1.id
-                JOIN users u2 ON r.reported_by_user_id = u2.id
-                ORDER BY r.created_at DESC
-                LIMIT 50
-            """)
-            
-            reports = cur.fetchall()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'reports': [dict(r) for r in reports]}, default=str),
-                'isBase64Encoded': False
-            }
-        
-        elif method == 'PUT':
-            if not user or not user['is_admin']:
-                return {
-                    'statusCode': 403,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Admin access required'}),
-                    'isBase64Encoded': False
-                }
-            
-            body = json.loads(event.get('body', '{}'))
-            report_id = body.get('report_id')
-            status = body.get('status', 'resolved')
-            
-            if not report_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'report_id required'}),
-                    'isBase64Encoded': False
-                }
-            
-            cur.execute(
-                "UPDATE reports SET status = %s, reviewed_at = CURRENT_TIMESTAMP, reviewed_by_admin_id = %s WHERE id = %s",
-                (status, user_id, report_id)
-            )
-            conn.commit()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'message': 'Report updated'}),
-                'isBase64Encoded': False
-            }
-        
-        return {
-            'statusCode': 404,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Endpoint not found'}),
-            'isBase64Encoded': False
-        }
-    
-    finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+    return router(event, context)
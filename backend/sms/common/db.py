@@ -0,0 +1,102 @@
+import os
+import threading
+import time
+import psycopg2
+import psycopg2.extensions
+
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+POOL_WAIT_TIMEOUT = float(os.environ.get('DB_POOL_WAIT_TIMEOUT', '5'))
+POOL_PING_AFTER = 30.0
+
+class ConnectionPool:
+    """Пул соединений с БД, переживающий тёплые вызовы функции"""
+
+    def __init__(self, dsn: str, max_size: int = POOL_MAX_SIZE, wait_timeout: float = POOL_WAIT_TIMEOUT):
+        self.dsn = dsn
+        self.max_size = max_size
+        self.wait_timeout = wait_timeout
+        self.stats = {'hits': 0, 'misses': 0, 'waits': 0, 'wait_seconds': 0.0, 'discarded': 0}
+        self._idle = []
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+    def getconn(self):
+        with self._cond:
+            if not self._idle and self._in_use >= self.max_size:
+                self.stats['waits'] += 1
+                started = time.monotonic()
+                ready = self._cond.wait_for(lambda: self._idle or self._in_use < self.max_size, self.wait_timeout)
+                self.stats['wait_seconds'] += time.monotonic() - started
+                if not ready:
+                    raise psycopg2.OperationalError('Connection pool exhausted')
+            conn, released_at = self._idle.pop() if self._idle else (None, 0.0)
+            self._in_use += 1
+
+        try:
+            if conn is not None:
+                if self._is_alive(conn, time.monotonic() - released_at):
+                    self._count('hits')
+                    return conn
+                self._discard(conn)
+            self._count('misses')
+            return psycopg2.connect(self.dsn)
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn, broken: bool = False):
+        if not broken and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                broken = True
+
+        with self._cond:
+            self._in_use -= 1
+            keep = not broken and not conn.closed and len(self._idle) < self.max_size
+            if keep:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+        if not keep:
+            self._discard(conn)
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return dict(self.stats, idle=len(self._idle), in_use=self._in_use, max_size=self.max_size)
+
+    def _is_alive(self, conn, idle_for: float) -> bool:
+        if conn.closed or conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if idle_for < POOL_PING_AFTER:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _count(self, key: str):
+        # Проверка и соединение идут вне блокировки, счётчики — под ней, иначе += теряет обновления
+        with self._cond:
+            self.stats[key] += 1
+
+    def _discard(self, conn):
+        self._count('discarded')
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+_pool = None
+
+def get_pool(dsn: str) -> ConnectionPool:
+    global _pool
+    if _pool is None or _pool.dsn != dsn:
+        _pool = ConnectionPool(dsn)
+    return _pool
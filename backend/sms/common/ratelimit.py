@@ -0,0 +1,104 @@
+"""Ограничение частоты запросов корзинами токенов
+
+Каждая корзина задаётся ключом, ёмкостью и скоростью пополнения (токенов в секунду).
+Сначала проверяется корзина в памяти процесса: она видит только запросы своего экземпляра,
+поэтому если пуста она, пуста и общая, и запрос отклоняется без обращения к БД.
+Затем корзины списываются в общем хранилище: таблица rate_limits (RATE_LIMIT_STORE=postgres)
+или только память процесса (RATE_LIMIT_STORE=local, для локального стенда).
+"""
+import os
+import threading
+import time
+from common.http import JSON_HEADERS, respond
+
+RATE_LIMIT_STORE = os.environ.get('RATE_LIMIT_STORE', 'postgres')
+LOCAL_MAX_BUCKETS = 10000
+
+class Limit:
+    __slots__ = ('name', 'capacity', 'per_seconds')
+
+    def __init__(self, name: str, capacity: int, per_seconds: float):
+        self.name = name
+        self.capacity = capacity
+        self.per_seconds = per_seconds
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.per_seconds
+
+class LocalBuckets:
+    """Корзины в памяти процесса; при переполнении забываются самые старые"""
+
+    def __init__(self, max_size: int = LOCAL_MAX_BUCKETS):
+        self.max_size = max_size
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def peek(self, key: str, limit: Limit) -> float:
+        """Сколько секунд ждать до появления токена; 0, если токен есть"""
+        with self._lock:
+            tokens = self._refill(key, limit, time.monotonic())
+        return 0.0 if tokens >= 1 else (1 - tokens) / limit.rate
+
+    def take(self, key: str, limit: Limit) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens = self._refill(key, limit, now)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return 0.0
+            self._buckets[key] = (tokens, now)
+        return (1 - tokens) / limit.rate
+
+    def _refill(self, key: str, limit: Limit, now: float) -> float:
+        item = self._buckets.get(key)
+        if item is None:
+            if len(self._buckets) >= self.max_size:
+                del self._buckets[next(iter(self._buckets))]
+            return float(limit.capacity)
+        tokens, updated = item
+        return min(float(limit.capacity), tokens + (now - updated) * limit.rate)
+
+_local = LocalBuckets()
+
+def check(req, checks: list) -> float:
+    """Списывает по токену из каждой корзины [(Limit, значение)]; возвращает секунды до повтора или 0
+
+    Соединение с БД берётся только если локальные корзины пропустили запрос. Отказ не коммитится:
+    списанное в общем хранилище откатывается вместе с запросом.
+    """
+    keys = [(f'{limit.name}:{value}', limit) for limit, value in checks if value]
+    wait = max((_local.peek(key, limit) for key, limit in keys), default=0.0)
+    if wait:
+        return wait
+    waits = [_local.take(key, limit) for key, limit in keys]
+    if RATE_LIMIT_STORE != 'postgres' or not keys:
+        return max(waits, default=0.0)
+
+    # Ключи сортируются, чтобы параллельные запросы блокировали строки в одном порядке
+    keys.sort(key=lambda item: item[0])
+    cur = req.cur
+    cur.execute("""
+        INSERT INTO t_p33435224_messenger_api_modern.rate_limits AS b (bucket_key, tokens, refill_rate, updated_at)
+        SELECT k, c - 1, r, clock_timestamp()
+        FROM unnest(%s::text[], %s::float8[], %s::float8[]) AS t(k, c, r)
+        ON CONFLICT (bucket_key) DO UPDATE SET
+            tokens = GREATEST(LEAST(
+                EXCLUDED.tokens + 1,
+                b.tokens + EXTRACT(EPOCH FROM clock_timestamp() - b.updated_at)::float8 * EXCLUDED.refill_rate
+            ) - 1, -1),
+            refill_rate = EXCLUDED.refill_rate,
+            updated_at = clock_timestamp()
+        RETURNING bucket_key, tokens, refill_rate
+    """, (
+        [key for key, _ in keys],
+        [float(limit.capacity) for _, limit in keys],
+        [limit.rate for _, limit in keys],
+    ))
+    return max((-row['tokens'] / row['refill_rate'] for row in cur.fetchall() if row['tokens'] < 0), default=0.0)
+
+def throttled(retry_after: float) -> dict:
+    seconds = max(int(retry_after + 0.999), 1)
+    response = respond(429, {'error': 'Too many requests', 'retry_after': seconds})
+    response['headers'] = {**JSON_HEADERS, 'Retry-After': str(seconds)}
+    return response
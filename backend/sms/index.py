@@ -1,142 +1,118 @@
-import json
 import os
-import random
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import sys
+import hashlib
+import hmac
+import secrets
 from datetime import datetime, timedelta
 
+# common — копия backend/common (backend/vendor_common.py): каталог функции разворачивается отдельно
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import tracing
+from common.auth import AUTH_DEV_MODE, issue_phone_proof, require_configured
+from common.http import Router, respond, error
+from common.ratelimit import Limit, check, throttled
+
+router = Router('GET, POST, OPTIONS', 'Content-Type')
+
+SEND_PER_PHONE = Limit('sms_send_phone', 3, 600)
+SEND_PER_IP = Limit('sms_send_ip', 20, 3600)
+VERIFY_PER_PHONE = Limit('sms_verify_phone', 10, 600)
+VERIFY_PER_IP = Limit('sms_verify_ip', 60, 600)
+# После стольких неверных вводов код блокируется, нужен новый
+VERIFY_MAX_ATTEMPTS = 5
+CODE_TTL = timedelta(minutes=5)
+# Ключ HMAC для кодов: без него шестизначный код подбирается по хэшу из БД перебором
+CODE_SECRET = (os.environ.get('SMS_CODE_SECRET') or os.environ.get('AUTH_TOKEN_SECRET') or '').encode()
+
+def hash_code(phone: str, code: str) -> str:
+    return hmac.new(CODE_SECRET, f'{phone}:{code}'.encode(), hashlib.sha256).hexdigest()
+
+@router.route('POST', when=lambda req: req.body.get('action', 'send') == 'send')
+def send_code(req):
+    require_configured()
+    phone = req.body.get('phone', '').strip()
+
+    if not phone:
+        return error(400, 'Phone number required')
+
+    retry_after = check(req, [(SEND_PER_PHONE, phone), (SEND_PER_IP, req.client_ip)])
+    if retry_after:
+        return throttled(retry_after)
+
+    code = f'{secrets.randbelow(900000) + 100000}'
+
+    # Новый код заменяет предыдущий и сбрасывает счётчик попыток
+    cur = req.cur
+    cur.execute(
+        """INSERT INTO t_p33435224_messenger_api_modern.verification_codes
+           (phone, code_hash, expires_at)
+           VALUES (%s, %s, %s)
+           ON CONFLICT (phone) DO UPDATE SET
+               code_hash = EXCLUDED.code_hash,
+               expires_at = EXCLUDED.expires_at,
+               created_at = CURRENT_TIMESTAMP,
+               attempts = 0""",
+        (phone, hash_code(phone, code), datetime.now() + CODE_TTL)
+    )
+    req.conn.commit()
+
+    # Реальной отправки SMS нет: код виден только на локальном стенде, иначе подтверждение получил бы кто угодно
+    if not AUTH_DEV_MODE:
+        return respond(200, {'message': 'Код отправлен'})
+
+    # Сам код в лог не пишется: он уже в ответе, а лог хранится дольше кода
+    tracing.log('sms_code_issued', phone_suffix=phone[-4:])
+
+    return respond(200, {
+        'message': 'Код отправлен',
+        'dev_code': code
+    })
+
+@router.route('POST', when=lambda req: req.body.get('action') == 'verify')
+def verify_code(req):
+    # Код удаляется при проверке, поэтому без возможности выдать подтверждение не проверяем вовсе
+    require_configured()
+    phone = req.body.get('phone', '').strip()
+    code = req.body.get('code', '').strip()
+
+    if not phone:
+        return error(400, 'Phone number required')
+
+    if not code:
+        return error(400, 'Code required')
+
+    retry_after = check(req, [(VERIFY_PER_PHONE, phone), (VERIFY_PER_IP, req.client_ip)])
+    if retry_after:
+        return throttled(retry_after)
+
+    # Верный код удаляет строку сразу; сравниваются HMAC, поэтому время сравнения ничего не раскрывает
+    cur = req.cur
+    cur.execute(
+        """DELETE FROM t_p33435224_messenger_api_modern.verification_codes
+           WHERE phone = %s AND code_hash = %s AND expires_at > NOW() AND attempts < %s
+           RETURNING id""",
+        (phone, hash_code(phone, code), VERIFY_MAX_ATTEMPTS)
+    )
+    if cur.fetchone():
+        req.conn.commit()
+        return respond(200, {'message': 'Код подтвержден', 'verified': True, 'phone_token': issue_phone_proof(phone)})
+
+    cur.execute(
+        """UPDATE t_p33435224_messenger_api_modern.verification_codes
+           SET attempts = attempts + 1
+           WHERE phone = %s AND expires_at > NOW()
+           RETURNING attempts""",
+        (phone,)
+    )
+    verification = cur.fetchone()
+    req.conn.commit()
+
+    if verification and verification['attempts'] > VERIFY_MAX_ATTEMPTS:
+        return error(429, 'Слишком много попыток, запросите новый код')
+
+    return error(400, 'Неверный или истекший код')
+
 def handler(event: dict, context) -> dict:
     """API для отправки и проверки SMS кодов подтверждения"""
-    
-    method = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    dsn = os.environ.get('DATABASE_URL')
-    if not dsn:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Database not configured'}),
-            'isBase64Encoded': False
-        }
-    
-    conn = psycopg2.connect(dsn)
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    
-    try:
-        if method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action', 'send')
-            phone = body.get('phone', '').strip()
-            
-            if not phone:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Phone number required'}),
-                    'isBase64Encoded': False
-                }
-            
-            if action == 'send':
-                code = str(random.randint(100000, 999999))
-                expires_at = datetime.now() + timedelta(minutes=5)
-                
-                cur.execute(
-                    """UPDATE t_p33435224_messenger_api_modern.verification_codes 
-                       SET is_used = TRUE 
-                       WHERE phone = %s AND is_used = FALSE""",
-                    (phone,)
-                )
-                
-                cur.execute(
-                    """INSERT INTO t_p33435224_messenger_api_modern.verification_codes 
-                       (phone, code, expires_at) 
-                       VALUES (%s, %s, %s)""",
-                    (phone, code, expires_at)
-                )
-                conn.commit()
-                
-                print(f"SMS код для {phone}: {code}")
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'message': 'Код отправлен',
-                        'dev_code': code
-                    }),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'verify':
-                code = body.get('code', '').strip()
-                
-                if not code:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Code required'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute(
-                    """SELECT * FROM t_p33435224_messenger_api_modern.verification_codes 
-                       WHERE phone = %s AND code = %s AND is_used = FALSE 
-                       AND expires_at > NOW() 
-                       ORDER BY created_at DESC LIMIT 1""",
-                    (phone, code)
-                )
-                verification = cur.fetchone()
-                
-                if not verification:
-                    cur.execute(
-                        """UPDATE t_p33435224_messenger_api_modern.verification_codes 
-                           SET attempts = attempts + 1 
-                           WHERE phone = %s AND is_used = FALSE""",
-                        (phone,)
-                    )
-                    conn.commit()
-                    
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Неверный или истекший код'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute(
-                    """UPDATE t_p33435224_messenger_api_modern.verification_codes 
-                       SET is_used = TRUE 
-                       WHERE id = %s""",
-                    (verification['id'],)
-                )
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'message': 'Код подтвержден', 'verified': True}),
-                    'isBase64Encoded': False
-                }
-        
-        return {
-            'statusCode': 404,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Endpoint not found'}),
-            'isBase64Encoded': False
-        }
-    
-    finally:
-        cur.close()
-        conn.close()
+    return router(event, context)
@@ -0,0 +1,89 @@
+"""Удаление просроченных кодов подтверждения, истёкших погашенных phone_token и давно не использованных корзин
+
+Запуск по расписанию: DATABASE_URL=postgres://... python backend/sms/sweeper.py
+или постоянно: python backend/sms/sweeper.py --interval 60
+
+Строки удаляются пачками по индексам idx_verification_codes_expires, idx_phone_proof_uses_expires
+и idx_rate_limits_updated_at, каждая пачка в своей транзакции, чтобы не держать блокировки и не раздувать WAL одной транзакцией.
+"""
+import argparse
+import json
+import os
+import time
+import psycopg2
+
+SCHEMA = 't_p33435224_messenger_api_modern'
+
+SWEEPS = {
+    'verification_codes': f"""
+        DELETE FROM {SCHEMA}.verification_codes
+        WHERE id IN (
+            SELECT id FROM {SCHEMA}.verification_codes
+            WHERE expires_at < NOW()
+            ORDER BY expires_at
+            LIMIT %(batch)s
+        )
+    """,
+    'phone_proof_uses': f"""
+        DELETE FROM {SCHEMA}.phone_proof_uses
+        WHERE nonce IN (
+            SELECT nonce FROM {SCHEMA}.phone_proof_uses
+            WHERE expires_at < NOW()
+            ORDER BY expires_at
+            LIMIT %(batch)s
+        )
+    """,
+    # Корзина, не тронутая дольше самого длинного окна, уже полна и равносильна отсутствующей
+    'rate_limits': f"""
+        DELETE FROM {SCHEMA}.rate_limits
+        WHERE bucket_key IN (
+            SELECT bucket_key FROM {SCHEMA}.rate_limits
+            WHERE updated_at < NOW() - %(idle)s * INTERVAL '1 second'
+            ORDER BY updated_at
+            LIMIT %(batch)s
+        )
+    """,
+}
+
+def sweep(conn, batch_size: int, idle_seconds: int) -> dict:
+    deleted = {}
+    for table, sql in SWEEPS.items():
+        deleted[table] = 0
+        while True:
+            with conn.cursor() as cur:
+                cur.execute(sql, {'batch': batch_size, 'idle': idle_seconds})
+                count = cur.rowcount
+            conn.commit()
+            deleted[table] += count
+            if count < batch_size:
+                break
+    return deleted
+
+def main():
+    parser = argparse.ArgumentParser(description='Очистка просроченных SMS-кодов и корзин ограничения частоты')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--rate-limit-idle', type=int, default=86400, help='через сколько секунд без обращений удалять корзину')
+    parser.add_argument('--interval', type=float, default=0, help='повторять каждые N секунд; 0 — один проход')
+    args = parser.parse_args()
+
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        raise SystemExit('DATABASE_URL is not configured')
+
+    conn = psycopg2.connect(dsn)
+    try:
+        while True:
+            started = time.perf_counter()
+            deleted = sweep(conn, args.batch_size, args.rate_limit_idle)
+            print(json.dumps({
+                'event': 'sms_sweep', 'ts': round(time.time(), 3),
+                'deleted': deleted, 'duration_ms': round((time.perf_counter() - started) * 1000, 1),
+            }), flush=True)
+            if args.interval <= 0:
+                break
+            time.sleep(args.interval)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Копирует backend/common в каталог каждой функции
+
+Платформа разворачивает каждый каталог из func2url.json отдельно, соседний ../common в сборку
+не попадает, поэтому функции импортируют свою копию backend/<fn>/common. Править только
+backend/common и после изменений запускать:
+    python backend/vendor_common.py          # обновить копии
+    python backend/vendor_common.py --check  # код выхода 1, если копии отстают (проверяется в tests)
+"""
+import argparse
+import filecmp
+import json
+import os
+import shutil
+
+BACKEND = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.join(BACKEND, 'common')
+
+def functions() -> list:
+    with open(os.path.join(BACKEND, 'func2url.json'), encoding='utf-8') as f:
+        return sorted(json.load(f))
+
+def sources() -> list:
+    return sorted(name for name in os.listdir(SOURCE) if name.endswith('.py'))
+
+def stale(function: str) -> list:
+    """Файлы копии функции, которые отличаются от backend/common, отсутствуют или лишние"""
+    target = os.path.join(BACKEND, function, 'common')
+    expected = sources()
+    present = sorted(name for name in os.listdir(target) if name.endswith('.py')) if os.path.isdir(target) else []
+    changed = [
+        name for name in expected
+        if name not in present or not filecmp.cmp(os.path.join(SOURCE, name), os.path.join(target, name), shallow=False)
+    ]
+    return changed + [name for name in present if name not in expected]
+
+def vendor(function: str) -> list:
+    target = os.path.join(BACKEND, function, 'common')
+    os.makedirs(target, exist_ok=True)
+    changed = stale(function)
+    for name in changed:
+        if name in sources():
+            shutil.copyfile(os.path.join(SOURCE, name), os.path.join(target, name))
+        else:
+            os.remove(os.path.join(target, name))
+    return changed
+
+def main():
+    parser = argparse.ArgumentParser(description='Копии backend/common в каталогах функций')
+    parser.add_argument('--check', action='store_true', help='только проверить, ничего не менять')
+    args = parser.parse_args()
+
+    drift = False
+    for function in functions():
+        changed = stale(function) if args.check else vendor(function)
+        if changed:
+            drift = True
+            print(f"{function}/common: {', '.join(changed)}")
+    if args.check and drift:
+        raise SystemExit('backend/common copies are stale, run python backend/vendor_common.py')
+
+if __name__ == '__main__':
+    main()
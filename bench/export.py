@@ -0,0 +1,140 @@
+"""Бенчмарк выгрузки большой истории чата: буферизованный ответ против потоковой выгрузки
+
+Запуск (после bench/seed.py): python bench/export.py [--chat-id 1] [--runs 3] [--chunk-rows 2000]
+По умолчанию берётся самый длинный чат. Каждый режим запускается в отдельном процессе, чтобы
+пиковая память (ru_maxrss) не смешивалась:
+  buffered  — как обработчики до пагинации: RealDictCursor, fetchall, [dict(m) for m in messages],
+              jsonenc.dumps всего ответа;
+  streaming — export_chunks из backend/messages/stream.py: именованный курсор, кортежи,
+              encode_rows по пачкам, байты уходят в приёмник без накопления.
+"""
+import argparse
+import functools
+import importlib.util
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND = os.path.join(ROOT, 'backend')
+
+sys.path.insert(0, BACKEND)
+
+from common.jsonenc import dumps, encode_rows
+
+BUFFERED_SQL = """
+    SELECT m.id, m.message_text, m.sent_at, u.id as sender_id, u.username as sender_username
+    FROM messages m
+    JOIN users u ON m.sender_id = u.id
+    WHERE m.chat_id = %s AND m.deleted_at IS NULL
+    ORDER BY m.sent_at, m.id
+"""
+
+@functools.lru_cache(maxsize=None)
+def load_stream():
+    spec = importlib.util.spec_from_file_location('messages_stream', os.path.join(BACKEND, 'messages', 'stream.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def max_rss_mb() -> float:
+    # В Linux ru_maxrss в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_buffered(conn, chat_id: int, chunk_rows: int) -> tuple:
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(BUFFERED_SQL, (chat_id,))
+        messages = cur.fetchall()
+    body = dumps({'messages': [dict(m) for m in messages]}).encode()
+    return len(messages), len(body)
+
+def run_streaming(conn, chat_id: int, chunk_rows: int) -> tuple:
+    stream = load_stream()
+    rows_total = bytes_total = 0
+    for rows in stream.export_chunks(conn, chat_id, chunk_rows):
+        rows_total += len(rows)
+        bytes_total += len(encode_rows(rows).encode()) + 1
+    return rows_total, bytes_total
+
+MODES = {'buffered': run_buffered, 'streaming': run_streaming}
+
+def child(args):
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.set_session(readonly=True)
+    load_stream()
+    baseline = max_rss_mb()
+    started = time.perf_counter()
+    rows, size = MODES[args.mode](conn, args.chat_id, args.chunk_rows)
+    elapsed = time.perf_counter() - started
+    conn.close()
+    print(json.dumps({
+        'rows': rows, 'bytes': size, 'seconds': elapsed,
+        'rss_peak_mb': max_rss_mb(), 'rss_growth_mb': max_rss_mb() - baseline,
+    }))
+
+def largest_chat(dsn: str) -> int:
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT chat_id FROM messages GROUP BY chat_id ORDER BY COUNT(*) DESC LIMIT 1")
+            row = cur.fetchone()
+    finally:
+        conn.close()
+    if not row:
+        raise SystemExit('No messages found, run bench/seed.py first')
+    return row[0]
+
+def main():
+    parser = argparse.ArgumentParser(description='Память и время выгрузки истории чата')
+    parser.add_argument('--chat-id', type=int)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--chunk-rows', type=int, default=2000)
+    parser.add_argument('--mode', choices=sorted(MODES), help=argparse.SUPPRESS)
+    parser.add_argument('--json', help='сохранить отчёт в файл')
+    args = parser.parse_args()
+
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        raise SystemExit('DATABASE_URL is not configured')
+
+    if args.mode:
+        child(args)
+        return
+
+    chat_id = args.chat_id or largest_chat(dsn)
+    report = {'chat_id': chat_id, 'chunk_rows': args.chunk_rows, 'modes': {}}
+    for mode in sorted(MODES):
+        samples = [
+            json.loads(subprocess.check_output([
+                sys.executable, os.path.abspath(__file__), '--mode', mode,
+                '--chat-id', str(chat_id), '--chunk-rows', str(args.chunk_rows),
+            ]))
+            for _ in range(args.runs)
+        ]
+        report['modes'][mode] = {
+            'rows': samples[0]['rows'],
+            'bytes': samples[0]['bytes'],
+            'seconds_p50': round(statistics.median(s['seconds'] for s in samples), 4),
+            'rss_peak_mb': round(max(s['rss_peak_mb'] for s in samples), 1),
+            'rss_growth_mb': round(max(s['rss_growth_mb'] for s in samples), 1),
+        }
+
+    buffered, streaming = report['modes']['buffered'], report['modes']['streaming']
+    report['streaming_vs_buffered'] = {
+        'time_ratio': round(streaming['seconds_p50'] / buffered['seconds_p50'], 3) if buffered['seconds_p50'] else None,
+        'rss_growth_saved_mb': round(buffered['rss_growth_mb'] - streaming['rss_growth_mb'], 1),
+    }
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+"""Нагрузочный бенчмарк облачных функций: handler(event, context) вызывается в процессе против локальной БД
+
+Запуск (после bench/seed.py):
+    python bench/load.py --requests 500 --json bench_output.json
+    python bench/load.py --baseline bench_output.json   # код выхода 1 при регрессии
+
+Сценарии: случаи из backend/*/tests.json (заодно проверяется ожидаемый статус) и типовые
+запросы к горячим эндпоинтам со случайными пользователями и чатами из БД. Для каждого сценария
+выводятся p50/p95/p99 задержки, число SQL-запросов на вызов и строк, прочитанных из таблиц
+(по pg_stat_user_tables, значение приблизительное).
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from urllib.parse import urlsplit, parse_qsl
+import psycopg2
+import psycopg2.extras
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND = os.path.join(ROOT, 'backend')
+FUNCTIONS = ['auth', 'messages', 'moderation', 'sms']
+
+sys.path.insert(0, BACKEND)
+# Построчный лог запросов в бенчмарке не нужен, число SQL-запросов берётся из счётчиков tracing
+os.environ.setdefault('REQUEST_LOG', '0')
+# Без AUTH_TOKEN_SECRET обработчики работают как локальный стенд; с секретом флаг не действует
+os.environ.setdefault('AUTH_DEV_MODE', '1')
+
+from common import db, tracing
+from common.auth import issue_token
+from sign_tests import sign_case
+
+def load_handler(name: str):
+    spec = importlib.util.spec_from_file_location(f'{name}_index', os.path.join(BACKEND, name, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.handler
+
+def auth_headers(user: dict) -> dict:
+    return {'x-user-id': str(user['id']), 'x-auth-token': issue_token(user)}
+
+def event_from_test(case: dict, admin: dict) -> dict:
+    case = sign_case(case, {admin['id']})
+    url = urlsplit(case.get('path', '/'))
+    headers = {k.lower(): v for k, v in (case.get('headers') or {}).items()}
+    return {
+        'httpMethod': case.get('method', 'GET'),
+        'headers': headers,
+        'queryStringParameters': dict(parse_qsl(url.query)) or None,
+        'body': json.dumps(case['body']) if 'body' in case else None,
+    }
+
+def sample_fixtures(conn, size: int) -> dict:
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        cur.execute("""
+            SELECT s.user_id, s.chat_id, s.peer_user_id, u.is_admin
+            FROM chat_summary s TABLESAMPLE SYSTEM (10)
+            JOIN users u ON u.id = s.user_id
+            LIMIT %s
+        """, (size,))
+        chats = cur.fetchall()
+        if not chats:
+            cur.execute("""
+                SELECT s.user_id, s.chat_id, s.peer_user_id, u.is_admin
+                FROM chat_summary s JOIN users u ON u.id = s.user_id
+                LIMIT %s
+            """, (size,))
+            chats = cur.fetchall()
+        cur.execute("SELECT id, is_admin FROM users WHERE is_admin ORDER BY id LIMIT 1")
+        admin = cur.fetchone()
+        cur.execute("SELECT username FROM users TABLESAMPLE SYSTEM (10) LIMIT %s", (size,))
+        usernames = [r['username'] for r in cur.fetchall()]
+    conn.rollback()
+    if not chats or not admin:
+        raise SystemExit('Database has no chats or admin user; run bench/seed.py first')
+    return {'chats': chats, 'admin': admin, 'usernames': usernames}
+
+def scenarios(fixtures: dict) -> dict:
+    chats, admin, usernames = fixtures['chats'], fixtures['admin'], fixtures['usernames']
+
+    def user(row):
+        return {'id': row['user_id'], 'is_admin': row['is_admin']}
+
+    def chat_list():
+        row = random.choice(chats)
+        return 'messages', {'httpMethod': 'GET', 'headers': auth_headers(user(row))}
+
+    def history_latest():
+        row = random.choice(chats)
+        return 'messages', {
+            'httpMethod': 'GET', 'headers': auth_headers(user(row)),
+            'queryStringParameters': {'chat_id': str(row['chat_id'])},
+        }
+
+    def send_message():
+        row = random.choice(chats)
+        return 'messages', {
+            'httpMethod': 'POST', 'headers': auth_headers(user(row)),
+            'body': json.dumps({'recipient_id': row['peer_user_id'], 'message_text': 'Нагрузочное сообщение'}),
+        }
+
+    def send_batch():
+        row = random.choice(chats)
+        items = [{'recipient_id': r['peer_user_id'], 'message_text': 'Рассылка'} for r in random.sample(chats, min(50, len(chats)))
+                 if r['peer_user_id'] != row['user_id']]
+        return 'messages', {'httpMethod': 'POST', 'headers': auth_headers(user(row)), 'body': json.dumps({'messages': items})}
+
+    def search_users():
+        name = random.choice(usernames) if usernames else 'user'
+        return 'auth', {'httpMethod': 'GET', 'queryStringParameters': {'q': name[:random.randint(2, len(name))]}}
+
+    def reports():
+        return 'moderation', {'httpMethod': 'GET', 'headers': auth_headers(admin)}
+
+    return {
+        'messages.chat_list': chat_list,
+        'messages.history_latest': history_latest,
+        'messages.send': send_message,
+        'messages.send_batch': send_batch,
+        'auth.search': search_users,
+        'moderation.reports': reports,
+    }
+
+def rows_read(stats_conn) -> int:
+    with stats_conn.cursor() as cur:
+        cur.execute("SELECT pg_stat_clear_snapshot()")
+        cur.execute("SELECT COALESCE(SUM(COALESCE(seq_tup_read, 0) + COALESCE(idx_tup_fetch, 0)), 0) FROM pg_stat_user_tables")
+        return int(cur.fetchone()[0])
+
+def percentile(samples: list, q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+def run_scenario(handler_by_name: dict, make_event, requests: int, stats_conn, settle: float) -> dict:
+    latencies = []
+    statuses = {}
+    rows_before = rows_read(stats_conn)
+    queries_before = tracing.registry.queries_total
+    for _ in range(requests):
+        name, event = make_event()
+        started = time.perf_counter()
+        response = handler_by_name[name](event, None)
+        latencies.append(time.perf_counter() - started)
+        statuses[response['statusCode']] = statuses.get(response['statusCode'], 0) + 1
+    # Статистика таблиц сбрасывается бэкендами с задержкой
+    time.sleep(settle)
+    return {
+        'requests': requests,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+        'queries_per_request': round((tracing.registry.queries_total - queries_before) / requests, 2),
+        'rows_read_per_request': round((rows_read(stats_conn) - rows_before) / requests, 1),
+        'statuses': statuses,
+    }
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for name, current in report['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous:
+            continue
+        for metric in ('p95_ms', 'queries_per_request', 'rows_read_per_request'):
+            if previous[metric] and current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f'{name}: {metric} {previous[metric]} -> {current[metric]}')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный бенчмарк обработчиков')
+    parser.add_argument('--requests', type=int, default=500, help='вызовов на сценарий')
+    parser.add_argument('--only', help='подстрока имени сценария')
+    parser.add_argument('--settle', type=float, default=1.0, help='пауза перед чтением pg_stat_user_tables')
+    parser.add_argument('--json', help='сохранить отчёт в файл')
+    parser.add_argument('--metrics', help='сохранить метрики tracing в формате Prometheus')
+    parser.add_argument('--baseline', help='отчёт для сравнения; при регрессии код выхода 1')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        raise SystemExit('DATABASE_URL is not configured')
+    random.seed(args.seed)
+
+    handler_by_name = {name: load_handler(name) for name in FUNCTIONS}
+
+    stats_conn = psycopg2.connect(dsn)
+    stats_conn.autocommit = True
+    fixtures = sample_fixtures(stats_conn, 1000)
+
+    report = {'tests_json': [], 'scenarios': {}}
+
+    for name in FUNCTIONS:
+        with open(os.path.join(BACKEND, name, 'tests.json'), encoding='utf-8') as f:
+            cases = json.load(f)['tests']
+        for case in cases:
+            response = handler_by_name[name](event_from_test(case, fixtures['admin']), None)
+            ok = response['statusCode'] == case.get('expectedStatus')
+            report['tests_json'].append({'function': name, 'name': case['name'], 'status': response['statusCode'], 'ok': ok})
+            print(f"{'ok  ' if ok else 'FAIL'} {name}: {case['name']} -> {response['statusCode']}")
+
+    for name, make_event in scenarios(fixtures).items():
+        if args.only and args.only not in name:
+            continue
+        result = run_scenario(handler_by_name, make_event, args.requests, stats_conn, args.settle)
+        report['scenarios'][name] = result
+        print(
+            f"{name:28} p50={result['p50_ms']:8.2f}ms p95={result['p95_ms']:8.2f}ms p99={result['p99_ms']:8.2f}ms "
+            f"queries={result['queries_per_request']:5.2f} rows={result['rows_read_per_request']:10.1f} {result['statuses']}"
+        )
+
+    report['pool'] = db.get_pool(dsn).snapshot()
+    if args.metrics:
+        with open(args.metrics, 'w', encoding='utf-8') as f:
+            f.write(tracing.registry.render_prometheus(report['pool']))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    failed = [t for t in report['tests_json'] if not t['ok']]
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+
+    if failed or regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
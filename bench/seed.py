@@ -0,0 +1,183 @@
+"""Наполнение локальной БД синтетическими данными для нагрузочного бенчмарка
+
+Запуск:
+    createdb messenger_bench
+    export DATABASE_URL='postgresql://localhost/messenger_bench?options=-csearch_path%3Dt_p33435224_messenger_api_modern'
+    python bench/seed.py --migrate --users 10000 --messages 10000000
+
+Данные генерируются на стороне сервера через generate_series, сообщения вставляются пачками
+с коммитом после каждой. Распределение сообщений по чатам неравномерное: часть чатов получает
+очень длинную историю, как в реальном мессенджере.
+"""
+import argparse
+import glob
+import importlib.util
+import os
+import time
+from datetime import date
+import psycopg2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCHEMA = 't_p33435224_messenger_api_modern'
+
+def log(step: str, started: float):
+    print(f'{step}: {time.perf_counter() - started:.1f}s', flush=True)
+
+def migrate(conn):
+    with conn.cursor() as cur:
+        cur.execute(f'CREATE SCHEMA IF NOT EXISTS {SCHEMA}')
+        cur.execute(f'SET search_path TO {SCHEMA}, public')
+        for path in sorted(glob.glob(os.path.join(ROOT, 'db_migrations', 'V*.sql'))):
+            started = time.perf_counter()
+            with open(path, encoding='utf-8') as f:
+                cur.execute(f.read())
+            conn.commit()
+            log(os.path.basename(path), started)
+
+def load_partitions():
+    spec = importlib.util.spec_from_file_location('partitions', os.path.join(ROOT, 'backend', 'messages', 'partitions.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def seed(conn, users: int, chats_per_user: int, messages: int, reports: int, chunk: int):
+    cur = conn.cursor()
+    cur.execute(f'SET search_path TO {SCHEMA}, public')
+
+    started = time.perf_counter()
+    cur.execute("""
+        INSERT INTO users (username, password_hash, full_name, phone)
+        SELECT 'user_' || g, '', 'Пользователь ' || g, '+7900' || lpad(g::text, 7, '0')
+        FROM generate_series(1, %s) g
+        ON CONFLICT DO NOTHING
+    """, (users,))
+    conn.commit()
+    log('users', started)
+
+    started = time.perf_counter()
+    cur.execute("""
+        INSERT INTO chats (user_low, user_high)
+        SELECT DISTINCT LEAST(a, b), GREATEST(a, b)
+        FROM (
+            SELECT u.id as a, (SELECT MIN(id) FROM users) + floor(random() * %s)::int as b
+            FROM users u, generate_series(1, %s)
+        ) pairs
+        WHERE a != b AND b <= (SELECT MAX(id) FROM users)
+        ON CONFLICT (user_low, user_high) DO NOTHING
+    """, (users, max(chats_per_user // 2, 1)))
+    cur.execute("""
+        INSERT INTO chat_participants (chat_id, user_id)
+        SELECT c.id, v.user_id
+        FROM chats c, LATERAL (VALUES (c.user_low), (c.user_high)) v(user_id)
+        WHERE c.user_low IS NOT NULL
+        ON CONFLICT DO NOTHING
+    """)
+    cur.execute("""
+        INSERT INTO chat_summary (chat_id, user_id, peer_user_id)
+        SELECT c.id, v.user_id, v.peer_user_id
+        FROM chats c, LATERAL (VALUES (c.user_low, c.user_high), (c.user_high, c.user_low)) v(user_id, peer_user_id)
+        WHERE c.user_low IS NOT NULL
+        ON CONFLICT DO NOTHING
+    """)
+    cur.execute("DROP TABLE IF EXISTS seed_chats")
+    cur.execute("""
+        CREATE UNLOGGED TABLE seed_chats AS
+        SELECT row_number() OVER (ORDER BY id) - 1 as n, id, user_low, user_high
+        FROM chats WHERE user_low IS NOT NULL
+    """)
+    cur.execute("CREATE UNIQUE INDEX ON seed_chats(n)")
+    cur.execute("SELECT COUNT(*) FROM seed_chats")
+    chat_count = cur.fetchone()[0]
+    conn.commit()
+    log(f'chats ({chat_count})', started)
+
+    # История генерируется за последний год: секции под неё создаются заранее, мимо messages_default
+    partitions = load_partitions()
+    current = date.today().replace(day=1)
+    partitions.ensure_partitions(conn, partitions.add_months(current, -12), current)
+
+    started = time.perf_counter()
+    for offset in range(0, messages, chunk):
+        # Квадрат случайного числа смещает сообщения к первым чатам: получаются и короткие, и очень длинные истории
+        cur.execute("""
+            INSERT INTO messages (chat_id, sender_id, message_text, sent_at)
+            SELECT c.id,
+                   CASE WHEN random() < 0.5 THEN c.user_low ELSE c.user_high END,
+                   'Сообщение ' || t.g || ' ' || md5(t.g::text),
+                   NOW() - INTERVAL '365 days' + (t.g * (INTERVAL '365 days' / %s))
+            FROM (
+                -- Номер чата считается в подзапросе один раз на строку; random() в условии соединения
+                -- вычислялся бы заново для каждой пары и почти ничего не соединял
+                SELECT g, floor(power(random(), 2) * %s)::int as n
+                FROM generate_series(%s, %s) g
+            ) t
+            JOIN seed_chats c ON c.n = t.n
+        """, (messages, chat_count, offset + 1, min(offset + chunk, messages)))
+        conn.commit()
+        print(f'  messages {min(offset + chunk, messages)}/{messages}', flush=True)
+    log('messages', started)
+
+    started = time.perf_counter()
+    cur.execute("""
+        UPDATE chat_summary s SET
+            last_message_id = l.id,
+            last_message_text = l.message_text,
+            last_message_time = l.sent_at,
+            unread_count = 0
+        FROM (
+            SELECT DISTINCT ON (chat_id) chat_id, id, message_text, sent_at
+            FROM messages
+            ORDER BY chat_id, sent_at DESC, id DESC
+        ) l
+        WHERE s.chat_id = l.chat_id
+    """)
+    cur.execute("""
+        UPDATE chat_participants cp SET last_read_message_id = s.last_message_id
+        FROM chat_summary s
+        WHERE s.chat_id = cp.chat_id AND s.user_id = cp.user_id AND s.last_message_id IS NOT NULL
+    """)
+    cur.execute("""
+        INSERT INTO reports (reported_user_id, reported_by_user_id, reason, status, created_at)
+        SELECT a.id, b.id, 'Спам ' || t.g, (ARRAY['pending', 'reviewed', 'resolved'])[1 + floor(random() * 3)::int],
+               NOW() - random() * INTERVAL '90 days'
+        FROM (
+            SELECT g, floor(random() * u.total)::int as a, floor(random() * u.total)::int as b
+            FROM generate_series(1, %s) g, (SELECT COUNT(*) as total FROM users) u
+        ) t
+        JOIN (SELECT row_number() OVER (ORDER BY id) - 1 as n, id FROM users) a ON a.n = t.a
+        JOIN (SELECT row_number() OVER (ORDER BY id) - 1 as n, id FROM users) b ON b.n = t.b
+    """, (reports,))
+    cur.execute("INSERT INTO presence (user_id, seen_at) SELECT id, NOW() FROM users WHERE random() < 0.2 ON CONFLICT DO NOTHING")
+    cur.execute("DROP TABLE seed_chats")
+    conn.commit()
+    log('summaries, reports and presence', started)
+
+    started = time.perf_counter()
+    conn.autocommit = True
+    cur.execute('VACUUM ANALYZE')
+    log('vacuum analyze', started)
+
+def main():
+    parser = argparse.ArgumentParser(description='Синтетические данные для бенчмарка')
+    parser.add_argument('--migrate', action='store_true', help='применить db_migrations перед наполнением')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--chats-per-user', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=10000000)
+    parser.add_argument('--reports', type=int, default=10000)
+    parser.add_argument('--chunk', type=int, default=500000)
+    args = parser.parse_args()
+
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        raise SystemExit('DATABASE_URL is not configured')
+
+    conn = psycopg2.connect(dsn)
+    try:
+        if args.migrate:
+            migrate(conn)
+        seed(conn, args.users, args.chats_per_user, args.messages, args.reports, args.chunk)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
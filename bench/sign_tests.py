@@ -0,0 +1,65 @@
+"""Подписывает случаи backend/*/tests.json токенами для прогона против функций с AUTH_TOKEN_SECRET
+
+С секретом функции не доверяют X-User-Id, а вход требует подтверждения телефона, поэтому перед
+прогоном tests.json случаи дополняются: к X-User-Id добавляется X-Auth-Token из issue_token, ко входу
+по телефону — phone_token из issue_phone_proof. X-User-Id остаётся для локального стенда без секрета.
+
+Подписанные копии пишутся в отдельный каталог (по умолчанию временный), <out>/<fn>/tests.json:
+токены в закоммиченные backend/*/tests.json не попадают.
+
+Запуск (с тем же секретом, что у функций, непосредственно перед прогоном — подтверждение телефона
+живёт PHONE_PROOF_TTL секунд):
+    AUTH_TOKEN_SECRET=... python bench/sign_tests.py [--admin 1] [--out DIR]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND = os.path.join(ROOT, 'backend')
+FUNCTIONS = ['auth', 'messages', 'moderation', 'sms']
+
+sys.path.insert(0, BACKEND)
+
+from common.auth import AUTH_TOKEN_SECRET, issue_phone_proof, issue_token
+
+def sign_case(case: dict, admin_ids) -> dict:
+    """Копия случая с токеном сессии для X-User-Id и подтверждением телефона для входа"""
+    case = dict(case)
+    headers = dict(case.get('headers') or {})
+    user_id = next((v for k, v in headers.items() if k.lower() == 'x-user-id'), None)
+    if user_id is not None:
+        headers['X-Auth-Token'] = issue_token({'id': int(user_id), 'is_admin': int(user_id) in admin_ids})
+        case['headers'] = headers
+    body = case.get('body')
+    if isinstance(body, dict) and body.get('phone') and 'action' not in body and user_id is None:
+        case['body'] = {**body, 'phone_token': issue_phone_proof(body['phone'])}
+    return case
+
+def main():
+    parser = argparse.ArgumentParser(description='Токены для backend/*/tests.json')
+    parser.add_argument('--admin', type=int, action='append', help='id администратора (по умолчанию 1 из V0001)')
+    parser.add_argument('--out', help='каталог для подписанных копий (по умолчанию новый временный)')
+    args = parser.parse_args()
+
+    if not AUTH_TOKEN_SECRET:
+        raise SystemExit('AUTH_TOKEN_SECRET is not configured')
+    admin_ids = set(args.admin or [1])
+    out = args.out or tempfile.mkdtemp(prefix='signed_tests_')
+    if os.path.realpath(out).startswith(os.path.realpath(ROOT) + os.sep):
+        raise SystemExit('--out must be outside the repository')
+
+    for name in FUNCTIONS:
+        with open(os.path.join(BACKEND, name, 'tests.json'), encoding='utf-8') as f:
+            tests = json.load(f)
+        tests['tests'] = [sign_case(case, admin_ids) for case in tests['tests']]
+        path = os.path.join(out, name, 'tests.json')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(tests, indent=2, ensure_ascii=False) + '\n')
+        print(f'{name}: {len(tests["tests"])} cases signed -> {path}')
+
+if __name__ == '__main__':
+    main()
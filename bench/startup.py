@@ -0,0 +1,111 @@
+"""Бенчмарк холодного старта и накладных расходов на запрос для облачных функций
+
+Запуск: python bench/startup.py [--runs 20] [--requests 20000]
+Не требует БД: меряет импорт модуля функции в свежем интерпретаторе, маршрутизацию
+запросов без обращения к БД и кодирование типичного ответа истории чата.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND = os.path.join(ROOT, 'backend')
+FUNCTIONS = ['auth', 'messages', 'moderation', 'sms']
+
+IMPORT_SNIPPET = """
+import importlib.util, sys, time
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location('index', sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+print(time.perf_counter() - started)
+"""
+
+def load_handler(name: str):
+    spec = importlib.util.spec_from_file_location(f'{name}_index', os.path.join(BACKEND, name, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.handler
+
+def cold_import(name: str, runs: int) -> list:
+    path = os.path.join(BACKEND, name, 'index.py')
+    return [
+        float(subprocess.check_output([sys.executable, '-c', IMPORT_SNIPPET, path]).decode().strip())
+        for _ in range(runs)
+    ]
+
+def per_call(fn, requests: int) -> float:
+    started = time.perf_counter()
+    for _ in range(requests):
+        fn()
+    return (time.perf_counter() - started) / requests
+
+def sample_history(size: int = 200) -> list:
+    base = datetime(2024, 1, 1, 12, 0, 0)
+    return [
+        {
+            'id': i,
+            'message_text': f'Сообщение номер {i} с немного более длинным текстом',
+            'sent_at': base + timedelta(seconds=i, microseconds=i),
+            'is_read': i % 3 == 0,
+            'sender_id': 1 + i % 2,
+            'sender_username': 'alexdev' if i % 2 else 'maria_design',
+        }
+        for i in range(size)
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description='Холодный старт и накладные расходы на запрос')
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=20000)
+    args = parser.parse_args()
+
+    os.environ.pop('DATABASE_URL', None)
+    # Маршрутизация меряется на локальном стенде, без проверки подписи
+    os.environ.pop('AUTH_TOKEN_SECRET', None)
+    os.environ['AUTH_DEV_MODE'] = '1'
+    sys.path.insert(0, BACKEND)
+    from common import jsonenc
+
+    report = {'cold_import_ms': {}, 'request_us': {}, 'encode_history_us': {}}
+
+    for name in FUNCTIONS:
+        samples = cold_import(name, args.runs)
+        report['cold_import_ms'][name] = {
+            'p50': round(statistics.median(samples) * 1000, 2),
+            'max': round(max(samples) * 1000, 2),
+        }
+
+    messages = load_handler('messages')
+    scenarios = {
+        'options': {'httpMethod': 'OPTIONS'},
+        'unauthorized': {'httpMethod': 'GET', 'headers': {}},
+        'not_found': {'httpMethod': 'DELETE', 'headers': {}},
+        'bad_request': {'httpMethod': 'POST', 'headers': {'x-user-id': '1'}, 'body': '{"message_text": ""}'},
+    }
+    for label, event in scenarios.items():
+        report['request_us'][label] = round(per_call(lambda: messages(event, None), args.requests) * 1e6, 2)
+
+    history = sample_history()
+    rows = [dict(m) for m in history]
+    encoders = {
+        'legacy_json_default_str': lambda: json.dumps({'messages': [dict(m) for m in rows]}, default=str),
+        'common_jsonenc': lambda: jsonenc.dumps({'messages': rows}),
+        'common_jsonenc_backend': jsonenc.orjson.__name__ if jsonenc.orjson else 'json',
+    }
+    for label, fn in encoders.items():
+        if callable(fn):
+            report['encode_history_us'][label] = round(per_call(fn, max(args.requests // 20, 100)) * 1e6, 2)
+        else:
+            report['encode_history_us'][label] = fn
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+if __name__ == '__main__':
+    main()
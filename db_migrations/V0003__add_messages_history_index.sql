@@ -0,0 +1,5 @@
+-- Составной индекс для постраничной выдачи истории чата по ключу (sent_at, id)
+CREATE INDEX idx_messages_chat_sent_at_id ON t_p33435224_messenger_api_modern.messages(chat_id, sent_at, id);
+
+-- Одиночный индекс по chat_id полностью покрывается составным
+DROP INDEX t_p33435224_messenger_api_modern.idx_messages_chat_id;
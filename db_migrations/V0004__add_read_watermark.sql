@@ -0,0 +1,15 @@
+-- Отметка прочтения хранится одной строкой на участника: id последнего прочитанного сообщения
+ALTER TABLE t_p33435224_messenger_api_modern.chat_participants
+ADD COLUMN last_read_message_id INTEGER NOT NULL DEFAULT 0;
+
+-- Переносим уже прочитанные сообщения в отметку
+UPDATE t_p33435224_messenger_api_modern.chat_participants cp
+SET last_read_message_id = r.max_id
+FROM (
+    SELECT cp2.id AS participant_id, MAX(m.id) AS max_id
+    FROM t_p33435224_messenger_api_modern.chat_participants cp2
+    JOIN t_p33435224_messenger_api_modern.messages m
+      ON m.chat_id = cp2.chat_id AND m.sender_id != cp2.user_id AND m.is_read = TRUE
+    GROUP BY cp2.id
+) r
+WHERE cp.id = r.participant_id;
@@ -0,0 +1,39 @@
+-- Денормализованная сводка чата: одна строка на участника с последним сообщением и счётчиком непрочитанных
+CREATE TABLE t_p33435224_messenger_api_modern.chat_summary (
+    chat_id INTEGER NOT NULL REFERENCES t_p33435224_messenger_api_modern.chats(id),
+    user_id INTEGER NOT NULL REFERENCES t_p33435224_messenger_api_modern.users(id),
+    peer_user_id INTEGER REFERENCES t_p33435224_messenger_api_modern.users(id),
+    last_message_id INTEGER,
+    last_message_text TEXT,
+    last_message_time TIMESTAMP,
+    unread_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (chat_id, user_id)
+);
+
+-- Список чатов пользователя читается одним проходом по индексу
+CREATE INDEX idx_chat_summary_user_time ON t_p33435224_messenger_api_modern.chat_summary(user_id, last_message_time DESC NULLS LAST);
+
+-- Заполняем сводку по существующим чатам
+INSERT INTO t_p33435224_messenger_api_modern.chat_summary
+    (chat_id, user_id, peer_user_id, last_message_id, last_message_text, last_message_time, unread_count)
+SELECT
+    cp.chat_id,
+    cp.user_id,
+    peer.user_id,
+    last_msg.id,
+    last_msg.message_text,
+    last_msg.sent_at,
+    (
+        SELECT COUNT(*) FROM t_p33435224_messenger_api_modern.messages um
+        WHERE um.chat_id = cp.chat_id AND um.sender_id != cp.user_id AND um.id > cp.last_read_message_id
+    )
+FROM t_p33435224_messenger_api_modern.chat_participants cp
+LEFT JOIN t_p33435224_messenger_api_modern.chat_participants peer
+    ON peer.chat_id = cp.chat_id AND peer.user_id != cp.user_id
+LEFT JOIN LATERAL (
+    SELECT m.id, m.message_text, m.sent_at
+    FROM t_p33435224_messenger_api_modern.messages m
+    WHERE m.chat_id = cp.chat_id
+    ORDER BY m.sent_at DESC, m.id DESC
+    LIMIT 1
+) last_msg ON TRUE;
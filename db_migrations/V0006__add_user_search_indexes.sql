@@ -0,0 +1,9 @@
+-- Триграммы для поиска подстроки и нечёткого поиска по username и имени
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX idx_users_username_trgm ON t_p33435224_messenger_api_modern.users USING GIN (username gin_trgm_ops);
+CREATE INDEX idx_users_full_name_trgm ON t_p33435224_messenger_api_modern.users USING GIN (full_name gin_trgm_ops);
+
+-- Префиксный поиск по username для коротких запросов и по телефону
+CREATE INDEX idx_users_username_prefix ON t_p33435224_messenger_api_modern.users (lower(username) text_pattern_ops);
+CREATE INDEX idx_users_phone_prefix ON t_p33435224_messenger_api_modern.users (phone varchar_pattern_ops);
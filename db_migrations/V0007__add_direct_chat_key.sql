@@ -0,0 +1,73 @@
+-- Канонический ключ личного чата: пара участников (меньший id, больший id)
+ALTER TABLE t_p33435224_messenger_api_modern.chats
+ADD COLUMN user_low INTEGER REFERENCES t_p33435224_messenger_api_modern.users(id),
+ADD COLUMN user_high INTEGER REFERENCES t_p33435224_messenger_api_modern.users(id);
+
+-- Личные чаты и их канонический экземпляр (самый ранний чат пары)
+CREATE TEMP TABLE direct_chats AS
+SELECT
+    chat_id,
+    MIN(user_id) AS user_low,
+    MAX(user_id) AS user_high,
+    MIN(chat_id) OVER (PARTITION BY MIN(user_id), MAX(user_id)) AS canonical_id
+FROM t_p33435224_messenger_api_modern.chat_participants
+GROUP BY chat_id
+HAVING COUNT(*) = 2;
+
+-- Сливаем дубликаты, созданные гонкой первых сообщений
+UPDATE t_p33435224_messenger_api_modern.messages m
+SET chat_id = d.canonical_id
+FROM direct_chats d
+WHERE m.chat_id = d.chat_id AND d.chat_id != d.canonical_id;
+
+UPDATE t_p33435224_messenger_api_modern.chat_participants cp
+SET last_read_message_id = GREATEST(cp.last_read_message_id, r.max_read)
+FROM (
+    SELECT d.canonical_id, cp2.user_id, MAX(cp2.last_read_message_id) AS max_read
+    FROM direct_chats d
+    JOIN t_p33435224_messenger_api_modern.chat_participants cp2 ON cp2.chat_id = d.chat_id
+    GROUP BY d.canonical_id, cp2.user_id
+) r
+WHERE cp.chat_id = r.canonical_id AND cp.user_id = r.user_id;
+
+DELETE FROM t_p33435224_messenger_api_modern.chat_summary
+WHERE chat_id IN (SELECT chat_id FROM direct_chats WHERE chat_id != canonical_id);
+
+DELETE FROM t_p33435224_messenger_api_modern.chat_participants
+WHERE chat_id IN (SELECT chat_id FROM direct_chats WHERE chat_id != canonical_id);
+
+DELETE FROM t_p33435224_messenger_api_modern.chats
+WHERE id IN (SELECT chat_id FROM direct_chats WHERE chat_id != canonical_id);
+
+-- Пересчитываем сводку объединённых чатов
+UPDATE t_p33435224_messenger_api_modern.chat_summary s
+SET
+    last_message_id = l.id,
+    last_message_text = l.message_text,
+    last_message_time = l.sent_at,
+    unread_count = (
+        SELECT COUNT(*)
+        FROM t_p33435224_messenger_api_modern.messages um
+        JOIN t_p33435224_messenger_api_modern.chat_participants cp
+            ON cp.chat_id = um.chat_id AND cp.user_id = s.user_id
+        WHERE um.chat_id = s.chat_id AND um.sender_id != s.user_id AND um.id > cp.last_read_message_id
+    )
+FROM (SELECT DISTINCT canonical_id FROM direct_chats WHERE chat_id != canonical_id) merged
+LEFT JOIN LATERAL (
+    SELECT m.id, m.message_text, m.sent_at
+    FROM t_p33435224_messenger_api_modern.messages m
+    WHERE m.chat_id = merged.canonical_id
+    ORDER BY m.sent_at DESC, m.id DESC
+    LIMIT 1
+) l ON TRUE
+WHERE s.chat_id = merged.canonical_id;
+
+UPDATE t_p33435224_messenger_api_modern.chats c
+SET user_low = d.user_low, user_high = d.user_high
+FROM direct_chats d
+WHERE c.id = d.chat_id AND d.chat_id = d.canonical_id;
+
+DROP TABLE direct_chats;
+
+-- Уникальный ключ пары: поиск чата при отправке становится одной пробой индекса
+CREATE UNIQUE INDEX idx_chats_direct_pair ON t_p33435224_messenger_api_modern.chats(user_low, user_high);
@@ -0,0 +1,53 @@
+-- Помесячное секционирование сообщений по sent_at: вставка и вакуум работают с небольшой текущей секцией,
+-- а старые месяцы отсоединяются и архивируются скриптом backend/messages/partitions.py
+ALTER TABLE t_p33435224_messenger_api_modern.messages RENAME TO messages_legacy;
+
+-- Первичный ключ секционированной таблицы обязан включать ключ секционирования
+CREATE TABLE t_p33435224_messenger_api_modern.messages (
+    id INTEGER NOT NULL DEFAULT nextval('t_p33435224_messenger_api_modern.messages_id_seq'),
+    chat_id INTEGER REFERENCES t_p33435224_messenger_api_modern.chats(id),
+    sender_id INTEGER REFERENCES t_p33435224_messenger_api_modern.users(id),
+    message_text TEXT NOT NULL,
+    sent_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    is_read BOOLEAN DEFAULT FALSE,
+    PRIMARY KEY (id, sent_at)
+) PARTITION BY RANGE (sent_at);
+
+-- Строки вне созданных месяцев попадают сюда; скрипт обслуживания переносит их в нужную секцию
+CREATE TABLE t_p33435224_messenger_api_modern.messages_default
+PARTITION OF t_p33435224_messenger_api_modern.messages DEFAULT;
+
+-- Секции с первого месяца истории до трёх месяцев вперёд
+DO $$
+DECLARE
+    month_start DATE;
+    last_month DATE := date_trunc('month', CURRENT_DATE + INTERVAL '3 months')::date;
+BEGIN
+    SELECT date_trunc('month', COALESCE(MIN(sent_at), CURRENT_TIMESTAMP))::date INTO month_start
+    FROM t_p33435224_messenger_api_modern.messages_legacy;
+
+    WHILE month_start <= last_month LOOP
+        EXECUTE format(
+            'CREATE TABLE t_p33435224_messenger_api_modern.%I PARTITION OF t_p33435224_messenger_api_modern.messages FOR VALUES FROM (%L) TO (%L)',
+            'messages_' || to_char(month_start, '"y"YYYY"m"MM'),
+            month_start,
+            (month_start + INTERVAL '1 month')::date
+        );
+        month_start := (month_start + INTERVAL '1 month')::date;
+    END LOOP;
+END $$;
+
+INSERT INTO t_p33435224_messenger_api_modern.messages (id, chat_id, sender_id, message_text, sent_at, is_read)
+SELECT id, chat_id, sender_id, message_text, COALESCE(sent_at, CURRENT_TIMESTAMP), is_read
+FROM t_p33435224_messenger_api_modern.messages_legacy;
+
+-- Последовательность переходит к новой таблице, иначе удалится вместе со старой
+ALTER SEQUENCE t_p33435224_messenger_api_modern.messages_id_seq OWNED BY t_p33435224_messenger_api_modern.messages.id;
+
+DROP TABLE t_p33435224_messenger_api_modern.messages_legacy;
+
+-- Индексы на родительской таблице создаются в каждой секции, в том числе в будущих
+CREATE INDEX idx_messages_chat_sent_at_id ON t_p33435224_messenger_api_modern.messages(chat_id, sent_at, id);
+CREATE INDEX idx_messages_sender_id ON t_p33435224_messenger_api_modern.messages(sender_id);
+
+ANALYZE t_p33435224_messenger_api_modern.messages;
@@ -0,0 +1,13 @@
+-- Очередь приёма сообщений для режима MESSAGES_INGEST_MODE=queued: обработчик отвечает сразу после вставки сюда,
+-- а backend/messages/flusher.py переносит сообщения в messages пачками, одной транзакцией на пачку.
+-- UNLOGGED не пишет WAL, поэтому коммит отправки не ждёт fsync; цена режима — после аварийного
+-- перезапуска Postgres таблица очищается и ещё не перенесённые сообщения теряются.
+-- id берётся из последовательности messages и сохраняется при переносе, клиент сразу получает окончательный id
+CREATE UNLOGGED TABLE t_p33435224_messenger_api_modern.message_queue (
+    id INTEGER PRIMARY KEY DEFAULT nextval('t_p33435224_messenger_api_modern.messages_id_seq'),
+    chat_id INTEGER NOT NULL,
+    sender_id INTEGER NOT NULL,
+    recipient_id INTEGER NOT NULL,
+    message_text TEXT NOT NULL,
+    queued_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
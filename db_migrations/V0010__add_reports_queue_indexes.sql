@@ -0,0 +1,8 @@
+-- Очередь жалоб листается внутри статуса по ключу (created_at, id) от новых к старым
+CREATE INDEX idx_reports_status_created_at_id ON t_p33435224_messenger_api_modern.reports(status, created_at, id);
+
+-- Лента без фильтра по статусу
+CREATE INDEX idx_reports_created_at_id ON t_p33435224_messenger_api_modern.reports(created_at, id);
+
+-- Одиночный индекс по статусу полностью покрывается составным
+DROP INDEX t_p33435224_messenger_api_modern.idx_reports_status;
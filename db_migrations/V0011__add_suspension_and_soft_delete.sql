@@ -0,0 +1,8 @@
+-- Блокировка пользователя модератором: заблокированный не входит, не отправляет сообщения и не находится поиском
+ALTER TABLE t_p33435224_messenger_api_modern.users
+ADD COLUMN suspended_at TIMESTAMP,
+ADD COLUMN suspended_by_admin_id INTEGER REFERENCES t_p33435224_messenger_api_modern.users(id);
+
+-- Мягкое удаление сообщений: строка остаётся для разбора жалоб, но не выдаётся в историю и поток
+ALTER TABLE t_p33435224_messenger_api_modern.messages
+ADD COLUMN deleted_at TIMESTAMP;
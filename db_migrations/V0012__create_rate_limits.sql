@@ -0,0 +1,11 @@
+-- Общие корзины токенов для ограничения частоты (common/ratelimit.py): одна строка на ключ вида 'sms_send_phone:+7...'.
+-- UNLOGGED: счётчики не стоят fsync на каждый запрос, а потеря их при аварийном перезапуске безопасна
+CREATE UNLOGGED TABLE t_p33435224_messenger_api_modern.rate_limits (
+    bucket_key TEXT PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,
+    refill_rate DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMP NOT NULL
+);
+
+-- Очистка давно не использованных корзин
+CREATE INDEX idx_rate_limits_updated_at ON t_p33435224_messenger_api_modern.rate_limits(updated_at);
@@ -0,0 +1,15 @@
+-- Одна строка с действующим кодом на телефон: отправка перезаписывает её через ON CONFLICT (phone),
+-- успешная проверка удаляет, просроченные строки удаляет backend/sms/sweeper.py.
+-- Коды живут 5 минут и хранились открытым текстом, поэтому существующие строки не переносятся
+DELETE FROM t_p33435224_messenger_api_modern.verification_codes;
+
+-- Вместо кода хранится HMAC-SHA256 от телефона и кода
+ALTER TABLE t_p33435224_messenger_api_modern.verification_codes
+DROP COLUMN code,
+DROP COLUMN is_used,
+ADD COLUMN code_hash VARCHAR(64) NOT NULL,
+ALTER COLUMN attempts SET NOT NULL;
+
+-- Уникальный индекс по телефону заменяет обычный
+CREATE UNIQUE INDEX idx_verification_codes_phone_unique ON t_p33435224_messenger_api_modern.verification_codes(phone);
+DROP INDEX t_p33435224_messenger_api_modern.idx_verification_codes_phone;
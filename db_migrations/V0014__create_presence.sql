@@ -0,0 +1,10 @@
+-- Отметки присутствия: одна строка на активного пользователя, пишется на каждый heartbeat.
+-- UNLOGGED и отдельно от users, чтобы частые отметки не создавали WAL и конкуренцию за строки горячей таблицы;
+-- после аварийного перезапуска все просто окажутся не в сети до следующей отметки.
+-- users.is_online больше не читается: онлайн — это отметка моложе PRESENCE_TTL
+CREATE UNLOGGED TABLE t_p33435224_messenger_api_modern.presence (
+    user_id INTEGER PRIMARY KEY,
+    seen_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX idx_presence_seen_at ON t_p33435224_messenger_api_modern.presence(seen_at);
@@ -0,0 +1,12 @@
+-- Полнотекстовый поиск по сообщениям: русская морфология плюс конфигурация simple для имён, ников и слов на латинице.
+-- Столбец вычисляемый, поэтому вектор всегда соответствует тексту; добавление переписывает секции сообщений один раз
+ALTER TABLE t_p33435224_messenger_api_modern.messages
+ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+    to_tsvector('russian', message_text) || to_tsvector('simple', message_text)
+) STORED;
+
+-- btree_gin позволяет положить chat_id в тот же GIN-индекс: поиск идёт по чатам пользователя,
+-- и каждый чат проверяется одной выборкой из индекса, а не фильтрацией всех совпадений по базе
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+
+CREATE INDEX idx_messages_chat_search ON t_p33435224_messenger_api_modern.messages USING GIN (chat_id, search_vector);
@@ -0,0 +1,26 @@
+-- Журнал изменений для дельта-синхронизации: строка помечается транзакцией, которая её записала, и номером из общей последовательности.
+-- Курсор клиента — пара (change_xid, change_seq); отдаются только строки завершённых транзакций,
+-- поэтому изменение, закоммиченное позже с меньшим номером, не проскакивает мимо курсора
+CREATE SEQUENCE t_p33435224_messenger_api_modern.change_seq;
+
+-- Столбцы без значения по умолчанию не переписывают секции; существующие строки остаются без метки
+-- и в синхронизацию не попадают: клиент получает курсор до первой полной загрузки
+ALTER TABLE t_p33435224_messenger_api_modern.messages
+ADD COLUMN change_xid xid8,
+ADD COLUMN change_seq BIGINT;
+
+ALTER TABLE t_p33435224_messenger_api_modern.messages
+ALTER COLUMN change_xid SET DEFAULT pg_current_xact_id(),
+ALTER COLUMN change_seq SET DEFAULT nextval('t_p33435224_messenger_api_modern.change_seq');
+
+ALTER TABLE t_p33435224_messenger_api_modern.chat_summary
+ADD COLUMN change_xid xid8,
+ADD COLUMN change_seq BIGINT;
+
+ALTER TABLE t_p33435224_messenger_api_modern.chat_summary
+ALTER COLUMN change_xid SET DEFAULT pg_current_xact_id(),
+ALTER COLUMN change_seq SET DEFAULT nextval('t_p33435224_messenger_api_modern.change_seq');
+
+-- Изменения читаются по чату и по пользователю в порядке курсора
+CREATE INDEX idx_messages_chat_changes ON t_p33435224_messenger_api_modern.messages(chat_id, change_xid, change_seq);
+CREATE INDEX idx_chat_summary_user_changes ON t_p33435224_messenger_api_modern.chat_summary(user_id, change_xid, change_seq);
@@ -0,0 +1,4 @@
+-- Версия профиля для кэша профилей: растёт при каждом изменении username, full_name или avatar_url.
+-- Постоянное значение по умолчанию не переписывает таблицу
+ALTER TABLE t_p33435224_messenger_api_modern.users
+ADD COLUMN profile_version INTEGER NOT NULL DEFAULT 1;
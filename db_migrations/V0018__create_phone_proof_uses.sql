@@ -0,0 +1,8 @@
+-- Использованные подтверждения телефона (phone_token из sms): вход принимает каждое один раз.
+-- Строка нужна, пока подтверждение не истекло; просроченные удаляет backend/sms/sweeper.py
+CREATE TABLE t_p33435224_messenger_api_modern.phone_proof_uses (
+    nonce VARCHAR(32) PRIMARY KEY,
+    expires_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX idx_phone_proof_uses_expires ON t_p33435224_messenger_api_modern.phone_proof_uses(expires_at);
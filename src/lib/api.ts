@@ -5,6 +5,15 @@ const API_URLS = {
   sms: 'https://functions.poehali.dev/58533b13-5bd0-4ce1-825a-0eb4027d637f',
 };
 
+const STREAM_URL: string | undefined = import.meta.env.VITE_MESSAGES_STREAM_URL;
+
+let authToken: string | null = localStorage.getItem('token');
+
+const authHeaders = (userId: number): Record<string, string> => ({
+  'X-User-Id': userId.toString(),
+  ...(authToken ? { 'X-Auth-Token': authToken } : {}),
+});
+
 export type User = {
   id: number;
   username: string | null;
@@ -26,6 +35,7 @@ export type Chat = {
   full_name: string | null;
   avatar_url: string | null;
   is_online: boolean;
+  last_seen: string | null;
   last_message: string | null;
   last_message_time: string | null;
   unread_count: number;
@@ -40,6 +50,76 @@ export type Message = {
   sender_username: string;
 };
 
+export type MessagePage = {
+  messages: Message[];
+  has_more: boolean;
+  before: string | null;
+  after: string | null;
+};
+
+export type PageParams = {
+  before?: string;
+  after?: string;
+  limit?: number;
+};
+
+export type ChatChange = {
+  chat_id: number;
+  user_id: number;
+  last_message_id: number | null;
+  last_message: string | null;
+  last_message_time: string | null;
+  unread_count: number;
+  peer_last_read_message_id: number | null;
+};
+
+export type MessageChange = {
+  id: number;
+  chat_id: number;
+  sender_id: number;
+  sent_at: string;
+  message_text: string | null;
+  deleted: boolean;
+};
+
+export type SyncBatch = {
+  messages: MessageChange[];
+  chats: ChatChange[];
+  has_more: boolean;
+  cursor: string;
+};
+
+export type SearchHit = {
+  id: number;
+  chat_id: number;
+  sent_at: string;
+  rank: number;
+  snippet: string;
+  sender_id: number;
+  sender_username: string;
+};
+
+export type SearchPage = {
+  hits: SearchHit[];
+  has_more: boolean;
+  next: string | null;
+};
+
+export type SearchParams = {
+  chatId?: number;
+  before?: string;
+  limit?: number;
+};
+
+export type StreamMessage = {
+  id: number;
+  chat_id: number;
+  message_text: string;
+  sent_at: string;
+  sender_id: number;
+  sender_username: string;
+};
+
 export type Report = {
   id: number;
   reported_username: string;
@@ -49,7 +129,69 @@ export type Report = {
   created_at: string;
 };
 
+export type ReportStatus = 'pending' | 'reviewed' | 'resolved' | 'rejected';
+
+export type ReportGroup = {
+  reported_user_id: number;
+  reported_username: string;
+  report_count: number;
+  reporter_count: number;
+  first_reported_at: string;
+  last_reported_at: string;
+  report_ids: number[];
+  reasons: string[];
+};
+
+export type ReportQuery = {
+  status?: ReportStatus;
+  before?: string;
+  limit?: number;
+};
+
+export type BulkReportAction = {
+  report_ids: number[];
+  status?: Exclude<ReportStatus, 'pending'>;
+  suspend_users?: boolean;
+  delete_messages_hours?: number;
+};
+
+export type BulkReportResult = {
+  reports_updated: number;
+  users_reported: number;
+  users_suspended: number;
+  messages_deleted: number;
+};
+
+export type ReportPage = {
+  reports: Report[];
+  next: string | null;
+  counts: Partial<Record<ReportStatus, number>>;
+};
+
+export type ReportGroupPage = {
+  groups: ReportGroup[];
+  next: string | null;
+  counts: Partial<Record<ReportStatus, number>>;
+};
+
+const reportParams = (query: ReportQuery): URLSearchParams => {
+  const params = new URLSearchParams();
+  if (query.status) params.set('status', query.status);
+  if (query.before) params.set('before', query.before);
+  if (query.limit) params.set('limit', query.limit.toString());
+  return params;
+};
+
 export const api = {
+  setAuthToken(token: string | null) {
+    authToken = token;
+    if (token) {
+      localStorage.setItem('token', token);
+    } else {
+      localStorage.removeItem('token');
+    }
+  },
+
   async sendSmsCode(phone: string): Promise<{ message: string; dev_code?: string }> {
     const response = await fetch(API_URLS.sms, {
       method: 'POST',
@@ -65,7 +207,7 @@ export const api = {
     return response.json();
   },
 
-  async verifySmsCode(phone: string, code: string): Promise<{ verified: boolean }> {
+  async verifySmsCode(phone: string, code: string): Promise<{ verified: boolean; phone_token?: string | null }> {
     const response = await fetch(API_URLS.sms, {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
@@ -80,11 +222,16 @@ export const api = {
     return response.json();
   },
 
-  async register(phone: string, username: string, full_name: string): Promise<AuthResponse> {
+  async register(phone: string, username: string, full_name: string, phoneToken?: string | null, idempotencyKey?: string): Promise<AuthResponse> {
+    // Повтор с тем же ключом возвращает тот же ответ, а не повторную регистрацию
     const response = await fetch(API_URLS.auth, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ phone, username, full_name }),
+      headers: {
+        'Content-Type': 'application/json',
+        ...(idempotencyKey ? { 'Idempotency-Key': idempotencyKey } : {}),
+      },
+      // phone_token из verifySmsCode подтверждает телефон, без него сервер с секретом токен не выдаст
+      body: JSON.stringify({ phone, username, full_name, phone_token: phoneToken }),
     });
     
     if (!response.ok) {
@@ -95,6 +242,41 @@ export const api = {
     return response.json();
   },
 
+  async loginWithPassword(username: string, password: string): Promise<AuthResponse> {
+    // Для учётных записей без телефона; пароль задаётся на сервере (backend/auth/passwords.py)
+    const response = await fetch(API_URLS.auth, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ username, password }),
+    });
+
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.error || 'Login failed');
+    }
+
+    return response.json();
+  },
+
+  async updateProfile(userId: number, changes: Partial<Pick<User, 'username' | 'full_name' | 'avatar_url'>>): Promise<User> {
+    const response = await fetch(API_URLS.auth, {
+      method: 'PUT',
+      headers: {
+        'Content-Type': 'application/json',
+        ...authHeaders(userId),
+      },
+      body: JSON.stringify(changes),
+    });
+    
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.error || 'Profile update failed');
+    }
+    
+    const data = await response.json();
+    return data.user;
+  },
+
   async searchUsers(query: string): Promise<User[]> {
     const response = await fetch(`${API_URLS.auth}?q=${encodeURIComponent(query)}`);
     
@@ -108,7 +290,7 @@ export const api = {
 
   async getChats(userId: number): Promise<Chat[]> {
     const response = await fetch(API_URLS.messages, {
-      headers: { 'X-User-Id': userId.toString() },
+      headers: authHeaders(userId),
     });
     
     if (!response.ok) {
@@ -120,16 +302,58 @@ export const api = {
   },
 
   async getMessages(userId: number, chatId: number): Promise<Message[]> {
-    const response = await fetch(`${API_URLS.messages}?chat_id=${chatId}`, {
-      headers: { 'X-User-Id': userId.toString() },
+    const page = await api.getMessagesPage(userId, chatId);
+    return page.messages;
+  },
+
+  async getMessagesPage(userId: number, chatId: number, page: PageParams = {}): Promise<MessagePage> {
+    const params = new URLSearchParams({ chat_id: chatId.toString() });
+    if (page.before) params.set('before', page.before);
+    if (page.after) params.set('after', page.after);
+    if (page.limit) params.set('limit', page.limit.toString());
+
+    const response = await fetch(`${API_URLS.messages}?${params}`, {
+      headers: authHeaders(userId),
     });
     
     if (!response.ok) {
       throw new Error('Failed to load messages');
     }
     
-    const data = await response.json();
-    return data.messages;
+    return response.json();
+  },
+
+  async syncChanges(userId: number, cursor: string | null = null, limit?: number): Promise<SyncBatch> {
+    // Без курсора сервер возвращает только курсор: его нужно взять до полной загрузки чатов
+    const params = new URLSearchParams({ sync: cursor ?? '' });
+    if (limit) params.set('limit', limit.toString());
+
+    const response = await fetch(`${API_URLS.messages}?${params}`, {
+      headers: authHeaders(userId),
+    });
+    
+    if (!response.ok) {
+      throw new Error('Sync failed');
+    }
+    
+    return response.json();
+  },
+
+  async searchMessages(userId: number, query: string, search: SearchParams = {}): Promise<SearchPage> {
+    const params = new URLSearchParams({ q: query });
+    if (search.chatId) params.set('chat_id', search.chatId.toString());
+    if (search.before) params.set('before', search.before);
+    if (search.limit) params.set('limit', search.limit.toString());
+
+    const response = await fetch(`${API_URLS.messages}?${params}`, {
+      headers: authHeaders(userId),
+    });
+    
+    if (!response.ok) {
+      throw new Error('Search failed');
+    }
+    
+    return response.json();
   },
 
   async sendMessage(userId: number, recipientId: number, messageText: string): Promise<{ message: any; chat_id: number }> {
@@ -137,7 +361,7 @@ export const api = {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
-        'X-User-Id': userId.toString(),
+        ...authHeaders(userId),
       },
       body: JSON.stringify({ recipient_id: recipientId, message_text: messageText }),
     });
@@ -149,12 +373,47 @@ export const api = {
     return response.json();
   },
 
+  async heartbeat(userId: number): Promise<void> {
+    await fetch(API_URLS.messages, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        ...authHeaders(userId),
+      },
+      body: JSON.stringify({ action: 'heartbeat' }),
+    });
+  },
+
+  subscribeMessages(userId: number, onMessage: (message: StreamMessage) => void): () => void {
+    if (!STREAM_URL || typeof EventSource === 'undefined') {
+      return () => {};
+    }
+
+    // EventSource сам переподключается и передаёт Last-Event-ID, сервер досылает пропущенное
+    const params = new URLSearchParams({ user_id: userId.toString() });
+    if (authToken) params.set('token', authToken);
+    const source = new EventSource(`${STREAM_URL}/events?${params}`);
+    source.addEventListener('message', (event) => {
+      onMessage(JSON.parse((event as MessageEvent).data));
+    });
+
+    return () => source.close();
+  },
+
+  chatExportUrl(userId: number, chatId: number): string | null {
+    // Полная история чата потоком: {chat_id, participants, columns, rows: [[...], ...]}
+    if (!STREAM_URL) return null;
+    const params = new URLSearchParams({ chat_id: chatId.toString(), user_id: userId.toString() });
+    if (authToken) params.set('token', authToken);
+    return `${STREAM_URL}/export?${params}`;
+  },
+
   async submitReport(userId: number, reportedUserId: number, reason: string): Promise<void> {
     const response = await fetch(API_URLS.moderation, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
-        'X-User-Id': userId.toString(),
+        ...authHeaders(userId),
       },
       body: JSON.stringify({ reported_user_id: reportedUserId, reason }),
     });
@@ -165,16 +424,51 @@ export const api = {
   },
 
   async getReports(userId: number): Promise<Report[]> {
-    const response = await fetch(API_URLS.moderation, {
-      headers: { 'X-User-Id': userId.toString() },
+    const page = await api.getReportsPage(userId);
+    return page.reports;
+  },
+
+  async getReportsPage(userId: number, query: ReportQuery = {}): Promise<ReportPage> {
+    const response = await fetch(`${API_URLS.moderation}?${reportParams(query)}`, {
+      headers: authHeaders(userId),
     });
     
     if (!response.ok) {
       throw new Error('Failed to load reports');
     }
     
-    const data = await response.json();
-    return data.reports;
+    return response.json();
+  },
+
+  async getReportGroups(userId: number, query: ReportQuery = {}): Promise<ReportGroupPage> {
+    const params = reportParams(query);
+    params.set('view', 'grouped');
+    const response = await fetch(`${API_URLS.moderation}?${params}`, {
+      headers: authHeaders(userId),
+    });
+    
+    if (!response.ok) {
+      throw new Error('Failed to load reports');
+    }
+    
+    return response.json();
+  },
+
+  async bulkReportAction(userId: number, action: BulkReportAction): Promise<BulkReportResult> {
+    const response = await fetch(API_URLS.moderation, {
+      method: 'PUT',
+      headers: {
+        'Content-Type': 'application/json',
+        ...authHeaders(userId),
+      },
+      body: JSON.stringify(action),
+    });
+    
+    if (!response.ok) {
+      throw new Error('Failed to apply moderation action');
+    }
+    
+    return response.json();
   },
 
   async resolveReport(userId: number, reportId: number, status: string): Promise<void> {
@@ -182,7 +476,7 @@ export const api = {
       method: 'PUT',
       headers: {
         'Content-Type': 'application/json',
-        'X-User-Id': userId.toString(),
+        ...authHeaders(userId),
       },
       body: JSON.stringify({ report_id: reportId, status }),
     });
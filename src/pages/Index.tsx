@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { Avatar, AvatarFallback, AvatarImage } from '@/components/ui/avatar';
 import { Button } from '@/components/ui/button';
 import { Input } from '@/components/ui/input';
@@ -18,7 +18,7 @@ import {
 import { Label } from '@/components/ui/label';
 import { Switch } from '@/components/ui/switch';
 import { useToast } from '@/hooks/use-toast';
-import { api, User, Chat as ApiChat, Message as ApiMessage, Report as ApiReport } from '@/lib/api';
+import { api, User, Chat as ApiChat, Message as ApiMessage, Report as ApiReport, SyncBatch } from '@/lib/api';
 
 const Index = () => {
   const { toast } = useToast();
@@ -27,8 +27,10 @@ const Index = () => {
   const [smsCode, setSmsCode] = useState('');
   const [username, setUsername] = useState('');
   const [fullName, setFullName] = useState('');
-  const [step, setStep] = useState<'phone' | 'code' | 'profile'>('phone');
+  const [step, setStep] = useState<'phone' | 'code' | 'profile' | 'password'>('phone');
+  const [password, setPassword] = useState('');
   const [devCode, setDevCode] = useState('');
+  const [phoneToken, setPhoneToken] = useState<string | null>(null);
   
   const [selectedChat, setSelectedChat] = useState<ApiChat | null>(null);
   const [messageInput, setMessageInput] = useState('');
@@ -40,10 +42,14 @@ const Index = () => {
   const [contacts, setContacts] = useState<User[]>([]);
   const [reports, setReports] = useState<ApiReport[]>([]);
   const [isLoading, setIsLoading] = useState(false);
+  const syncCursor = useRef<string | null>(null);
+  // Курсор before для подгрузки более ранних сообщений открытого чата; null — история загружена целиком
+  const [olderCursor, setOlderCursor] = useState<string | null>(null);
+  const historyChatId = useRef<number | null>(null);
 
   useEffect(() => {
     if (currentUser) {
-      loadChats();
+      startSync();
     }
   }, [currentUser]);
 
@@ -53,6 +59,24 @@ const Index = () => {
     }
   }, [selectedChat]);
 
+  useEffect(() => {
+    if (!currentUser) return;
+    return api.subscribeMessages(currentUser.id, (message) => {
+      if (selectedChat && message.chat_id === selectedChat.chat_id) {
+        setMessages((prev) => (prev.some((m) => m.id === message.id) ? prev : [...prev, { ...message, is_read: false }]));
+      }
+      syncChats();
+    });
+  }, [currentUser, selectedChat]);
+
+  useEffect(() => {
+    if (!currentUser) return;
+    // Онлайн-статус держится отметками; при открытом потоке их дополнительно ставит сервер потока
+    api.heartbeat(currentUser.id).catch(() => {});
+    const timer = setInterval(() => api.heartbeat(currentUser.id).catch(() => {}), 30000);
+    return () => clearInterval(timer);
+  }, [currentUser]);
+
   useEffect(() => {
     if (searchQuery && currentUser) {
       searchUsers();
@@ -89,7 +113,8 @@ const Index = () => {
 
     setIsLoading(true);
     try {
-      await api.verifySmsCode(phone, smsCode);
+      const result = await api.verifySmsCode(phone, smsCode);
+      setPhoneToken(result.phone_token ?? null);
       setStep('profile');
       toast({ title: 'Успех', description: 'Телефон подтвержден' });
     } catch (error: any) {
@@ -99,10 +124,27 @@ const Index = () => {
     }
   };
 
+  const handlePasswordLogin = async () => {
+    setIsLoading(true);
+    try {
+      const result = await api.loginWithPassword(username, password);
+      setPassword('');
+      api.setAuthToken(result.token);
+      setCurrentUser(result.user);
+      localStorage.setItem('user', JSON.stringify(result.user));
+      toast({ title: 'Успех', description: 'Вы вошли в систему' });
+    } catch (error: any) {
+      toast({ title: 'Ошибка', description: error.message, variant: 'destructive' });
+    } finally {
+      setIsLoading(false);
+    }
+  };
+
   const handleRegister = async () => {
     setIsLoading(true);
     try {
-      const result = await api.register(phone, username, fullName || username || phone);
+      const result = await api.register(phone, username, fullName || username || phone, phoneToken);
+      api.setAuthToken(result.token);
       setCurrentUser(result.user);
       localStorage.setItem('user', JSON.stringify(result.user));
       toast({ title: 'Успех', description: 'Вы вошли в систему' });
@@ -123,16 +165,97 @@ const Index = () => {
     }
   };
 
+  const startSync = async () => {
+    if (!currentUser) return;
+    // Курсор берётся до полной загрузки: всё, что изменится во время загрузки, придёт синхронизацией
+    try {
+      syncCursor.current = (await api.syncChanges(currentUser.id)).cursor;
+    } catch (error) {
+      syncCursor.current = null;
+    }
+    await loadChats();
+  };
+
+  const syncChats = async () => {
+    if (!currentUser) return;
+    if (!syncCursor.current) {
+      await startSync();
+      return;
+    }
+    try {
+      let batch: SyncBatch;
+      do {
+        batch = await api.syncChanges(currentUser.id, syncCursor.current);
+        applySync(batch);
+        syncCursor.current = batch.cursor;
+      } while (batch.has_more);
+    } catch (error) {
+      console.error('Sync failed:', error);
+    }
+  };
+
+  const applySync = (batch: SyncBatch) => {
+    // Новый чат приходит без профиля собеседника: его проще перечитать списком
+    if (batch.chats.some((change) => !chats.some((chat) => chat.chat_id === change.chat_id))) {
+      loadChats();
+    }
+    setChats((prev) => {
+      const byId = new Map(prev.map((chat) => [chat.chat_id, chat]));
+      for (const change of batch.chats) {
+        const chat = byId.get(change.chat_id);
+        if (!chat) continue;
+        byId.set(change.chat_id, {
+          ...chat,
+          last_message: change.last_message,
+          last_message_time: change.last_message_time,
+          unread_count: change.unread_count,
+        });
+      }
+      return [...byId.values()].sort((a, b) => (b.last_message_time ?? '').localeCompare(a.last_message_time ?? ''));
+    });
+
+    if (!selectedChat) return;
+    const chatId = selectedChat.chat_id;
+    const peerRead = batch.chats.find((change) => change.chat_id === chatId)?.peer_last_read_message_id ?? null;
+    setMessages((prev) => {
+      const deleted = new Set(batch.messages.filter((m) => m.chat_id === chatId && m.deleted).map((m) => m.id));
+      return prev
+        .filter((m) => !deleted.has(m.id))
+        .map((m) => (peerRead !== null && m.sender_id === currentUser?.id && m.id <= peerRead ? { ...m, is_read: true } : m));
+    });
+  };
+
   const loadMessages = async (chatId: number) => {
     if (!currentUser) return;
+    historyChatId.current = chatId;
+    setOlderCursor(null);
     try {
-      const data = await api.getMessages(currentUser.id, chatId);
-      setMessages(data);
+      const page = await api.getMessagesPage(currentUser.id, chatId);
+      if (historyChatId.current !== chatId) return;
+      setMessages(page.messages);
+      setOlderCursor(page.has_more ? page.before : null);
     } catch (error) {
       console.error('Failed to load messages:', error);
     }
   };
 
+  const loadOlderMessages = async () => {
+    const chatId = historyChatId.current;
+    if (!currentUser || chatId === null || !olderCursor) return;
+    try {
+      const page = await api.getMessagesPage(currentUser.id, chatId, { before: olderCursor });
+      // Пока страница грузилась, мог открыться другой чат
+      if (historyChatId.current !== chatId) return;
+      setMessages((prev) => {
+        const known = new Set(prev.map((m) => m.id));
+        return [...page.messages.filter((m) => !known.has(m.id)), ...prev];
+      });
+      setOlderCursor(page.has_more ? page.before : null);
+    } catch (error) {
+      console.error('Failed to load older messages:', error);
+    }
+  };
+
   const searchUsers = async () => {
     try {
       const users = await api.searchUsers(searchQuery);
@@ -210,6 +333,37 @@ const Index = () => {
               <Button onClick={handleSendCode} className="w-full" disabled={isLoading}>
                 {isLoading ? 'Отправка...' : 'Получить код'}
               </Button>
+              <Button onClick={() => setStep('password')} variant="outline" className="w-full">
+                Войти по паролю
+              </Button>
+            </div>
+          )}
+
+          {step === 'password' && (
+            <div className="space-y-4">
+              <div>
+                <Label htmlFor="login-username">Имя пользователя</Label>
+                <Input
+                  id="login-username"
+                  value={username}
+                  onChange={(e) => setUsername(e.target.value)}
+                />
+              </div>
+              <div>
+                <Label htmlFor="login-password">Пароль</Label>
+                <Input
+                  id="login-password"
+                  type="password"
+                  value={password}
+                  onChange={(e) => setPassword(e.target.value)}
+                />
+              </div>
+              <Button onClick={handlePasswordLogin} className="w-full" disabled={isLoading || !username || !password}>
+                {isLoading ? 'Вход...' : 'Войти'}
+              </Button>
+              <Button onClick={() => setStep('phone')} variant="outline" className="w-full">
+                Назад
+              </Button>
             </div>
           )}
 
@@ -307,6 +461,7 @@ const Index = () => {
                       className="w-full"
                       onClick={() => {
                         localStorage.removeItem('user');
+                        api.setAuthToken(null);
                         setCurrentUser(null);
                       }}
                     >
@@ -487,6 +642,11 @@ const Index = () => {
 
             <ScrollArea className="flex-1 p-4">
               <div className="space-y-4">
+                {olderCursor && (
+                  <Button variant="ghost" size="sm" className="w-full" onClick={loadOlderMessages}>
+                    Загрузить более ранние
+                  </Button>
+                )}
                 {messages.map((message) => (
                   <div
                     key={message.id}
@@ -0,0 +1,81 @@
+"""Проверки backend/messages/partitions.py на живой БД
+
+Запуск: TEST_DATABASE_URL=postgres://... python -m pytest tests
+Каждая проверка работает в своей временной схеме со своей таблицей messages.
+"""
+import importlib.util
+import os
+import uuid
+from datetime import date, datetime
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DSN = os.environ.get('TEST_DATABASE_URL')
+
+pytestmark = pytest.mark.skipif(not DSN, reason='TEST_DATABASE_URL is not configured')
+
+def load_partitions():
+    spec = importlib.util.spec_from_file_location('partitions', os.path.join(ROOT, 'backend', 'messages', 'partitions.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+@pytest.fixture
+def conn():
+    schema = f'test_partitions_{uuid.uuid4().hex[:8]}'
+    conn = psycopg2.connect(DSN)
+    with conn.cursor() as cur:
+        cur.execute(f'CREATE SCHEMA {schema}')
+        cur.execute(f'SET search_path TO {schema}')
+        # Та же форма, что после V0008 и V0015: составной ключ, секция по умолчанию, вычисляемый search_vector
+        cur.execute("""
+            CREATE TABLE messages (
+                id BIGSERIAL,
+                chat_id INTEGER NOT NULL,
+                sender_id INTEGER NOT NULL,
+                message_text TEXT NOT NULL,
+                sent_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                deleted_at TIMESTAMP,
+                search_vector tsvector GENERATED ALWAYS AS (
+                    to_tsvector('russian', message_text) || to_tsvector('simple', message_text)
+                ) STORED,
+                PRIMARY KEY (id, sent_at)
+            ) PARTITION BY RANGE (sent_at)
+        """)
+        cur.execute('CREATE TABLE messages_default PARTITION OF messages DEFAULT')
+    conn.commit()
+    try:
+        yield conn
+    finally:
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute(f'DROP SCHEMA {schema} CASCADE')
+        conn.commit()
+        conn.close()
+
+def test_rows_in_default_partition_move_to_new_month(conn):
+    partitions = load_partitions()
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO messages (chat_id, sender_id, message_text, sent_at) VALUES (1, 1, 'привет мир', %s), (1, 2, 'позже', %s)",
+            (datetime(2024, 3, 10, 12, 0), datetime(2024, 5, 1, 0, 0))
+        )
+    conn.commit()
+
+    created = partitions.ensure_partitions(conn, date(2024, 3, 1), date(2024, 4, 1))
+
+    assert created == ['messages_y2024m03', 'messages_y2024m04']
+    with conn.cursor() as cur:
+        cur.execute("SELECT tableoid::regclass::text, search_vector @@ to_tsquery('simple', 'мир') FROM messages WHERE sent_at < '2024-04-01'")
+        assert cur.fetchall() == [('messages_y2024m03', True)]
+        cur.execute("SELECT COUNT(*) FROM messages_default")
+        assert cur.fetchone()[0] == 1
+        cur.execute("SELECT attgenerated FROM pg_attribute WHERE attrelid = 'messages_y2024m03'::regclass AND attname = 'search_vector'")
+        assert cur.fetchone()[0] == 's'
+
+def test_existing_partitions_are_skipped(conn):
+    partitions = load_partitions()
+    assert partitions.ensure_partitions(conn, date(2024, 1, 1), date(2024, 1, 1)) == ['messages_y2024m01']
+    assert partitions.ensure_partitions(conn, date(2024, 1, 1), date(2024, 2, 1)) == ['messages_y2024m02']
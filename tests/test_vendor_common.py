@@ -0,0 +1,20 @@
+"""Копии backend/common в каталогах функций совпадают с оригиналом
+
+Запуск: python -m pytest tests
+"""
+import importlib.util
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_vendor():
+    spec = importlib.util.spec_from_file_location('vendor_common', os.path.join(ROOT, 'backend', 'vendor_common.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def test_function_copies_match_common():
+    vendor = load_vendor()
+    assert vendor.functions()
+    for function in vendor.functions():
+        assert vendor.stale(function) == [], f'run python backend/vendor_common.py ({function})'